@@ -11,10 +11,11 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QHeaderView, QDialog, QDialogButtonBox, QInputDialog,
                              QAction, QMenu, QToolBar, QStatusBar, QCheckBox,
                              QGridLayout, QProgressBar)
-from PyQt5.QtCore import Qt, QSettings, QTranslator, QLocale, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QSettings, QTranslator, QLocale, QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import QIcon, QPalette, QColor
 import marlib
 from marlib import database, file_operations
+from marlib.compaction import BackgroundCompactor
 
 class ServerConnectionThread(QThread):
     """Поток для проверки соединения с сервером"""
@@ -109,6 +110,10 @@ class DatabaseApp(QMainWindow):
         self.current_table = None
         self.db_client = None  # Клиент для работы с базой
         self.connection_mode = "local"  # Режим подключения
+        self.compactor = None  # Фоновая дефрагментация в локальном режиме
+        self.defrag_timer = QTimer(self)  # Опрос завершения фоновой дефрагментации
+        self.defrag_timer.timeout.connect(self.check_defragmentation)
+        self.defrag_db = None
         self.settings = QSettings("MARSoft", "DatabaseManager")
         self.translator = QTranslator()
         self.initUI()
@@ -551,21 +556,42 @@ class DatabaseApp(QMainWindow):
                 return
                 
             if self.connection_mode == "local":
-                # Локальная дефрагментация
-                table_files = database.get_table_files(self.current_db)
-                for table_id, files in table_files.items():
-                    for file_name in files:
-                        file_operations.defragment_file(file_name)
+                # Локальная дефрагментация идет в фоне, интерфейс не блокируется
+                if self.compactor is None or not self.compactor.is_alive():
+                    self.compactor = BackgroundCompactor(self.current_db, 0, run_once=True).start()
             else:
                 # Серверная дефрагментация
-                self.db_client.defragment_database(self.current_db)
+                self.db_client.defragment_database(self.current_db, background=True)
             
-            QMessageBox.information(self, self.tr("Успех"), self.tr("База данных дефрагментирована"))
-            self.statusBar().showMessage(self.tr("База данных дефрагментирована"))
+            # О завершении сообщает опрос состояния сжатия
+            self.defrag_db = self.current_db
+            self.defrag_timer.start(500)
+            self.statusBar().showMessage(self.tr("Дефрагментация базы данных запущена"))
             
         except Exception as e:
             QMessageBox.critical(self, self.tr("Ошибка"), self.tr("Не удалось дефрагментировать базу данных: {0}").format(str(e)))
             
+    def check_defragmentation(self):
+        # Проверка завершения фоновой дефрагментации
+        try:
+            if self.connection_mode == "local":
+                status = self.compactor.get_status() if self.compactor else {'running': False, 'stats': None}
+            else:
+                status = self.db_client.get_compaction_status(self.defrag_db)
+        except Exception as e:
+            self.defrag_timer.stop()
+            QMessageBox.critical(self, self.tr("Ошибка"), self.tr("Не удалось дефрагментировать базу данных: {0}").format(str(e)))
+            return
+        
+        if status['running']:
+            return
+        
+        self.defrag_timer.stop()
+        reclaimed = status['stats']['bytes_reclaimed'] if status['stats'] else 0
+        message = self.tr("База данных дефрагментирована, освобождено байт: {0}").format(reclaimed)
+        self.statusBar().showMessage(message)
+        QMessageBox.information(self, self.tr("Успех"), message)
+            
     def load_tables(self):
         # Загрузка списка таблиц
         try:
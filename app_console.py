@@ -1,6 +1,7 @@
 import sys
 import os
 import json
+import itertools
 from marlib import database, file_operations
 from simple_term_menu import TerminalMenu
 from colorama import init, Fore, Back, Style
@@ -390,13 +391,15 @@ class ConsoleDatabaseApp:
                 return
         
         try:
-            records = database.select_from_table(self.current_db, self.current_table)
-            
             self.show_header()
             print(Fore.YELLOW + f"Table: {self.current_table}")
             print()
             
-            if not records:
+            # Записи читаются потоком, поэтому таблица не загружается в память целиком
+            records = database.iter_table(self.current_db, self.current_table)
+            first_record = next(records, None)
+            
+            if first_record is None:
                 print(Fore.YELLOW + "No records found in table!")
                 self.wait_for_enter()
                 return
@@ -421,7 +424,7 @@ class ConsoleDatabaseApp:
                 print(Fore.CYAN + "-" * (len(" | ".join(headers)) + 10))
             
             # Выводим записи
-            for record in records:
+            for record in itertools.chain([first_record], records):
                 cords, data_type, data_len, data, reversed_size = record
                 row = [str(coord) for coord in cords] + [str(data)]
                 print(Fore.WHITE + " | ".join(row))
@@ -438,14 +441,11 @@ class ConsoleDatabaseApp:
             return
         
         try:
-            # Получаем все файлы таблиц
-            table_files = database.get_table_files(self.current_db)
-            
-            for table_id, files in table_files.items():
-                for file_name in files:
-                    file_operations.defragment_file(file_name)
+            # Сжимаются только файлы, в которых есть мертвые байты
+            stats = database.defragment_database(self.current_db, threshold=0)
             
-            self.show_success(self.translate("defrag_complete"))
+            self.show_success(self.translate("defrag_complete") +
+                              f" ({stats['bytes_reclaimed']} B, {stats['elapsed']:.2f} s)")
                 
         except Exception as e:
             self.show_error(str(e))
@@ -0,0 +1,71 @@
+"""Сравнение последовательного и параллельного чтения таблицы (select_from_table с workers)"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import importlib.util
+from pathlib import Path
+
+
+def load_database():
+    """Импортирует marlib.database из установленного пакета или из этого репозитория"""
+    try:
+        from marlib import database
+        return database
+    except ImportError:
+        pass
+
+    root = Path(__file__).resolve().parent.parent
+    spec = importlib.util.spec_from_file_location('marlib', root / '__init__.py',
+                                                  submodule_search_locations=[str(root)])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules['marlib'] = package
+    spec.loader.exec_module(package)
+    from marlib import database
+    return database
+
+
+def make_record(i):
+    """Запись с вложенными данными: ее распаковка занимает процессор"""
+    return {'id': f'{i}', 'name': f'row {i}', 'scores': [i * 0.5, i * 0.25, i * 0.125],
+            'tags': ['a', 'b', 'c'], 'nested': {'x': i * 1.5, 'y': -i * 1.5, 'label': f'point {i}'}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sequential and parallel table scans')
+    parser.add_argument('--rows', type=int, default=50000, help='Rows in the table')
+    parser.add_argument('--segment', type=int, default=5000, help='Rows per segment file')
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4], help='Process counts to compare')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions (best is reported)')
+    args = parser.parse_args()
+
+    database = load_database()
+    print(f"cpu cores: {os.cpu_count()}, rows: {args.rows}, segment files: {-(-args.rows // args.segment)}")
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        database.create_database('bench.marm')
+        database.create_table('bench.marm', 'scan', ['x', 'y'], cases_in_file=args.segment)
+        database.insert_many('bench.marm', 'scan', (([i // 1000, i % 1000], make_record(i)) for i in range(args.rows)))
+
+        baseline = None
+        for workers in [0] + args.workers:
+            # Первый проход запускает пул процессов и не учитывается
+            database.select_from_table('bench.marm', 'scan', workers=workers)
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                records = database.select_from_table('bench.marm', 'scan', workers=workers)
+                # Данные последовательного чтения десериализуются при первом обращении
+                for record in records:
+                    record.data
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            baseline = baseline or best
+            print(f"workers {workers:>2}: {best:8.3f} s, {args.rows / best:10.0f} rows/s, "
+                  f"{baseline / best:5.2f}x")
+        database.shutdown_scan_pools()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Сравнение serialize_data (таблица кодировщиков, один bytearray) с прежним рекурсивным сериализатором"""
+import io
+import re
+import sys
+import enum
+import uuid
+import array
+import types
+import pickle
+import struct
+import timeit
+import decimal
+import weakref
+import argparse
+import datetime
+import fractions
+import collections
+import importlib.util
+from pathlib import Path
+
+
+def load_serialization():
+    """Импортирует marlib.serialization из установленного пакета или из этого репозитория"""
+    try:
+        from marlib import serialization
+        return serialization
+    except ImportError:
+        pass
+
+    root = Path(__file__).resolve().parent.parent
+    spec = importlib.util.spec_from_file_location('marlib', root / '__init__.py',
+                                                  submodule_search_locations=[str(root)])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules['marlib'] = package
+    spec.loader.exec_module(package)
+    from marlib import serialization
+    return serialization
+
+
+serialization = load_serialization()
+
+
+def serialize_data_recursive(data, len_size=2):
+    """Прежний сериализатор на цепочке условий: эталон формата и скорости для serialize_data"""
+    data_type = type(data)
+
+    if data_type not in serialization.PYTHON_TYPE_TO_BYTE:
+        raise TypeError(f"Неподдерживаемый тип: {data_type}")
+
+    type_byte = serialization.PYTHON_TYPE_TO_BYTE[data_type]
+
+    # Простые типы данных
+    if data_type is str:
+        encoded = data.encode('utf-8')
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif data_type is int:
+        # Для нуля используем 1 байт
+        if data == 0:
+            byte_repr = b'\x00'
+        else:
+            byte_repr = data.to_bytes((data.bit_length() + 7) // 8, 'big', signed=True)
+        return type_byte + len(byte_repr).to_bytes(len_size, 'big') + byte_repr
+    elif data_type is float:
+        encoded = struct.pack('!d', data)
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif data_type is bool:
+        encoded = b'\x01' if data else b'\x00'
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif data_type is bytes:
+        return type_byte + len(data).to_bytes(len_size, 'big') + data
+    elif data_type is bytearray:
+        return type_byte + len(data).to_bytes(len_size, 'big') + bytes(data)
+    elif data_type is complex:
+        encoded = struct.pack('!dd', data.real, data.imag)
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif data is None:
+        return type_byte + b'\x00' * len_size
+
+    # Коллекции
+    elif data_type in (list, tuple, set, frozenset, collections.deque):
+        items = b''.join(serialize_data_recursive(item, len_size) for item in data)
+        return type_byte + len(items).to_bytes(len_size, 'big') + items
+    elif data_type in (dict, collections.defaultdict, collections.OrderedDict, collections.Counter):
+        items = b''.join(serialize_data_recursive(k, len_size) + serialize_data_recursive(v, len_size)
+                         for k, v in data.items())
+        return type_byte + len(items).to_bytes(len_size, 'big') + items
+    elif data_type is collections.ChainMap:
+        items = serialize_data_recursive(list(data.maps), len_size)
+        return type_byte + len(items).to_bytes(len_size, 'big') + items
+
+    # Специальные типы
+    elif data_type is array.array:
+        return type_byte + len(data).to_bytes(len_size, 'big') + data.tobytes()
+    elif data_type in (datetime.date, datetime.datetime, datetime.time):
+        encoded = data.isoformat().encode('utf-8')
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif data_type is datetime.timedelta:
+        encoded = struct.pack('!d', data.total_seconds())
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif data_type is decimal.Decimal:
+        encoded = str(data).encode('utf-8')
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif data_type is uuid.UUID:
+        return type_byte + len(data.bytes).to_bytes(len_size, 'big') + data.bytes
+    elif data_type in (re.Pattern, re.Match, types.FunctionType, types.GeneratorType, types.CoroutineType):
+        encoded = pickle.dumps(data)
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif data_type in (io.StringIO, io.BytesIO):
+        encoded = serialize_data_recursive(data.getvalue(), len_size)
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif data_type is Path:
+        encoded = str(data).encode('utf-8')
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif isinstance(data, (enum.Enum, enum.Flag)):
+        encoded = serialize_data_recursive(data.value, len_size)
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif data_type is fractions.Fraction:
+        encoded = (serialize_data_recursive(data.numerator, len_size) +
+                   serialize_data_recursive(data.denominator, len_size))
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif data_type is memoryview:
+        return type_byte + len(data).to_bytes(len_size, 'big') + data.tobytes()
+    elif data_type is weakref.ref:
+        encoded = serialize_data_recursive(data(), len_size)
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif data_type is weakref.ProxyType:
+        encoded = serialize_data_recursive(data, len_size)
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+    elif data_type is types.ModuleType:
+        encoded = data.__name__.encode('utf-8')
+        return type_byte + len(encoded).to_bytes(len_size, 'big') + encoded
+
+    raise TypeError(f"Сериализация не реализована для типа: {data_type}")
+
+
+def make_nested(depth, width):
+    """Строит дерево словарей и списков заданной глубины"""
+    if depth == 0:
+        return {'name': 'leaf', 'value': 1.5, 'tags': ['a', 'b', 'c'], 'flag': True}
+    return {f'node{i}': [make_nested(depth - 1, width), f'text {i}', i * 0.25] for i in range(width)}
+
+
+def deep_list(depth):
+    """Строит вложенные списки глубины depth"""
+    value = ['leaf', 1.5]
+    for _ in range(depth):
+        value = [value, 'level']
+    return value
+
+
+CASES = {
+    'flat dict (100 str)': {f'key{i}': f'value {i}' for i in range(100)},
+    'list of 1000 floats': [i * 0.5 for i in range(1000)],
+    'records (200 dicts)': [{'id': f'{i}', 'score': i * 0.1, 'labels': ['x', 'y'], 'extra': None}
+                            for i in range(200)],
+    'nested depth 3 x 4': make_nested(3, 4),
+    'nested depth 6 x 2': make_nested(6, 2),
+    'deep list depth 50': deep_list(50),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark serialize_data against the recursive serializer')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing repetitions (best is reported)')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Minimum seconds per timing run')
+    parser.add_argument('--len-size', type=int, default=2, help='Length field width in bytes')
+    args = parser.parse_args()
+
+    new = serialization.serialize_data
+    old = serialize_data_recursive
+
+    print(f"{'case':<24}{'bytes':>9}{'recursive, us':>16}{'table, us':>12}{'speedup':>10}")
+    for name, data in CASES.items():
+        encoded = new(data, args.len_size)
+        if encoded != old(data, args.len_size):
+            raise SystemExit(f"{name}: output differs from the recursive serializer")
+
+        timings = []
+        for func in (old, new):
+            timer = timeit.Timer(lambda: func(data, args.len_size))
+            number, _ = timer.autorange()
+            number = max(number, int(number * args.min_time / 0.2))
+            best = min(timer.repeat(args.repeat, number)) / number
+            timings.append(best * 1e6)
+
+        print(f"{name:<24}{len(encoded):>9}{timings[0]:>16.1f}{timings[1]:>12.1f}{timings[0] / timings[1]:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
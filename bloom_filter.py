@@ -0,0 +1,175 @@
+import os
+import math
+import hashlib
+from .config import *
+
+# Расширение файла фильтра Блума сегмента
+BLOOM_EXT = ".marb"
+# Заголовок фильтра: количество бит (4 байта), количество хеш-функций (1 байт), количество ключей (4 байта)
+BLOOM_BITS_SIZE = 4
+BLOOM_KEYS_POS = BLOOM_BITS_SIZE + 1
+BLOOM_HEADER_SIZE = BLOOM_KEYS_POS + 4
+# До скольких позиций битов фильтр дописывается точечно, а не перезаписывается целиком
+BLOOM_SPARSE_WRITES = 64
+
+# Кэш загруженных фильтров: {путь к .marb: (отметка файла, BloomFilter)}
+BLOOM_CACHE = {}
+
+class BloomFilter:
+    """Фильтр Блума ключей одного файла записей: ложных отрицательных ответов не бывает"""
+
+    def __init__(self, bit_count, hash_count, bits=None, key_count=0):
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+        self.bits = bytearray(bits) if bits is not None else bytearray((bit_count + 7) // 8)
+        self.key_count = key_count
+
+    @classmethod
+    def for_capacity(cls, capacity, bits_per_key=BLOOM_BITS_PER_KEY):
+        """Создает пустой фильтр для capacity ключей"""
+        bit_count = max(capacity * bits_per_key, 64)
+        hash_count = max(1, round(bits_per_key * math.log(2)))
+        return cls(bit_count, hash_count)
+
+    def _positions(self, key):
+        # Двойное хеширование: i-я хеш-функция - h1 + i * h2
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, key):
+        """Добавляет ключ; возвращает множество номеров измененных байт"""
+        changed = set()
+        bits = self.bits
+        for position in self._positions(key):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                changed.add(byte)
+        self.key_count += 1
+        return changed
+
+    def update(self, keys):
+        """Добавляет пачку ключей, не отслеживая измененные байты"""
+        bits = self.bits
+        bit_count = self.bit_count
+        hashes = range(self.hash_count)
+        blake2b = hashlib.blake2b
+        for key in keys:
+            digest = blake2b(key, digest_size=16).digest()
+            h1 = int.from_bytes(digest[:8], 'little')
+            h2 = int.from_bytes(digest[8:], 'little') | 1
+            for i in hashes:
+                position = (h1 + i * h2) % bit_count
+                bits[position >> 3] |= 1 << (position & 7)
+            self.key_count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def to_bytes(self):
+        """Упаковывает фильтр для записи в файл"""
+        return (self.bit_count.to_bytes(BLOOM_BITS_SIZE, 'big') +
+                self.hash_count.to_bytes(1, 'big') +
+                self.key_count.to_bytes(BLOOM_HEADER_SIZE - BLOOM_KEYS_POS, 'big') +
+                bytes(self.bits))
+
+    @classmethod
+    def from_bytes(cls, raw):
+        """Распаковывает фильтр из содержимого файла"""
+        bit_count = int.from_bytes(raw[:BLOOM_BITS_SIZE], 'big')
+        hash_count = raw[BLOOM_BITS_SIZE]
+        key_count = int.from_bytes(raw[BLOOM_KEYS_POS:BLOOM_HEADER_SIZE], 'big')
+        return cls(bit_count, hash_count, raw[BLOOM_HEADER_SIZE:], key_count)
+
+def get_bloom_path(file_name, cases_dir=CASES_DIR):
+    """Возвращает путь к фильтру Блума файла записей"""
+    return os.path.join(cases_dir, os.path.splitext(file_name)[0] + BLOOM_EXT)
+
+def _file_stamp(path):
+    """Возвращает отметку состояния файла для проверки актуальности кэша"""
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def load_bloom(file_name, cases_dir=CASES_DIR):
+    """Загружает фильтр Блума файла записей; возвращает None, если его нет или он поврежден"""
+    bloom_path = get_bloom_path(file_name, cases_dir)
+    try:
+        stamp = _file_stamp(bloom_path)
+    except FileNotFoundError:
+        BLOOM_CACHE.pop(bloom_path, None)
+        return None
+
+    cached = BLOOM_CACHE.get(bloom_path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    with open(bloom_path, "rb") as f:
+        raw = f.read()
+
+    bloom = BloomFilter.from_bytes(raw) if len(raw) >= BLOOM_HEADER_SIZE else None
+    if bloom is None or not bloom.hash_count or len(bloom.bits) != (bloom.bit_count + 7) // 8:
+        # Оборванный файл не годится: в нем могут не хватать битов ключей
+        return None
+
+    BLOOM_CACHE[bloom_path] = (stamp, bloom)
+    return bloom
+
+def save_bloom(file_name, bloom, cases_dir=CASES_DIR):
+    """Записывает фильтр Блума файла записей целиком"""
+    bloom_path = get_bloom_path(file_name, cases_dir)
+    temp_path = bloom_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(bloom.to_bytes())
+    os.replace(temp_path, bloom_path)
+    BLOOM_CACHE[bloom_path] = (_file_stamp(bloom_path), bloom)
+
+def rebuild_bloom(file_name, keys, capacity, cases_dir=CASES_DIR):
+    """Строит фильтр Блума по упакованным ключам файла записей"""
+    bloom = BloomFilter.for_capacity(capacity)
+    bloom.update(keys)
+    save_bloom(file_name, bloom, cases_dir)
+    return bloom
+
+def add_bloom_keys(file_name, keys, cases_dir=CASES_DIR):
+    """Добавляет ключи в фильтр; без фильтра ничего не делает - он будет построен по индексу"""
+    bloom = load_bloom(file_name, cases_dir)
+    if bloom is None:
+        return
+
+    if len(keys) * bloom.hash_count > BLOOM_SPARSE_WRITES:
+        # Пачка ключей меняет байты по всему фильтру - он перезаписывается целиком
+        bloom.update(keys)
+        save_bloom(file_name, bloom, cases_dir)
+        return
+
+    # Несколько новых ключей меняют несколько байт - они и переписываются на месте
+    changed = set()
+    for key in keys:
+        changed |= bloom.add(key)
+    bloom_path = get_bloom_path(file_name, cases_dir)
+    with open(bloom_path, "rb+") as f:
+        for byte in sorted(changed):
+            f.seek(BLOOM_HEADER_SIZE + byte)
+            f.write(bloom.bits[byte:byte + 1])
+        f.seek(BLOOM_KEYS_POS)
+        f.write(bloom.key_count.to_bytes(BLOOM_HEADER_SIZE - BLOOM_KEYS_POS, 'big'))
+    BLOOM_CACHE[bloom_path] = (_file_stamp(bloom_path), bloom)
+
+def replace_bloom(src_file_name, dst_file_name, cases_dir=CASES_DIR):
+    """Переносит фильтр Блума файла записей вместе с самим файлом"""
+    src_path = get_bloom_path(src_file_name, cases_dir)
+    dst_path = get_bloom_path(dst_file_name, cases_dir)
+    BLOOM_CACHE.pop(src_path, None)
+    BLOOM_CACHE.pop(dst_path, None)
+    if os.path.exists(src_path):
+        os.replace(src_path, dst_path)
+
+def clear_bloom(file_name, cases_dir=CASES_DIR):
+    """Удаляет фильтр Блума файла записей; при следующем поиске он будет построен по индексу"""
+    bloom_path = get_bloom_path(file_name, cases_dir)
+    BLOOM_CACHE.pop(bloom_path, None)
+    if os.path.exists(bloom_path):
+        os.remove(bloom_path)
@@ -0,0 +1,159 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import itertools
+from .config import *
+from . import database
+from .file_operations import MAX_CASES_LIMIT
+
+# Форматы входных файлов по расширению
+LOAD_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+# Запас слотов сегмента сверх оценки количества строк
+PRESIZE_HEADROOM = 1.1
+
+def detect_format(path):
+    """Определяет формат входного файла по расширению"""
+    file_format = LOAD_FORMATS.get(os.path.splitext(path)[1].lower())
+    if file_format is None:
+        raise ValueError(f"Не удалось определить формат файла {path}: укажите 'csv' или 'jsonl'")
+    return file_format
+
+def estimate_rows(path, file_format=None, sample_size=BULK_LOAD_SAMPLE_SIZE):
+    """Оценивает количество строк данных в файле по средней длине строки в его начале"""
+    file_format = file_format or detect_format(path)
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        sample = f.read(sample_size)
+
+    lines = sample.count(b'\n')
+    if len(sample) >= file_size:
+        # Файл прочитан целиком - строки считаются точно
+        lines += bool(sample) and not sample.endswith(b'\n')
+    elif lines:
+        lines = file_size * lines // len(sample)
+
+    # Первая строка CSV - заголовок
+    if file_format == 'csv':
+        lines -= 1
+    return max(lines, 0)
+
+def presize_segments(estimated_rows):
+    """Возвращает количество слотов сегмента для ожидаемого количества строк"""
+    return min(max(int(estimated_rows * PRESIZE_HEADROOM), CASES_IN_FILE), MAX_CASES_LIMIT)
+
+def iter_rows(path, file_format=None, delimiter=','):
+    """Лениво читает строки CSV (первая строка - имена колонок) или JSONL как словари {колонка: значение}"""
+    file_format = file_format or detect_format(path)
+    if file_format == 'csv':
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f, delimiter=delimiter)
+    elif file_format == 'jsonl':
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        raise ValueError(f"Неизвестный формат файла: {file_format}")
+
+def map_rows(rows, cord_columns, value_columns=None):
+    """Превращает строки в пары (координаты, данные); одна колонка данных дает ее значение, несколько - словарь"""
+    for row in rows:
+        if value_columns is None:
+            # Колонки данных - все, кроме координат, по первой строке
+            value_columns = [column for column in row if column not in cord_columns]
+
+        cords = [int(row[column]) for column in cord_columns]
+        if len(value_columns) == 1:
+            yield cords, row[value_columns[0]]
+        else:
+            yield cords, {column: row[column] for column in value_columns}
+
+def bulk_load(db_name, table_name, path, cord_columns, value_columns=None, file_format=None, delimiter=',',
+              batch_size=BULK_LOAD_BATCH_SIZE, estimated_rows=None, cord_size=STANDART_CORD_SIZE,
+              len_size=STANDART_LEN_SIZE, compression=None, report=None,
+              report_interval=BULK_LOAD_REPORT_INTERVAL):
+    """Потоково загружает CSV или JSONL в таблицу; report(статистика) вызывается раз в report_interval секунд"""
+    file_format = file_format or detect_format(path)
+    if estimated_rows is None:
+        estimated_rows = estimate_rows(path, file_format)
+
+    if not any(table_info['name'] == table_name for table_info in database.get_tables(db_name).values()):
+        # Отсутствующая таблица создается с сегментами, в которые помещается весь файл (в пределах сегмента)
+        database.create_table(db_name, table_name, list(cord_columns), presize_segments(estimated_rows),
+                              cord_size, len_size, compression)
+
+    start_time = time.perf_counter()
+    stats = {'rows': 0, 'estimated_rows': estimated_rows, 'elapsed': 0.0, 'rows_per_sec': 0.0}
+    last_report = start_time
+    records = map_rows(iter_rows(path, file_format, delimiter), list(cord_columns), value_columns)
+
+    try:
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+
+            # Данные пачки пишутся в конец сегмента одним блоком, слоты метаданных - подряд;
+            # журнал и индексы таблицы не ведутся построчно
+            stats['rows'] += database.insert_many(db_name, table_name, batch, batch_size,
+                                                  log=False, update_indexes=False)
+
+            now = time.perf_counter()
+            stats['elapsed'] = now - start_time
+            stats['rows_per_sec'] = stats['rows'] / stats['elapsed'] if stats['elapsed'] else 0.0
+            if report and now - last_report >= report_interval:
+                report(dict(stats))
+                last_report = now
+    finally:
+        # Индексы строятся один раз по итогам загрузки
+        database.rebuild_table_indexes(db_name, table_name)
+
+    stats['segments'] = sum(len(files) for files in database.get_table_files(db_name, table_name).values())
+    stats['elapsed'] = time.perf_counter() - start_time
+    stats['rows_per_sec'] = stats['rows'] / stats['elapsed'] if stats['elapsed'] else 0.0
+    return stats
+
+def main():
+    """Основная функция для загрузки файла из командной строки"""
+    parser = argparse.ArgumentParser(description='MAR bulk loader: streams CSV or JSONL rows into a table')
+    parser.add_argument('db_name', help='Database file (.marm); created if missing')
+    parser.add_argument('table_name', help='Table to load into; created if missing')
+    parser.add_argument('source', help='Input file (.csv, .jsonl)')
+    parser.add_argument('--cords', nargs='+', required=True,
+                        help='Columns that become coordinates, in order')
+    parser.add_argument('--values', nargs='+', default=None,
+                        help='Columns that become the payload (default: all other columns)')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                        help='Input format (default: by file extension)')
+    parser.add_argument('--delimiter', default=',', help='CSV delimiter')
+    parser.add_argument('--batch-size', type=int, default=BULK_LOAD_BATCH_SIZE,
+                        help='Rows per write batch')
+    parser.add_argument('--estimate', type=int, default=None,
+                        help='Expected row count for segment pre-sizing (default: estimated from the file)')
+    parser.add_argument('--cord-size', type=int, default=STANDART_CORD_SIZE,
+                        help='Coordinate width in bytes for a new table')
+    parser.add_argument('--len-size', type=int, default=STANDART_LEN_SIZE,
+                        help='Data length field width in bytes for a new table')
+    parser.add_argument('--compression', choices=['zlib', 'lzma'], default=None,
+                        help='Record compression for a new table')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_name):
+        database.create_database(args.db_name)
+
+    def report(stats):
+        print(f"{stats['rows']} rows, {stats['rows_per_sec']:.0f} rows/s", file=sys.stderr)
+
+    stats = bulk_load(args.db_name, args.table_name, args.source, args.cords, args.values, args.format,
+                      args.delimiter, args.batch_size, args.estimate, args.cord_size, args.len_size,
+                      args.compression, report)
+    print(f"Loaded {stats['rows']} rows into {stats['segments']} segments "
+          f"in {stats['elapsed']:.2f} s ({stats['rows_per_sec']:.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import threading
+import time
+import logging
+from .config import *
+from . import database
+from . import file_operations
+
+class BackgroundCompactor:
+    """Фоновая дефрагментация файлов записей базы данных с фрагментацией выше порога"""
+
+    def __init__(self, db_name, threshold=FRAGMENTATION_THRESHOLD, time_slice=COMPACTION_TIME_SLICE,
+                 interval=COMPACTION_INTERVAL, run_once=False, logger=None, chunk_size=COMPACTION_CHUNK_SIZE):
+        """
+        :param db_name: Файл базы данных (.marm)
+        :param threshold: Отношение мертвых байт к живым, выше которого файл сжимается
+        :param time_slice: Длительность одного шага в секундах (шаг завершает начатую порцию)
+        :param interval: Пауза между шагами в секундах
+        :param run_once: Остановиться, когда фрагментированных файлов не останется
+        :param logger: Логгер для сообщений о сжатых файлах
+        :param chunk_size: Сколько байт данных копируется за одну блокировку файла
+        """
+        self.db_name = db_name
+        self.threshold = threshold
+        self.time_slice = time_slice
+        self.interval = interval
+        self.run_once = run_once
+        self.logger = logger or logging.getLogger('MARCompactor')
+        self.chunk_size = chunk_size
+        self.stats = {'steps': 0, 'files_compacted': 0, 'bytes_reclaimed': 0, 'elapsed': 0.0}
+        self.running = False
+        self.pending = False      # Остались файлы выше порога или начатое сжатие
+        self.thread = None
+        self._wakeup = threading.Event()
+        self._queue = []          # Фрагментированные файлы текущего прохода
+        self._compaction = None   # Начатое сжатие файла и его показатели
+
+    def get_candidates(self):
+        """Возвращает показатели фрагментированных файлов, начиная с самых фрагментированных"""
+        fragmentation = database.get_database_fragmentation(self.db_name)
+        candidates = [item for item in fragmentation if item['ratio'] > self.threshold]
+        return sorted(candidates, key=lambda item: item['ratio'], reverse=True)
+
+    def step(self):
+        """Сжимает файлы порциями, пока не истечет квант времени; возвращает True, если сжаты не все"""
+        deadline = time.perf_counter() + self.time_slice
+        self.stats['steps'] += 1
+        if self._compaction is None and not self._queue:
+            self._queue = self.get_candidates()
+
+        # Каждый шаг копирует хотя бы одну порцию, даже если квант меньше ее
+        while True:
+            if self._compaction is None:
+                if not self._queue:
+                    return False
+                candidate = self._queue.pop(0)
+                self._compaction = (file_operations.SegmentCompaction(candidate['file']), candidate)
+
+            # Файл блокируется только на время копирования одной порции, сжатие продолжается со следующего шага
+            compaction, candidate = self._compaction
+            file_stats = compaction.step(self.chunk_size)
+            if compaction.done:
+                self._compaction = None
+            if file_stats:
+                self.stats['files_compacted'] += 1
+                self.stats['bytes_reclaimed'] += file_stats['bytes_reclaimed']
+                self.stats['elapsed'] += file_stats['elapsed']
+                self.logger.info(f"Compacted {candidate['file']} (ratio {candidate['ratio']:.2f}): "
+                                 f"reclaimed {file_stats['bytes_reclaimed']} bytes in {file_stats['steps']} chunks, "
+                                 f"{file_stats['elapsed']:.3f} s")
+
+            if time.perf_counter() >= deadline:
+                return True
+
+    def abort(self):
+        """Прерывает начатое сжатие файла; временный файл удаляется"""
+        if self._compaction is not None:
+            self._compaction[0].abort()
+            self._compaction = None
+        self._queue = []
+
+    def _run(self):
+        """Цикл фонового потока"""
+        while self.running:
+            try:
+                pending = self.step()
+            except Exception as e:
+                self.logger.error(f"Compaction error in {self.db_name}: {e}")
+                self.abort()
+                pending = False
+
+            self.pending = pending
+            if self.run_once and not pending:
+                break
+            self._wakeup.wait(self.interval)
+
+        self.abort()
+        self.pending = False
+        self.running = False
+
+    def start(self):
+        """Запускает фоновый поток дефрагментации"""
+        if self.running:
+            return self
+        self.running = True
+        self.pending = True
+        self._wakeup.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, wait=True):
+        """Останавливает фоновый поток; начатое сжатие файла прерывается после текущей порции"""
+        self.running = False
+        self._wakeup.set()
+        if wait and self.thread:
+            self.thread.join()
+
+    def is_alive(self):
+        """Проверяет, работает ли фоновый поток"""
+        return self.thread is not None and self.thread.is_alive()
+
+    def get_status(self):
+        """Возвращает {'running': сжатие еще идет, 'stats': статистика}; постоянный поток считается
+        закончившим, когда файлов выше порога не осталось"""
+        return {'running': self.is_alive() and self.pending, 'stats': dict(self.stats)}
@@ -1,5 +1,5 @@
 # Конфигурационные константы базы данных
-DB_VERSION = 1
+DB_VERSION = 2         # Версия формата новых баз данных (1 - формат с разделителями)
 DB_VERSION_BYTES = 3
 STANDART_CORD_SIZE = 2  # Размер одного значения координаты в байтах
 STANDART_LEN_SIZE = 2   # Размер поля длины данных в байтах
@@ -9,4 +9,21 @@ MAX_TABLES_IN_BD_B = 2  # Размер поля для количества та
 MAX_CASES_IN_TABLE_B = 2  # Размер поля для количества записей в таблице
 BYTES_PLASE_IN_FILE = 5  # Размер поля позиции в файле
 BASED_RESERV_SIZE = 10   # Базовый размер резервного пространства
-CASES_DIR = "cases/"     # Директория для файлов с данными
\ No newline at end of file
+CASES_DIR = "cases/"     # Директория для файлов с данными
+FRAGMENTATION_THRESHOLD = 0.3  # Доля мертвых байт к живым, после которой файл сжимается
+COMPACTION_TIME_SLICE = 0.1    # Длительность одного шага фоновой дефрагментации в секундах
+COMPACTION_INTERVAL = 5        # Пауза между шагами фоновой дефрагментации в секундах
+COMPACTION_CHUNK_SIZE = 1024 * 1024  # Сколько байт данных фоновая дефрагментация копирует за одну блокировку файла
+WAL_DURABILITY = "batch"       # Режим надежности журнала: none, batch (групповой fsync), op (fsync на операцию)
+WAL_GROUP_COMMIT_DELAY = 0.002  # Сколько лидер группы ждет другие операции перед fsync в секундах
+WAL_CHECKPOINT_SIZE = 16 * 1024 * 1024  # Размер журнала, после которого он усекается контрольной точкой
+BUFFER_POOL_SIZE = 16 * 1024 * 1024  # Бюджет пула страниц файлов записей в байтах (0 - пул выключен)
+BUFFER_PAGE_SIZE = 4096        # Размер страницы пула в байтах
+CONVERT_CHUNK_SIZE = 1024 * 1024  # Размер куска при потоковом переводе файлов записей в формат версии 2
+COMPRESSION_THRESHOLD = 256    # Данные записи не короче этого размера сжимаются, если для таблицы включено сжатие
+BULK_LOAD_BATCH_SIZE = 50000    # Количество строк в одной пачке массовой загрузки
+BULK_LOAD_SAMPLE_SIZE = 1024 * 1024  # Размер начала файла, по которому оценивается количество строк
+BULK_LOAD_REPORT_INTERVAL = 1.0  # Период отчетов о скорости массовой загрузки в секундах
+SCAN_WORKERS = 0               # Количество процессов параллельного чтения таблиц (0 или 1 - чтение в одном процессе)
+SCAN_PREFETCH = 2              # Сколько файлов на процесс читается параллельным чтением впрок
+BLOOM_BITS_PER_KEY = 10        # Бит фильтра Блума сегмента на один слот (около 1% ложных срабатываний)
\ No newline at end of file
@@ -1,21 +1,208 @@
 import os
 import struct
+import itertools
+import time
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from .config import *
-from .file_operations import create_cases_file, write_case_to_file, find_case_in_file, read_all_cases
+from .file_operations import (create_cases_file, write_case_to_file, find_case_in_file, read_all_cases,
+                              find_case_info, get_table_id, get_table_info, iter_cases,
+                              write_cases_to_file, get_case_index, defragment_file, get_fragmentation,
+                              find_cases_in_file, read_cases_by_slots, get_cases_info, get_segment_layout,
+                              convert_segment, set_segment_compression, match_slots, read_slot_arrays,
+                              delete_case_from_file, get_free_slots, get_live_count, reset_process_state,
+                              configure_buffer_pool, pack_case_key, might_contain, segment_overlaps,
+                              SEGMENT_VERSION)
+from .serialization import COMPRESSION_METHODS, COMPRESSION_NAMES
+from .index import pack_cords, get_index_path, get_index_generation
+from .bloom_filter import get_bloom_path, clear_bloom
+from .wal import WriteAheadLog, get_wal_path, OP_INSERT, OP_DELETE
+from . import sorted_index
+from . import spatial_index
+from . import inverted_index
 
-def create_database(db_name):
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Каталог версии 2: версия (3 байта), сигнатура (4), размер заголовка (2), количество таблиц (4),
+# смещение (8) и размер (8) каталога таблиц, длина пути к данным (2), конфигурация (24), резерв
+CATALOG_VERSION = 2
+CATALOG_MAGIC = b'MARM'
+CATALOG_HEADER_SIZE = 64
+# Наибольшая ширина координаты и поля длины данных таблицы в байтах
+MAX_CORD_SIZE = 8
+MAX_LEN_SIZE = 4
+
+# Кэш каталога: {абсолютный путь к .marm/.mart: (отметка файла, разобранное содержимое)}
+CATALOG_CACHE = {}
+# Открытые журналы упреждающей записи: {абсолютный путь к .marm: WriteAheadLog}
+WAL_LOGS = {}
+# Пулы процессов параллельного чтения таблиц: {количество процессов: ProcessPoolExecutor}
+SCAN_POOLS = {}
+_SCAN_POOLS_GUARD = threading.Lock()
+# Количество живых записей таблиц: {файлы таблицы: (поколение индексов, количество записей)}
+LIVE_COUNT_CACHE = {}
+
+def _catalog_stamp(file_path):
+    """Возвращает отметку состояния файла каталога или None, если файла нет"""
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def _get_cached(file_path, stamp):
+    """Возвращает разобранное содержимое файла из кэша, если файл не менялся"""
+    cached = CATALOG_CACHE.get(os.path.abspath(file_path))
+    if cached and cached[0] == stamp:
+        return cached[1]
+    return None
+
+def invalidate_catalog(file_path=None):
+    """Сбрасывает кэш каталога для файла или целиком"""
+    if file_path is None:
+        CATALOG_CACHE.clear()
+    else:
+        CATALOG_CACHE.pop(os.path.abspath(file_path), None)
+
+def create_database(db_name, version=DB_VERSION):
     """Создает новую базу данных"""
-    with open(db_name, "wb") as f:
-        f.write(DB_VERSION.to_bytes(DB_VERSION_BYTES, 'big'))
-        f.write(b'\xf8')
-        f.write(CASES_DIR.encode('utf-8'))
-        f.write(b'\xfa')
-        f.write(b'\x00' * 24)  # Резервное пространство для конфигурации
+    if version == 1:
+        with open(db_name, "wb") as f:
+            f.write(version.to_bytes(DB_VERSION_BYTES, 'big'))
+            f.write(b'\xf8')
+            f.write(CASES_DIR.encode('utf-8'))
+            f.write(b'\xfa')
+            f.write(b'\x00' * 24)  # Резервное пространство для конфигурации
+            f.write(b'\xfa')
+            f.write(b'\x00' * MAX_TABLES_IN_BD_B)  # Место для количества таблиц
+    else:
+        _write_catalog(db_name, CASES_DIR, b'\x00' * 24, [])
+    invalidate_catalog(db_name)
+
+def _pack_catalog_header(table_count, dir_offset, dir_size, cases_dir, config):
+    """Упаковывает заголовок каталога версии 2"""
+    header = (CATALOG_VERSION.to_bytes(DB_VERSION_BYTES, 'big') +
+              CATALOG_MAGIC +
+              CATALOG_HEADER_SIZE.to_bytes(2, 'big') +
+              table_count.to_bytes(4, 'big') +
+              dir_offset.to_bytes(8, 'big') +
+              dir_size.to_bytes(8, 'big') +
+              len(cases_dir).to_bytes(2, 'big') +
+              config)
+    return header.ljust(CATALOG_HEADER_SIZE, b'\x00')
+
+def _pack_table_entry(table_id, table_info):
+    """Упаковывает запись каталога таблиц версии 2"""
+    name = table_info['name'].encode('utf-8')
+    body = (table_id.to_bytes(MAX_TABLES_IN_BD_B, 'big') +
+            table_info['cord_size'].to_bytes(1, 'big') +
+            table_info['len_size'].to_bytes(1, 'big') +
+            len(name).to_bytes(2, 'big') + name +
+            table_info['columns_count'].to_bytes(MAX_CASES_IN_TABLE_B, 'big'))
+    for col_id in range(table_info['columns_count']):
+        column = table_info['columns'][col_id].encode('utf-8')
+        body += len(column).to_bytes(2, 'big') + column
+    return len(body).to_bytes(4, 'big') + body
+
+def _write_catalog(db_name, cases_dir, config, tables):
+    """Записывает каталог версии 2 целиком: заголовок, путь к данным и каталог таблиц"""
+    cases_dir = cases_dir.encode('utf-8')
+    directory = b''.join(_pack_table_entry(table_id, table_info) for table_id, table_info in tables)
+    dir_offset = CATALOG_HEADER_SIZE + len(cases_dir)
+    
+    temp_path = db_name + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(_pack_catalog_header(len(tables), dir_offset, len(directory), cases_dir, config))
+        f.write(cases_dir)
+        f.write(directory)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, db_name)
+
+def create_table(db_name, table_name, columns, cases_in_file=CASES_IN_FILE,
+                 cord_size=STANDART_CORD_SIZE, len_size=STANDART_LEN_SIZE,
+                 compression=None, compress_threshold=COMPRESSION_THRESHOLD):
+    """Создает новую таблицу в базе данных; compression - 'zlib', 'lzma' или None"""
+    db_info = parse_database(db_name)
+    compression_code = get_compression_code(compression)
+    if db_info['version'] == 1:
+        if (cord_size, len_size) != (STANDART_CORD_SIZE, STANDART_LEN_SIZE):
+            raise ValueError("Ширина координат и длины данных задается только в базах формата 2 (convert_database)")
+        if compression_code:
+            raise ValueError("Сжатие записей доступно только в базах формата 2 (convert_database)")
+        new_table_count = _append_table_v1(db_name, table_name, columns)
+    else:
+        if not 1 <= cord_size <= MAX_CORD_SIZE or not 1 <= len_size <= MAX_LEN_SIZE:
+            raise ValueError(f"Ширина координаты должна быть от 1 до {MAX_CORD_SIZE}, "
+                             f"ширина длины данных - от 1 до {MAX_LEN_SIZE} байт")
+        new_table_count = db_info['table_count'] + 1
+        entry = _pack_table_entry(new_table_count, {
+            'name': table_name,
+            'columns_count': len(columns),
+            'columns': dict(enumerate(columns)),
+            'cord_size': cord_size,
+            'len_size': len_size
+        })
+        with open(db_name, "rb+") as f:
+            # Запись таблицы дописывается в конец каталога, заголовок обновляется последним
+            f.seek(db_info['dir_offset'] + db_info['dir_size'])
+            f.write(entry)
+            f.truncate()
+            f.flush()
+            f.seek(0)
+            f.write(_pack_catalog_header(new_table_count, db_info['dir_offset'], db_info['dir_size'] + len(entry),
+                                         db_info['cases_dir'].encode('utf-8'), db_info['config']))
+    invalidate_catalog(db_name)
+    
+    # Создаем файл для хранения данных таблицы
+    if not os.path.exists('config'):
+        os.makedirs('config')
+    
+    table_file = f"{table_name}_1.marc"
+    segment_version = 1 if db_info['version'] == 1 else SEGMENT_VERSION
+    create_cases_file(table_file, new_table_count, len(columns), max_cases=cases_in_file,
+                      cord_size=cord_size, len_size=len_size, version=segment_version,
+                      compression=compression_code, compress_threshold=compress_threshold)
+    
+    # Создаем конфигурационный файл таблицы
+    with open(f"config/{table_name}.mart", "wb") as f:
+        f.write(new_table_count.to_bytes(MAX_TABLES_IN_BD_B, 'big'))
+        f.write(table_file.encode('utf-8'))
         f.write(b'\xfa')
-        f.write(b'\x00' * MAX_TABLES_IN_BD_B)  # Место для количества таблиц
+    invalidate_catalog(f"config/{table_name}.mart")
+    
+    # Упорядоченный индекс ведется с момента создания таблицы
+    sorted_index.create_sorted_index(table_name)
+
+def get_compression_code(compression):
+    """Возвращает код метода сжатия по имени ('zlib', 'lzma') или 0 для None"""
+    if not compression:
+        return 0
+    if compression not in COMPRESSION_METHODS:
+        raise ValueError(f"Неизвестный метод сжатия: {compression}")
+    return COMPRESSION_METHODS[compression]
+
+def set_table_compression(db_name, table_name, compression, compress_threshold=COMPRESSION_THRESHOLD):
+    """Меняет сжатие таблицы для новых и перезаписываемых записей; старые записи остаются как есть"""
+    compression_code = get_compression_code(compression)
+    for files in get_table_files(db_name, table_name).values():
+        for file_name in files:
+            set_segment_compression(file_name, compression_code, compress_threshold)
+
+def get_table_compression(db_name, table_name):
+    """Возвращает метод и порог сжатия таблицы"""
+    files = next(iter(get_table_files(db_name, table_name).values()), [])
+    if not files:
+        return None
+    layout = get_segment_layout(files[-1])
+    return {'compression': COMPRESSION_NAMES.get(layout.compression), 'threshold': layout.compress_threshold}
 
-def create_table(db_name, table_name, columns):
-    """Создает новую таблицу в базе данных"""
+def _append_table_v1(db_name, table_name, columns):
+    """Добавляет таблицу в каталог версии 1; возвращает ее ID"""
     # Читаем текущее количество таблиц
     with open(db_name, "rb+") as f:
         f.seek(DB_VERSION_BYTES + 1)
@@ -47,27 +234,30 @@ def create_table(db_name, table_name, columns):
             f.write(i.to_bytes(MAX_CASES_IN_TABLE_B, 'big'))
             f.write(column.encode('utf-8'))
             f.write(b'\xfa')
-    
-    # Создаем файл для хранения данных таблицы
-    if not os.path.exists('config'):
-        os.makedirs('config')
-    
-    table_file = f"{table_name}_1.marc"
-    create_cases_file(table_file, new_table_count, len(columns))
-    
-    # Создаем конфигурационный файл таблицы
-    with open(f"config/{table_name}.mart", "wb") as f:
-        f.write(new_table_count.to_bytes(MAX_TABLES_IN_BD_B, 'big'))
-        f.write(table_file.encode('utf-8'))
-        f.write(b'\xfa')
+    return new_table_count
 
 def parse_database(db_name):
     """Парсит основную информацию о базе данных"""
     with open(db_name, "rb") as f:
-        version = int.from_bytes(f.read(DB_VERSION_BYTES), 'big')
+        header = f.read(CATALOG_HEADER_SIZE)
+        version = int.from_bytes(header[:DB_VERSION_BYTES], 'big')
+        
+        if header[DB_VERSION_BYTES:DB_VERSION_BYTES + len(CATALOG_MAGIC)] == CATALOG_MAGIC:
+            # Версия 2: все поля заголовка лежат по фиксированным смещениям
+            header_size = int.from_bytes(header[7:9], 'big')
+            cases_dir_len = int.from_bytes(header[29:31], 'big')
+            f.seek(header_size)
+            return {
+                'version': version,
+                'cases_dir': f.read(cases_dir_len).decode('utf-8'),
+                'config': header[31:55],
+                'table_count': int.from_bytes(header[9:13], 'big'),
+                'dir_offset': int.from_bytes(header[13:21], 'big'),
+                'dir_size': int.from_bytes(header[21:29], 'big')
+            }
         
         # Читаем путь к директории с данными
-        f.read(1)  # Пропускаем разделитель
+        f.seek(DB_VERSION_BYTES + 1)  # Пропускаем разделитель
         cases_dir = b''
         while True:
             byte = f.read(1)
@@ -93,7 +283,66 @@ def parse_database(db_name):
 
 def get_tables(db_name):
     """Возвращает информацию о всех таблицах в базе данных"""
+    # Вызывающий получает копию: изменения не попадают в кэш каталога
+    return {table_id: dict(table_info, columns=dict(table_info['columns']))
+            for table_id, table_info in _load_tables(db_name).items()}
+
+def _load_tables(db_name):
+    """Возвращает каталог таблиц из кэша или читает его из файла; результат изменять нельзя"""
+    stamp = _catalog_stamp(db_name)
+    tables = _get_cached(db_name, stamp)
+    if tables is not None:
+        return tables
+    
     db_info = parse_database(db_name)
+    if db_info['version'] == 1:
+        tables = _read_tables_v1(db_name, db_info)
+    else:
+        tables = _read_tables_v2(db_name, db_info)
+    
+    CATALOG_CACHE[os.path.abspath(db_name)] = (stamp, tables)
+    return tables
+
+def _read_tables_v2(db_name, db_info):
+    """Читает каталог таблиц версии 2 одним чтением"""
+    with open(db_name, "rb") as f:
+        f.seek(db_info['dir_offset'])
+        directory = f.read(db_info['dir_size'])
+    
+    tables = {}
+    offset = 0
+    for _ in range(db_info['table_count']):
+        entry_len = int.from_bytes(directory[offset:offset + 4], 'big')
+        pos = offset + 4
+        table_id = int.from_bytes(directory[pos:pos + MAX_TABLES_IN_BD_B], 'big')
+        pos += MAX_TABLES_IN_BD_B
+        cord_size, len_size = directory[pos], directory[pos + 1]
+        pos += 2
+        name_len = int.from_bytes(directory[pos:pos + 2], 'big')
+        table_name = directory[pos + 2:pos + 2 + name_len].decode('utf-8')
+        pos += 2 + name_len
+        columns_count = int.from_bytes(directory[pos:pos + MAX_CASES_IN_TABLE_B], 'big')
+        pos += MAX_CASES_IN_TABLE_B
+        
+        columns = {}
+        for col_id in range(columns_count):
+            col_len = int.from_bytes(directory[pos:pos + 2], 'big')
+            columns[col_id] = directory[pos + 2:pos + 2 + col_len].decode('utf-8')
+            pos += 2 + col_len
+        
+        tables[table_id] = {
+            'name': table_name,
+            'columns_count': columns_count,
+            'columns': columns,
+            'cord_size': cord_size,
+            'len_size': len_size,
+            'offset': db_info['dir_offset'] + offset
+        }
+        offset += 4 + entry_len
+    return tables
+
+def _read_tables_v1(db_name, db_info):
+    """Читает таблицы из каталога версии 1 с разделителями"""
     tables = {}
     
     with open(db_name, "rb") as f:
@@ -130,70 +379,818 @@ def get_tables(db_name):
             tables[table_id] = {
                 'name': table_name.decode('utf-8'),
                 'columns_count': columns_count,
-                'columns': columns
+                'columns': columns,
+                'cord_size': STANDART_CORD_SIZE,
+                'len_size': STANDART_LEN_SIZE
             }
     
     return tables
 
+def convert_database(db_name):
+    """Переводит базу данных формата 1 в формат 2: файлы записей по одному, затем каталог; возвращает статистику"""
+    start_time = time.perf_counter()
+    db_info = parse_database(db_name)
+    stats = {'converted': db_info['version'] == 1, 'files': []}
+    
+    # Файлы записей описывают себя сами, поэтому база читается и при частично выполненном переводе
+    for files in get_table_files(db_name).values():
+        for file_name in files:
+            file_stats = convert_segment(file_name)
+            if file_stats:
+                stats['files'].append(file_stats)
+    
+    if db_info['version'] == 1:
+        tables = get_tables(db_name)
+        _write_catalog(db_name, db_info['cases_dir'], db_info['config'], sorted(tables.items()))
+        invalidate_catalog(db_name)
+    
+    stats['elapsed'] = time.perf_counter() - start_time
+    return stats
+
+def _read_table_config(config_file):
+    """Возвращает список файлов из конфигурации таблицы или None, если ее нет"""
+    stamp = _catalog_stamp(config_file)
+    if stamp is None:
+        return None
+    
+    files = _get_cached(config_file, stamp)
+    if files is not None:
+        return files
+    
+    with open(config_file, "rb") as f:
+        f.read(MAX_TABLES_IN_BD_B)  # Пропускаем ID таблицы
+        
+        # Имена файлов разделены байтом 0xFA
+        files = [name.decode('utf-8') for name in f.read().split(b'\xfa')[:-1]]
+    
+    CATALOG_CACHE[os.path.abspath(config_file)] = (stamp, files)
+    return files
+
 def get_table_files(db_name, table_name=None):
     """Возвращает файлы, связанные с таблицей/таблицами"""
-    tables = get_tables(db_name)
+    tables = _load_tables(db_name)
     result = {}
     
     for table_id, table_info in tables.items():
         if table_name is None or table_info['name'] == table_name:
             config_file = f"config/{table_info['name']}.mart"
+            files = _read_table_config(config_file)
             
-            if os.path.exists(config_file):
-                with open(config_file, "rb") as f:
-                    f.read(MAX_TABLES_IN_BD_B)  # Пропускаем ID таблицы
-                    
-                    files = []
-                    file_name = b''
-                    while True:
-                        byte = f.read(1)
-                        if byte == b'\xfa':
-                            files.append(file_name.decode('utf-8'))
-                            file_name = b''
-                        elif not byte:
-                            break
-                        else:
-                            file_name += byte
-                    
-                    result[table_id] = files
+            if files is not None:
+                result[table_id] = list(files)
     
     return result
 
+def add_table_file(db_name, table_name):
+    """Создает новый файл записей для таблицы и регистрирует его в .mart"""
+    table_files = get_table_files(db_name, table_name)
+    
+    for files in table_files.values():
+        if not files:
+            continue
+        
+        # Новый файл наследует параметры текущего последнего файла таблицы
+        layout = get_segment_layout(files[-1])
+        
+        table_file = f"{table_name}_{len(files) + 1}.marc"
+        create_cases_file(table_file, layout.table_id, layout.cords, max_cases=layout.max_cases,
+                          cord_size=layout.cord_size, len_size=layout.len_size, version=layout.version,
+                          compression=layout.compression, compress_threshold=layout.compress_threshold)
+        
+        with open(f"config/{table_name}.mart", "ab") as f:
+            f.write(table_file.encode('utf-8'))
+            f.write(b'\xfa')
+        invalidate_catalog(f"config/{table_name}.mart")
+        
+        return table_file
+    
+    return None
+
+def get_wal(db_name):
+    """Возвращает открытый журнал базы данных или None"""
+    return WAL_LOGS.get(os.path.abspath(db_name))
+
+def open_database(db_name, durability=WAL_DURABILITY):
+    """Открывает журнал упреждающей записи базы данных и применяет операции, оставшиеся после сбоя"""
+    wal = get_wal(db_name)
+    if wal:
+        return wal
+    
+    wal = WriteAheadLog(get_wal_path(db_name), durability)
+    replayed = set()
+    
+    def apply(op, table_name, cords, data):
+        if table_name not in replayed:
+            # Фильтры Блума после сбоя могли отстать от файлов записей, поэтому перед повтором
+            # операций они удаляются и строятся заново по индексам
+            replayed.add(table_name)
+            for files in get_table_files(db_name, table_name).values():
+                for file_name in files:
+                    clear_bloom(file_name)
+        if op == OP_INSERT:
+            insert_into_table(db_name, table_name, cords, data, log=False)
+        elif op == OP_DELETE:
+            delete_from_table(db_name, table_name, cords, log=False)
+    
+    wal.replay(apply)
+    # Повторенные операции записаны без журнала: их таблицы сбрасываются на диск до усечения журнала
+    wal.tables.update(replayed)
+    WAL_LOGS[os.path.abspath(db_name)] = wal
+    checkpoint_database(db_name)
+    return wal
+
+def close_database(db_name):
+    """Сбрасывает изменения на диск и закрывает журнал базы данных"""
+    wal = WAL_LOGS.pop(os.path.abspath(db_name), None)
+    if wal:
+        _sync_tables(db_name, wal.tables)
+        wal.checkpoint()
+        wal.close()
+
+def _sync_tables(db_name, table_names):
+    """Принудительно сбрасывает на диск файлы записей и индексы таблиц"""
+    for table_name in table_names:
+        for files in get_table_files(db_name, table_name).values():
+            for file_name in files:
+                for path in (os.path.join(CASES_DIR, file_name), get_index_path(file_name),
+                             get_bloom_path(file_name)):
+                    if os.path.exists(path):
+                        with open(path, "rb+") as f:
+                            os.fsync(f.fileno())
+
+def checkpoint_database(db_name, upto=None):
+    """Сбрасывает файлы записей на диск и усекает журнал до смещения upto (целиком, если None)"""
+    wal = get_wal(db_name)
+    if wal is None:
+        return False
+    
+    _sync_tables(db_name, set(wal.tables))
+    return wal.checkpoint(upto)
+
+def log_operations(db_name, operations, pending=True):
+    """Записывает операции в журнал базы данных, если он открыт; возвращает логическое смещение или None"""
+    wal = get_wal(db_name)
+    if wal is None:
+        return None
+    return wal.append_many(operations, pending)
+
+def _operations_applied(db_name, count):
+    """Отмечает операции журнала как примененные и при необходимости делает контрольную точку"""
+    wal = get_wal(db_name)
+    if wal is None:
+        return
+    wal.mark_applied(count)
+    if wal.size() > WAL_CHECKPOINT_SIZE:
+        checkpoint_database(db_name)
+
+def _may_hold(file_name, cords, key):
+    """Проверяет по границам координат и фильтру Блума файла, может ли в нем быть запись"""
+    return segment_overlaps(file_name, cords, cords) and might_contain(file_name, key)
+
+def _overlapping_segments(files, lower_cords, upper_cords):
+    """Возвращает номера файлов, границы координат которых пересекают прямоугольник запроса"""
+    return [segment for segment, file in enumerate(files) if segment_overlaps(file, lower_cords, upper_cords)]
+
 def find_in_table(db_name, table_name, cords):
     """Ищет запись в указанной таблице"""
     table_files = get_table_files(db_name, table_name)
     
     for files in table_files.values():
+        if not files:
+            continue
+        
+        key = pack_case_key(files[0], cords)
         for file in files:
+            # Границы координат и фильтр Блума отсекают файлы, в которых записи точно нет,
+            # не загружая их индекс
+            if not _may_hold(file, cords, key):
+                continue
             result = find_case_in_file(file, cords)
             if result:
                 return result
     
     return None
 
-def insert_into_table(db_name, table_name, cords, data):
+def insert_into_table(db_name, table_name, cords, data, log=True):
     """Вставляет запись в таблицу"""
+    # Операция сначала попадает в журнал, если он открыт
+    if log and log_operations(db_name, [(OP_INSERT, table_name, cords, data)]) is not None:
+        try:
+            return _insert_into_table(db_name, table_name, cords, data)
+        finally:
+            _operations_applied(db_name, 1)
+    
+    return _insert_into_table(db_name, table_name, cords, data)
+
+def _insert_into_table(db_name, table_name, cords, data):
+    """Вставляет запись в таблицу без записи в журнал"""
     table_files = get_table_files(db_name, table_name)
     
     for files in table_files.values():
+        if not files:
+            continue
+        
+        # Существующая запись обновляется в том файле, где она хранится
+        key = pack_case_key(files[0], cords)
         for file in files:
-            if write_case_to_file(file, cords, data):
+            if _may_hold(file, cords, key) and find_case_info(file, cords):
+                return write_case_to_file(file, cords, data)
+        
+        # Новая запись занимает слот удаленной записи, если он есть
+        for segment, file in enumerate(files[:-1]):
+            if get_free_slots(file) and write_case_to_file(file, cords, data):
+                _index_new_keys(table_name, files, [(cords, segment)])
                 return True
+        
+        # Иначе она пишется в текущий (последний) файл таблицы
+        if not write_case_to_file(files[-1], cords, data):
+            # Текущий файл заполнен - создаем следующий
+            files = files + [add_table_file(db_name, table_name)]
+            if not write_case_to_file(files[-1], cords, data):
+                return False
+        
+        _index_new_keys(table_name, files, [(cords, len(files) - 1)])
+        return True
     
     return False
 
-def select_from_table(db_name, table_name):
-    """Возвращает все записи из таблицы"""
+def insert_many(db_name, table_name, records, batch_size=10000, log=True, update_indexes=True):
+    """Вставляет в таблицу записи из итерируемого объекта пар (координаты, данные); возвращает их количество"""
+    # С update_indexes=False индексы таблицы не ведутся: после вставки нужен rebuild_table_indexes
     table_files = get_table_files(db_name, table_name)
+    if not table_files:
+        return 0
+    
+    files = next(iter(table_files.values()))
+    inserted = 0
+    records = iter(records)
+    
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return inserted
+        
+        # Вся пачка попадает в журнал одной записью и фиксируется одним fsync
+        logged = log and log_operations(
+            db_name, [(OP_INSERT, table_name, cords, data) for cords, data in batch]) is not None
+        try:
+            _insert_batch(db_name, table_name, files, batch, update_indexes)
+        finally:
+            if logged:
+                _operations_applied(db_name, len(batch))
+        
+        files = next(iter(get_table_files(db_name, table_name).values()))
+        inserted += len(batch)
+
+def _insert_batch(db_name, table_name, files, batch, update_indexes=True):
+    """Вставляет пачку записей в файлы таблицы"""
+    # Индексы файлов загружаются один раз на пачку
+    case_indexes = [(file, get_case_index(file)) for file in files]
+    
+    # Повторные координаты внутри пачки: остается последнее значение
+    cord_size = get_segment_layout(files[0]).cord_size
+    new_cases = {}
+    for cords, data in batch:
+        key = pack_cords(cords, cord_size)
+        
+        # Существующие записи обновляются в своих файлах
+        for file, case_index in case_indexes:
+            if key in case_index:
+                write_case_to_file(file, cords, data)
+                break
+        else:
+            new_cases[key] = (cords, data)
+    
+    # Новые записи сначала занимают слоты удаленных записей в прежних файлах
+    pending = list(new_cases.values())
+    new_keys = []
+    for segment, file in enumerate(files[:-1]):
+        if pending and get_free_slots(file):
+            written = write_cases_to_file(file, pending)
+            new_keys.extend((cords, segment) for cords, _ in pending[:written])
+            pending = pending[written:]
+    
+    # Остальные дописываются пачками в текущий файл, при заполнении создается следующий
+    while pending:
+        written = write_cases_to_file(files[-1], pending)
+        new_keys.extend((cords, len(files) - 1) for cords, _ in pending[:written])
+        pending = pending[written:]
+        if pending:
+            files = files + [add_table_file(db_name, table_name)]
+    
+    if update_indexes:
+        _index_new_keys(table_name, files, new_keys)
+
+def _index_new_keys(table_name, files, entries):
+    """Добавляет новые записи [(координаты, номер файла)] в индексы таблицы"""
+    cord_size = get_segment_layout(files[0]).cord_size
+    with sorted_index.sorted_index_lock(table_name):
+        sorted_index.add_keys(table_name, entries, cord_size)
+    with spatial_index.spatial_index_lock(table_name):
+        spatial_index.add_points(table_name, entries, cord_size)
+    
+    if entries:
+        dims = inverted_index.get_indexed_dims(table_name, len(entries[0][0]))
+        if dims:
+            # Инвертированным индексам нужны слоты новых записей - они есть в хеш-индексах файлов
+            case_indexes = {}
+            postings = []
+            for cords, segment in entries:
+                if segment not in case_indexes:
+                    case_indexes[segment] = get_case_index(files[segment])
+                postings.append((cords, segment, case_indexes[segment][pack_cords(cords, cord_size)][0]))
+            with inverted_index.inverted_index_lock(table_name):
+                for dim in dims:
+                    inverted_index.add_postings(table_name, dim, postings, cord_size)
+
+def delete_from_table(db_name, table_name, cords, log=True):
+    """Удаляет запись из таблицы; возвращает True, если она была найдена"""
+    if log and log_operations(db_name, [(OP_DELETE, table_name, cords, None)]) is not None:
+        try:
+            return _delete_from_table(db_name, table_name, cords)
+        finally:
+            _operations_applied(db_name, 1)
+    
+    return _delete_from_table(db_name, table_name, cords)
+
+def _delete_from_table(db_name, table_name, cords):
+    """Удаляет запись из таблицы без записи в журнал"""
+    for files in get_table_files(db_name, table_name).values():
+        if not files:
+            continue
+        
+        key = pack_case_key(files[0], cords)
+        for segment, file in enumerate(files):
+            if not _may_hold(file, cords, key):
+                continue
+            # Слот нужен инвертированным индексам, после удаления его в хеш-индексе уже нет
+            case = get_case_index(file).get(key)
+            if case and delete_case_from_file(file, cords):
+                _unindex_keys(table_name, files, [(cords, segment, case[0])])
+                return True
+    
+    return False
+
+def _unindex_keys(table_name, files, entries):
+    """Убирает удаленные записи [(координаты, номер файла, слот)] из индексов таблицы"""
+    cord_size = get_segment_layout(files[0]).cord_size
+    cords_list = [cords for cords, _, _ in entries]
+    with sorted_index.sorted_index_lock(table_name):
+        sorted_index.remove_keys(table_name, cords_list, cord_size)
+    with spatial_index.spatial_index_lock(table_name):
+        spatial_index.remove_points(table_name, cords_list, cord_size)
+    
+    dims = inverted_index.get_indexed_dims(table_name, len(cords_list[0]))
+    if dims:
+        with inverted_index.inverted_index_lock(table_name):
+            for dim in dims:
+                inverted_index.remove_postings(table_name, dim, entries, cord_size)
+
+def rebuild_table_indexes(db_name, table_name):
+    """Перестраивает упорядоченный и включенные пространственный и инвертированные индексы таблицы"""
+    files = next(iter(get_table_files(db_name, table_name).values()), [])
+    if not files:
+        return
+    
+    layout = get_segment_layout(files[0])
+    case_indexes = [get_case_index(file) for file in files]
+    with sorted_index.sorted_index_lock(table_name):
+        sorted_index.rebuild_sorted_index(table_name, case_indexes, layout.cord_size)
+    with spatial_index.spatial_index_lock(table_name):
+        if spatial_index.has_spatial_index(table_name):
+            spatial_index.rebuild_spatial_index(table_name, case_indexes, layout.cords, layout.cord_size)
+    
+    dims = inverted_index.get_indexed_dims(table_name, layout.cords)
+    if dims:
+        segments_info = [get_cases_info(file)[0] for file in files]
+        with inverted_index.inverted_index_lock(table_name):
+            for dim in dims:
+                inverted_index.rebuild_inverted_index(table_name, dim, segments_info, layout.cord_size)
+
+def _table_live_count(files):
+    """Возвращает количество живых записей в файлах таблицы; пока индексы не менялись, файлы не читаются"""
+    key = tuple(files)
+    # Поколение читается до подсчета: изменение во время подсчета заставит пересчитать в следующий раз
+    generation = get_index_generation()
+    cached = LIVE_COUNT_CACHE.get(key)
+    if cached and cached[0] == generation:
+        return cached[1]
+    
+    case_count = sum(get_live_count(file) for file in files)
+    LIVE_COUNT_CACHE[key] = (generation, case_count)
+    return case_count
+
+def get_sorted_index(db_name, table_name):
+    """Возвращает упорядоченный индекс таблицы (ключи, номера файлов), перестраивая его при необходимости"""
+    files = next(iter(get_table_files(db_name, table_name).values()), [])
+    if not files:
+        return [], []
+    
+    layout = get_segment_layout(files[0])
+    case_count = _table_live_count(files)
+    with sorted_index.sorted_index_lock(table_name):
+        result = sorted_index.load_sorted_index(table_name, layout.cords, case_count, layout.cord_size)
+        if result is None:
+            # Индекс отсутствует (таблица старой версии) или отстал от файлов после сбоя
+            result = sorted_index.rebuild_sorted_index(table_name, [get_case_index(file) for file in files],
+                                                       layout.cord_size)
+        # Копия нужна, чтобы параллельные вставки не меняли списки во время поиска
+        return list(result[0]), list(result[1])
+
+def select_range(db_name, table_name, lower_cords, upper_cords):
+    """Возвращает записи, все координаты которых лежат между lower_cords и upper_cords включительно"""
+    files = next(iter(get_table_files(db_name, table_name).values()), [])
+    if not files:
+        return []
+    
+    layout = get_segment_layout(files[0])
+    lower, upper = sorted_index.range_bounds(lower_cords, upper_cords, layout.cords, layout.cord_size)
+    # Если диапазон пуст или не пересекает границы координат ни одного файла, индекс не загружается
+    if sorted_index.is_empty_range(lower, upper) or not _overlapping_segments(files, lower, upper):
+        return []
+    
+    keys, segments = get_sorted_index(db_name, table_name)
+    matches = sorted_index.find_range(keys, segments, lower, upper, layout.cord_size)
+    
+    # Распаковываются только подходящие записи
+    found = _read_matches(files, matches)
+    
+    # Записи возвращаются в порядке координат
+    return [found[tuple(cords)] for cords, _ in matches if tuple(cords) in found]
+
+def _read_matches(files, matches):
+    """Читает записи [(координаты, номер файла)], по одному обращению к индексу на файл"""
+    by_segment = {}
+    for cords, segment in matches:
+        by_segment.setdefault(segment, []).append(list(cords))
+    
+    found = {}
+    for segment, cords_list in by_segment.items():
+        for cords, record in zip(cords_list, find_cases_in_file(files[segment], cords_list)):
+            if record:
+                found[tuple(cords)] = record
+    return found
+
+def create_spatial_index(db_name, table_name):
+    """Включает для таблицы пространственный индекс (k-d дерево) и строит его"""
+    files = next(iter(get_table_files(db_name, table_name).values()), [])
+    if not files:
+        return False
+    
+    layout = get_segment_layout(files[0])
+    with spatial_index.spatial_index_lock(table_name):
+        spatial_index.rebuild_spatial_index(table_name, [get_case_index(file) for file in files],
+                                            layout.cords, layout.cord_size)
+    return True
+
+def drop_spatial_index(db_name, table_name):
+    """Выключает пространственный индекс таблицы"""
+    with spatial_index.spatial_index_lock(table_name):
+        spatial_index.drop_spatial_index(table_name)
+
+def get_spatial_index(db_name, table_name):
+    """Возвращает пространственный индекс таблицы (точки, номера файлов, точек в дереве) или None, если он выключен"""
+    files = next(iter(get_table_files(db_name, table_name).values()), [])
+    if not files or not spatial_index.has_spatial_index(table_name):
+        return None
+    
+    layout = get_segment_layout(files[0])
+    case_count = _table_live_count(files)
+    with spatial_index.spatial_index_lock(table_name):
+        result = spatial_index.load_spatial_index(table_name, layout.cords, case_count, layout.cord_size)
+        if result is None:
+            result = spatial_index.rebuild_spatial_index(table_name, [get_case_index(file) for file in files],
+                                                         layout.cords, layout.cord_size)
+        return result
+
+def select_box(db_name, table_name, lower_cords, upper_cords):
+    """Возвращает записи внутри прямоугольника; без пространственного индекса работает как select_range"""
+    files = next(iter(get_table_files(db_name, table_name).values()), [])
+    if not files:
+        return []
+    
+    layout = get_segment_layout(files[0])
+    # Прямоугольник прижат к диапазону координат таблицы; пустой прямоугольник дерево не обходит
+    lower, upper = sorted_index.range_bounds(lower_cords, upper_cords, layout.cords, layout.cord_size)
+    if sorted_index.is_empty_range(lower, upper) or not _overlapping_segments(files, lower, upper):
+        return []
+    
+    spatial = get_spatial_index(db_name, table_name)
+    if spatial is None:
+        return select_range(db_name, table_name, lower_cords, upper_cords)
+    
+    points, segments, tree_count = spatial
+    matches = [(points[i], segments[i])
+               for i in spatial_index.query_box(points, tree_count, lower, upper, segments)]
+    # Удаление помечает точки на месте: точка, удаленная после обхода дерева, отбрасывается
+    matches = sorted(match for match in matches if match[1] is not None)
+    
+    found = _read_matches(files, matches)
+    return [found[point] for point, _ in matches if point in found]
+
+def find_nearest(db_name, table_name, cords, count=1):
+    """Возвращает до count записей, ближайших к координатам (евклидово расстояние), от ближней к дальней"""
+    files = next(iter(get_table_files(db_name, table_name).values()), [])
+    if not files:
+        return []
+    
+    spatial = get_spatial_index(db_name, table_name)
+    if spatial is None:
+        # Без пространственного индекса расстояния считаются по всем ключам упорядоченного индекса
+        keys, key_segments = get_sorted_index(db_name, table_name)
+        cord_size = get_segment_layout(files[0]).cord_size
+        points = [tuple(sorted_index.decode_key(key, cord_size)) for key in keys]
+        segments, tree_count = key_segments, 0
+    else:
+        points, segments, tree_count = spatial
+    
+    matches = [(points[i], segments[i])
+               for _, i in spatial_index.query_nearest(points, tree_count, cords, count, segments)]
+    matches = [match for match in matches if match[1] is not None]
+    found = _read_matches(files, matches)
+    return [found[point] for point, _ in matches if point in found]
+
+def resolve_dim(db_name, table_name, dim, cords_count):
+    """Возвращает номер измерения по номеру или имени колонки"""
+    if isinstance(dim, str) and not dim.isdigit():
+        for table_info in _load_tables(db_name).values():
+            if table_info['name'] == table_name:
+                for col_id, col_name in table_info['columns'].items():
+                    if col_name == dim:
+                        return col_id
+        raise ValueError(f"Колонка {dim} не найдена в таблице {table_name}")
+    
+    dim = int(dim)
+    if not 0 <= dim < cords_count:
+        raise ValueError(f"Измерение {dim} вне диапазона 0..{cords_count - 1}")
+    return dim
+
+def create_inverted_index(db_name, table_name, dim):
+    """Включает инвертированный индекс измерения (номер или имя колонки) и строит его"""
+    files = next(iter(get_table_files(db_name, table_name).values()), [])
+    if not files:
+        return False
+    
+    layout = get_segment_layout(files[0])
+    dim = resolve_dim(db_name, table_name, dim, layout.cords)
+    with inverted_index.inverted_index_lock(table_name):
+        inverted_index.rebuild_inverted_index(table_name, dim, [get_cases_info(file)[0] for file in files],
+                                              layout.cord_size)
+    return True
+
+def drop_inverted_index(db_name, table_name, dim):
+    """Выключает инвертированный индекс измерения"""
+    files = next(iter(get_table_files(db_name, table_name).values()), [])
+    if not files:
+        return
+    
+    dim = resolve_dim(db_name, table_name, dim, get_table_info(files[0])[0])
+    with inverted_index.inverted_index_lock(table_name):
+        inverted_index.drop_inverted_index(table_name, dim)
+
+def find_where(db_name, table_name, conditions):
+    """Возвращает записи, у которых заданные измерения {номер или имя колонки: значение} равны значениям"""
+    files = next(iter(get_table_files(db_name, table_name).values()), [])
+    if not files:
+        return []
+    
+    layout = get_segment_layout(files[0])
+    conditions = {resolve_dim(db_name, table_name, dim, layout.cords): value for dim, value in conditions.items()}
+    
+    # Файлы, в границы координат которых не попадают заданные значения, не читаются
+    bounds = [conditions.get(dim) for dim in range(layout.cords)]
+    overlapping = _overlapping_segments(files, bounds, bounds)
+    if not overlapping:
+        return []
+    case_count = _table_live_count(files)
+    
+    # Списки слотов по индексированным измерениям
+    postings = []
+    with inverted_index.inverted_index_lock(table_name):
+        for dim, value in conditions.items():
+            if not inverted_index.has_inverted_index(table_name, dim):
+                continue
+            dim_index = inverted_index.load_inverted_index(table_name, dim, case_count, layout.cord_size)
+            if dim_index is None:
+                dim_index = inverted_index.rebuild_inverted_index(
+                    table_name, dim, [get_cases_info(file)[0] for file in files], layout.cord_size)
+            postings.append(dim_index.get(value, []))
+    
+    if postings:
+        # Пересечение начинается с самого короткого списка
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(posting)
+    else:
+        # Индексов нет - отбор идет по массивам метаданных, данные распаковываются только у подходящих записей
+        candidates = set()
+        for segment in overlapping:
+            candidates.update((segment, slot) for slot in match_slots(files[segment], conditions))
+    
+    by_segment = {}
+    for segment, slot in candidates:
+        by_segment.setdefault(segment, []).append(slot)
+    
     results = []
+    for segment, slots in by_segment.items():
+        for record in read_cases_by_slots(files[segment], sorted(slots)):
+            # Условия по неиндексированным измерениям проверяются по координатам записи
+            if all(record[0][dim] == value for dim, value in conditions.items()):
+                results.append(record)
     
-    for files in table_files.values():
-        for file in files:
-            results.extend(read_all_cases(file))
+    results.sort(key=lambda record: record[0])
+    return results
+
+def cords_in_range(cords, lower_cords, upper_cords):
+    """Проверяет, лежат ли координаты между границами диапазона (None - граница отсутствует)"""
+    lower, upper = sorted_index.range_bounds(lower_cords, upper_cords, len(cords), MAX_CORD_SIZE)
+    return all(low <= cord <= high for cord, low, high in zip(cords, lower, upper))
+
+def _table_columns(db_name, table_name, with_values, use_numpy):
+    """Возвращает координаты файлов таблицы (по частям, в порядке слотов) и значения записей или None"""
+    files = next(iter(get_table_files(db_name, table_name).values()), [])
+    cords_parts = []
+    values = [] if with_values else None
+    for file in files:
+        slots = read_slot_arrays(file, use_numpy=use_numpy)
+        # Слоты удаленных записей имеют нулевую длину и в результат не попадают
+        if isinstance(slots.cords, list):
+            live_cords = [cords for cords, length in zip(slots.cords, slots.lengths) if length]
+        else:
+            live_cords = slots.cords[slots.lengths != 0]
+        cords_parts.append(live_cords)
+        if with_values:
+            # iter_cases тоже пропускает удаленные записи, поэтому значения идут в порядке прочитанных координат
+            values.extend(record[3] for record in itertools.islice(iter_cases(file), len(live_cords)))
+    return files, cords_parts, values
+
+def values_to_array(values):
+    """Собирает значения в массив NumPy: числовой для однородных чисел, иначе массив объектов"""
+    kinds = {type(value) for value in values}
+    if values and kinds <= {bool}:
+        return np.array(values, dtype=bool)
+    if values and kinds <= {int}:
+        try:
+            return np.array(values, dtype=np.int64)
+        except OverflowError:
+            pass
+    elif values and kinds <= {int, float}:
+        return np.array(values, dtype=np.float64)
+    
+    # Списки и кортежи не должны превращаться в дополнительные оси массива
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+def select_to_numpy(db_name, table_name, with_values=True):
+    """Возвращает координаты таблицы матрицей int64 (записи × измерения) и значения массивом или None"""
+    if np is None:
+        raise ImportError("Для select_to_numpy нужен пакет numpy (pip install marlib[numpy])")
+    
+    files, cords_parts, values = _table_columns(db_name, table_name, with_values, True)
+    if cords_parts:
+        cords = np.concatenate(cords_parts)
+    else:
+        cords = np.empty((0, 0), dtype=np.int64)
+    return cords, values_to_array(values) if with_values else None
+
+def select_columns(db_name, table_name, with_values=True):
+    """Возвращает координаты таблицы списком кортежей и значения списком или None (без NumPy)"""
+    _, cords_parts, values = _table_columns(db_name, table_name, with_values, False)
+    return [cords for part in cords_parts for cords in part], values
+
+def _init_scan_worker():
+    """Готовит процесс пула чтения: свои блокировки и отображения файлов, пул страниц выключен"""
+    reset_process_state()
+    # Запись в родительском процессе не сбрасывает страницы в пуле дочернего, поэтому файлы читаются напрямую
+    configure_buffer_pool(0)
+
+def get_scan_pool(workers):
+    """Возвращает пул процессов параллельного чтения таблиц заданного размера"""
+    with _SCAN_POOLS_GUARD:
+        pool = SCAN_POOLS.get(workers)
+        if pool is None:
+            pool = SCAN_POOLS[workers] = ProcessPoolExecutor(workers, initializer=_init_scan_worker)
+        return pool
+
+def shutdown_scan_pools():
+    """Останавливает процессы параллельного чтения таблиц"""
+    with _SCAN_POOLS_GUARD:
+        pools = list(SCAN_POOLS.values())
+        SCAN_POOLS.clear()
+    for pool in pools:
+        pool.shutdown()
+
+def _scan_segment(file_name, cases_dir):
+    """Читает и распаковывает все записи файла в процессе пула"""
+    records = read_all_cases(file_name, cases_dir)
+    # Данные десериализуются здесь, а не в родительском процессе, и приходят в LazyCase уже загруженными
+    for record in records:
+        record.data
+    return records
+
+def _scan_files(table_files, workers):
+    """Возвращает списки записей файлов таблицы по порядку; с workers > 1 файлы читаются параллельно"""
+    files = [file for files in table_files.values() for file in files]
+    if workers is None or workers <= 1 or len(files) < 2:
+        return (read_all_cases(file) for file in files)
+    
+    # Процессы пула могли запуститься в другом рабочем каталоге, поэтому путь к данным абсолютный
+    cases_dir = os.path.join(os.path.abspath(CASES_DIR), '')
+    return _scan_in_pool(files, cases_dir, workers)
+
+def _scan_in_pool(files, cases_dir, workers):
+    """Отдает записи файлов по порядку; в работе не больше workers * SCAN_PREFETCH файлов, поэтому
+    память родительского процесса не растет с размером таблицы"""
+    pool = get_scan_pool(workers)
+    files = iter(files)
+    futures = deque(pool.submit(_scan_segment, file, cases_dir)
+                    for file in itertools.islice(files, workers * SCAN_PREFETCH))
+    try:
+        while futures:
+            records = futures.popleft().result()
+            # Место освободившегося файла занимает следующий
+            for file in itertools.islice(files, 1):
+                futures.append(pool.submit(_scan_segment, file, cases_dir))
+            yield records
+    finally:
+        # Обход прерван: файлы, которые еще не начали читаться, не нужны
+        for future in futures:
+            future.cancel()
+
+def select_from_table(db_name, table_name, workers=SCAN_WORKERS):
+    """Возвращает все записи из таблицы; с workers > 1 файлы распаковываются параллельно в процессах"""
+    results = []
+    for records in _scan_files(get_table_files(db_name, table_name), workers):
+        results.extend(records)
+    return results
+
+def iter_table(db_name, table_name, batch_size=None, workers=SCAN_WORKERS):
+    """Лениво возвращает записи таблицы файл за файлом; с batch_size - списками такого размера"""
+    table_files = get_table_files(db_name, table_name)
+    if workers is not None and workers > 1:
+        # Файлы распаковываются в процессах пула, записи отдаются в порядке файлов
+        records = (record for records in _scan_files(table_files, workers) for record in records)
+    else:
+        records = (record
+                   for files in table_files.values()
+                   for file in files
+                   for record in iter_cases(file))
+    
+    if batch_size is None:
+        yield from records
+        return
+    
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def read_table_batch(db_name, table_name, cursor=None, batch_size=1000):
+    """Возвращает пачку записей таблицы и курсор [номер файла, слот] для следующей пачки"""
+    file_index, start = cursor or (0, 0)
+    records = []
+    
+    for files in get_table_files(db_name, table_name).values():
+        while file_index < len(files) and len(records) < batch_size:
+            # Курсор хранит номер слота: слоты удаленных записей пропускаются
+            for slot, record in iter_cases(files[file_index], start=start, with_slots=True):
+                records.append(record)
+                start = slot + 1
+                if len(records) >= batch_size:
+                    break
+            else:
+                # Файл прочитан полностью - переходим к следующему
+                file_index += 1
+                start = 0
+        
+        if file_index < len(files):
+            return records, [file_index, start]
+    
+    return records, None
+
+def get_database_fragmentation(db_name):
+    """Возвращает показатели фрагментации всех файлов записей базы данных"""
+    return [get_fragmentation(file_name)
+            for files in get_table_files(db_name).values()
+            for file_name in files]
+
+def defragment_database(db_name, threshold=None):
+    """Дефрагментирует файлы записей базы данных; с threshold - только файлы с фрагментацией выше порога"""
+    start_time = time.perf_counter()
+    stats = {'files': [], 'bytes_reclaimed': 0}
+    
+    for files in get_table_files(db_name).values():
+        for file_name in files:
+            if threshold is not None and get_fragmentation(file_name)['ratio'] <= threshold:
+                continue
+            file_stats = defragment_file(file_name)
+            stats['files'].append(file_stats)
+            stats['bytes_reclaimed'] += file_stats['bytes_reclaimed']
     
-    return results
\ No newline at end of file
+    stats['elapsed'] = time.perf_counter() - start_time
+    return stats
@@ -1,177 +1,1114 @@
 import os
 import time
+import mmap
+import struct
+import threading
+from collections import OrderedDict, namedtuple
 from .config import *
-from .serialization import create_case, unpack_case, create_cord_block
-# Глобальная переменная для отслеживания свободного пространства
-FREE_SPACE = {}
+from .serialization import create_case, unpack_case, unpack_case_lazy, create_cord_block
+from . import index
+from . import free_space
+from . import bloom_filter
 
-def create_cases_file(file_name, table_id, cords, cases_dir=CASES_DIR):
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Размер заголовка файла записей версии 1 (ID таблицы, координаты, максимум и счетчик записей)
+HEADER_SIZE = MAX_TABLES_IN_BD_B * 2 + MAX_CASES_IN_TABLE_B * 2
+# Сигнатура и версия файла записей версии 2
+SEGMENT_MAGIC = b'MARC'
+SEGMENT_VERSION = 2
+# Заголовок версии 2: сигнатура (4), версия (1), размер заголовка (2), ID таблицы (2), координаты (2),
+# ширина координаты (1), ширина длины данных (1), максимум (2) и счетчик (2) записей,
+# метод сжатия (1), порог сжатия (4), флаги (1), резерв
+SEGMENT_V2_HEADER_SIZE = 32
+SEGMENT_V2_COUNTER_POS = 15
+SEGMENT_V2_COMPRESSION_POS = 17
+COMPRESSION_THRESHOLD_SIZE = 4
+SEGMENT_V2_FLAGS_POS = 22
+# Флаг: за основным заголовком лежат границы координат - минимумы, затем максимумы по измерениям
+SEGMENT_FLAG_ZONE_MAP = 1
+SEGMENT_V2_ZONE_MAP_POS = SEGMENT_V2_HEADER_SIZE
+# Максимальное количество записей, которое помещается в поле заголовка
+MAX_CASES_LIMIT = 256 ** MAX_CASES_IN_TABLE_B - 1
+
+# Незавершенные пошаговые дефрагментации: {путь к файлу записей: SegmentCompaction}
+COMPACTIONS = {}
+# Отображения файлов записей в память: {путь: ((inode, размер), mmap)}
+SEGMENT_MAPS = {}
+# Блокировки файлов записей: запись и дефрагментация файла не пересекаются
+SEGMENT_LOCKS = {}
+_SEGMENT_LOCKS_GUARD = threading.Lock()
+
+# Коды struct/NumPy для целых со знаком, которые читаются одним полем
+_INT_CODES = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+
+# Слоты метаданных файла в виде параллельных массивов: координаты (по записи), позиции, длины данных.
+# С NumPy координаты - матрица int64 (записи × измерения), позиции и длины - массивы int64
+SlotArrays = namedtuple('SlotArrays', ['cords', 'positions', 'lengths'])
+
+# Неизменяемые параметры файла записей, прочитанные из заголовка
+SegmentLayout = namedtuple('SegmentLayout', ['version', 'header_size', 'counter_pos', 'table_id', 'cords',
+                                             'cord_size', 'len_size', 'max_cases', 'slot_size',
+                                             'compression', 'compress_threshold', 'zone_map'])
+
+class BufferPool:
+    """Пул страниц файлов записей фиксированного размера с вытеснением давно не использованных (LRU)"""
+
+    def __init__(self, capacity=BUFFER_POOL_SIZE, page_size=BUFFER_PAGE_SIZE):
+        """
+        :param capacity: Бюджет пула в байтах (0 - страницы не кэшируются)
+        :param page_size: Размер страницы в байтах
+        """
+        self.capacity = capacity
+        self.page_size = page_size
+        self.pages = OrderedDict()  # {(путь, номер страницы): bytes}, в начале - давно не использованные
+        self.file_pages = {}        # {путь: множество номеров страниц в пуле}
+        self.generations = {}       # {путь: номер поколения}, растет при каждой записи в файл
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _get_page(self, file_path, view, page_no):
+        """Возвращает страницу из пула или читает ее из отображения файла"""
+        key = (file_path, page_no)
+        with self._lock:
+            page = self.pages.get(key)
+            if page is not None:
+                self.pages.move_to_end(key)
+                self.hits += 1
+                return page
+            self.misses += 1
+            generation = self.generations.get(file_path, 0)
+        
+        start = page_no * self.page_size
+        page = bytes(view[start:start + self.page_size])
+        
+        with self._lock:
+            # Страница, прочитанная во время записи в файл, в пул не попадает
+            if self.generations.get(file_path, 0) == generation and key not in self.pages:
+                self.pages[key] = page
+                self.file_pages.setdefault(file_path, set()).add(page_no)
+                self.used += len(page)
+                self._evict()
+        return page
+
+    def _evict(self):
+        """Вытесняет давно не использованные страницы, пока пул не уложится в бюджет"""
+        while self.used > self.capacity and self.pages:
+            (file_path, page_no), page = self.pages.popitem(last=False)
+            self.file_pages[file_path].discard(page_no)
+            self.used -= len(page)
+            self.evictions += 1
+
+    def read(self, file_path, view, offset, length):
+        """Читает участок файла через пул"""
+        if not self.capacity or length <= 0:
+            return view[offset:offset + length]
+        
+        first_page = offset // self.page_size
+        last_page = (offset + length - 1) // self.page_size
+        start = offset - first_page * self.page_size
+        if first_page == last_page:
+            return self._get_page(file_path, view, first_page)[start:start + length]
+        
+        data = b''.join(self._get_page(file_path, view, page_no)
+                        for page_no in range(first_page, last_page + 1))
+        return data[start:start + length]
+
+    def invalidate(self, file_path, offset=0, length=None):
+        """Удаляет из пула страницы, затронутые записью в участок файла (весь файл, если length None)"""
+        with self._lock:
+            self.generations[file_path] = self.generations.get(file_path, 0) + 1
+            page_numbers = self.file_pages.get(file_path)
+            if not page_numbers:
+                return
+            
+            if length is None:
+                dropped = list(page_numbers)
+            else:
+                first_page = offset // self.page_size
+                last_page = (offset + max(length, 1) - 1) // self.page_size
+                dropped = [page_no for page_no in range(first_page, last_page + 1) if page_no in page_numbers]
+            
+            for page_no in dropped:
+                self.used -= len(self.pages.pop((file_path, page_no)))
+                page_numbers.discard(page_no)
+
+    def clear(self):
+        """Очищает пул и счетчики"""
+        with self._lock:
+            self.pages.clear()
+            self.file_pages.clear()
+            self.used = self.hits = self.misses = self.evictions = 0
+
+    def get_stats(self):
+        """Возвращает счетчики попаданий и промахов пула"""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / requests if requests else 0.0,
+                'evictions': self.evictions,
+                'pages': len(self.pages),
+                'used_bytes': self.used,
+                'capacity': self.capacity,
+                'page_size': self.page_size
+            }
+
+# Общий пул страниц всех файлов записей
+BUFFER_POOL = BufferPool()
+
+def configure_buffer_pool(capacity=BUFFER_POOL_SIZE, page_size=BUFFER_PAGE_SIZE):
+    """Пересоздает общий пул страниц с новым бюджетом и размером страницы"""
+    global BUFFER_POOL
+    BUFFER_POOL = BufferPool(capacity, page_size)
+    return BUFFER_POOL
+
+def get_buffer_pool_stats():
+    """Возвращает счетчики общего пула страниц"""
+    return BUFFER_POOL.get_stats()
+
+def get_slot_size(cords, cord_size=STANDART_CORD_SIZE, len_size=STANDART_LEN_SIZE):
+    """Возвращает размер слота метаданных одной записи"""
+    return cords * cord_size + BYTES_PLASE_IN_FILE + len_size + 1
+
+def create_cases_file(file_name, table_id, cords, cases_dir=CASES_DIR, max_cases=CASES_IN_FILE,
+                      cord_size=STANDART_CORD_SIZE, len_size=STANDART_LEN_SIZE, version=SEGMENT_VERSION,
+                      compression=0, compress_threshold=COMPRESSION_THRESHOLD):
     """Создает новый файл для хранения записей"""
+    if not 0 < max_cases <= MAX_CASES_LIMIT:
+        raise ValueError(f"Количество записей в файле должно быть от 1 до {MAX_CASES_LIMIT}")
+    if version == 1 and (cord_size, len_size) != (STANDART_CORD_SIZE, STANDART_LEN_SIZE):
+        raise ValueError("Файлы записей версии 1 поддерживают только стандартную ширину координат и длины")
+    if version == 1 and compression:
+        raise ValueError("Файлы записей версии 1 не поддерживают сжатие")
+    
     if not os.path.exists(cases_dir[:-1]):
         os.makedirs(cases_dir[:-1])
     
     file_path = os.path.join(cases_dir, file_name)
     with open(file_path, "wb") as f:
-        f.write(table_id.to_bytes(MAX_TABLES_IN_BD_B, 'big'))
-        f.write(cords.to_bytes(MAX_TABLES_IN_BD_B, 'big'))
-        f.write(CASES_IN_FILE.to_bytes(MAX_CASES_IN_TABLE_B, 'big'))
-        f.write(b'\x00' * MAX_CASES_IN_TABLE_B)  # Место для счетчика записей
+        if version == 1:
+            f.write(table_id.to_bytes(MAX_TABLES_IN_BD_B, 'big'))
+            f.write(cords.to_bytes(MAX_TABLES_IN_BD_B, 'big'))
+            f.write(max_cases.to_bytes(MAX_CASES_IN_TABLE_B, 'big'))
+            f.write(b'\x00' * MAX_CASES_IN_TABLE_B)  # Место для счетчика записей
+        else:
+            header = (SEGMENT_MAGIC +
+                      SEGMENT_VERSION.to_bytes(1, 'big') +
+                      get_v2_header_size(cords, cord_size).to_bytes(2, 'big') +
+                      table_id.to_bytes(MAX_TABLES_IN_BD_B, 'big') +
+                      cords.to_bytes(MAX_TABLES_IN_BD_B, 'big') +
+                      cord_size.to_bytes(1, 'big') +
+                      len_size.to_bytes(1, 'big') +
+                      max_cases.to_bytes(MAX_CASES_IN_TABLE_B, 'big') +
+                      b'\x00' * MAX_CASES_IN_TABLE_B +  # Место для счетчика записей
+                      _pack_compression(compression, compress_threshold) +
+                      SEGMENT_FLAG_ZONE_MAP.to_bytes(1, 'big'))
+            f.write(header.ljust(SEGMENT_V2_HEADER_SIZE, b'\x00'))
+            # Границы координат пустого файла не содержат ни одной точки
+            f.write(_pack_bounds(*_empty_bounds(cords, cord_size), cord_size))
         
-        # Записываем пустые слоты для записей
-        for _ in range(CASES_IN_FILE):
-            f.write(b'\x00' * (cords * STANDART_CORD_SIZE) + 
-                   b'\x00' * BYTES_PLASE_IN_FILE + 
-                   b'\x00' * (STANDART_LEN_SIZE + 1))
+        # Записываем пустые слоты для записей одним блоком
+        f.write(b'\x00' * (get_slot_size(cords, cord_size, len_size) * max_cases))
+    
+    # Фильтр Блума нового файла пуст; он же заменяет фильтр прежнего файла с тем же именем
+    bloom_filter.rebuild_bloom(file_name, (), max_cases, cases_dir)
 
-def get_table_id(file_name, cases_dir=CASES_DIR):
-    """Возвращает ID таблицы из файла"""
+def get_v2_header_size(cords, cord_size=STANDART_CORD_SIZE):
+    """Возвращает размер заголовка файла записей версии 2 вместе с границами координат"""
+    return SEGMENT_V2_HEADER_SIZE + 2 * cords * cord_size
+
+def _empty_bounds(cords, cord_size):
+    """Возвращает границы пустого файла: каждый минимум больше максимума"""
+    limit = 1 << (cord_size * 8 - 1)
+    return [limit - 1] * cords, [-limit] * cords
+
+def _extend_bounds(mins, maxs, cords_list):
+    """Возвращает границы, расширенные так, чтобы покрыть координаты cords_list"""
+    columns = list(zip(*cords_list))
+    if not columns:
+        return list(mins), list(maxs)
+    return ([min(low, min(column)) for low, column in zip(mins, columns)],
+            [max(high, max(column)) for high, column in zip(maxs, columns)])
+
+def _pack_bounds(mins, maxs, cord_size):
+    """Упаковывает границы координат для заголовка файла записей"""
+    return create_cord_block(list(mins) + list(maxs), cord_size)
+
+def _pack_compression(compression, compress_threshold):
+    """Упаковывает параметры сжатия для заголовка файла записей"""
+    return compression.to_bytes(1, 'big') + compress_threshold.to_bytes(COMPRESSION_THRESHOLD_SIZE, 'big')
+
+def set_segment_compression(file_name, compression, compress_threshold=COMPRESSION_THRESHOLD, cases_dir=CASES_DIR):
+    """Меняет параметры сжатия файла записей; уже записанные записи не перепаковываются"""
+    with segment_lock(file_name, cases_dir):
+        layout = get_segment_layout(file_name, cases_dir)
+        if layout.version == 1:
+            if compression:
+                raise ValueError("Файлы записей версии 1 не поддерживают сжатие")
+            return
+        
+        file_path = os.path.join(cases_dir, file_name)
+        with open(file_path, "rb+") as f:
+            f.seek(SEGMENT_V2_COMPRESSION_POS)
+            f.write(_pack_compression(compression, compress_threshold))
+        BUFFER_POOL.invalidate(file_path, 0, layout.header_size)
+
+def reset_process_state():
+    """Сбрасывает блокировки, отображения и пул страниц, унаследованные дочерним процессом"""
+    global _SEGMENT_LOCKS_GUARD, BUFFER_POOL
+    # Блокировку, захваченную потоком родителя в момент fork, в дочернем процессе никто не отпустит
+    SEGMENT_LOCKS.clear()
+    _SEGMENT_LOCKS_GUARD = threading.Lock()
+    SEGMENT_MAPS.clear()
+    BUFFER_POOL = BufferPool(BUFFER_POOL.capacity, BUFFER_POOL.page_size)
+
+def segment_lock(file_name, cases_dir=CASES_DIR):
+    """Возвращает блокировку файла записей"""
     file_path = os.path.join(cases_dir, file_name)
+    with _SEGMENT_LOCKS_GUARD:
+        return SEGMENT_LOCKS.setdefault(file_path, threading.RLock())
+
+def _release_map(mapped):
+    """Закрывает отображение; если им еще пользуются читатели, его закроет сборщик мусора"""
+    try:
+        mapped.close()
+    except BufferError:
+        pass
+
+def get_segment_view(file_name, cases_dir=CASES_DIR):
+    """Возвращает memoryview файла записей, отображенного в память"""
+    file_path = os.path.join(cases_dir, file_name)
+    stat = os.stat(file_path)
+    stamp = (stat.st_ino, stat.st_size)
+    
+    cached = SEGMENT_MAPS.get(file_path)
+    if cached and cached[0] == stamp:
+        return memoryview(cached[1])
+    
+    # Файл вырос, сжался или был заменен - отображаем его заново;
+    # у каждого читателя свой memoryview, поэтому начатые чтения продолжают работать
+    if cached:
+        _release_map(cached[1])
+    
     with open(file_path, "rb") as f:
-        return int.from_bytes(f.read(MAX_TABLES_IN_BD_B), 'big')
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    SEGMENT_MAPS[file_path] = (stamp, mapped)
+    return memoryview(mapped)
+
+def close_segment_map(file_name, cases_dir=CASES_DIR):
+    """Закрывает отображение файла записей перед его заменой"""
+    file_path = os.path.join(cases_dir, file_name)
+    BUFFER_POOL.invalidate(file_path)
+    cached = SEGMENT_MAPS.pop(file_path, None)
+    if cached:
+        _release_map(cached[1])
+
+def read_layout(header):
+    """Разбирает заголовок файла записей любой версии"""
+    if bytes(header[:len(SEGMENT_MAGIC)]) == SEGMENT_MAGIC:
+        version = header[4]
+        header_size = int.from_bytes(header[5:7], 'big')
+        table_id = int.from_bytes(header[7:9], 'big')
+        cords = int.from_bytes(header[9:11], 'big')
+        cord_size = header[11]
+        len_size = header[12]
+        max_cases = int.from_bytes(header[13:SEGMENT_V2_COUNTER_POS], 'big')
+        counter_pos = SEGMENT_V2_COUNTER_POS
+        compression = header[SEGMENT_V2_COMPRESSION_POS]
+        threshold_pos = SEGMENT_V2_COMPRESSION_POS + 1
+        compress_threshold = int.from_bytes(header[threshold_pos:threshold_pos + COMPRESSION_THRESHOLD_SIZE], 'big')
+        # Файлы, созданные до появления границ координат, их не хранят
+        zone_map = bool(header[SEGMENT_V2_FLAGS_POS] & SEGMENT_FLAG_ZONE_MAP)
+    else:
+        # Версия 1: ширина полей задана константами
+        version = 1
+        header_size = HEADER_SIZE
+        table_id = int.from_bytes(header[:MAX_TABLES_IN_BD_B], 'big')
+        cords = int.from_bytes(header[MAX_TABLES_IN_BD_B:MAX_TABLES_IN_BD_B * 2], 'big')
+        cord_size = STANDART_CORD_SIZE
+        len_size = STANDART_LEN_SIZE
+        counter_pos = MAX_TABLES_IN_BD_B * 2 + MAX_CASES_IN_TABLE_B
+        max_cases = int.from_bytes(header[MAX_TABLES_IN_BD_B * 2:counter_pos], 'big')
+        compression = 0
+        compress_threshold = COMPRESSION_THRESHOLD
+        zone_map = False
+    
+    return SegmentLayout(version, header_size, counter_pos, table_id, cords, cord_size, len_size,
+                         max_cases, get_slot_size(cords, cord_size, len_size), compression, compress_threshold,
+                         zone_map)
+
+def get_segment_layout(file_name, cases_dir=CASES_DIR):
+    """Возвращает параметры файла записей из его заголовка"""
+    return read_layout(get_segment_view(file_name, cases_dir)[:SEGMENT_V2_HEADER_SIZE])
+
+def get_segment_bounds(file_name, cases_dir=CASES_DIR):
+    """Возвращает границы координат файла (минимумы, максимумы) или None, если заголовок их не хранит"""
+    view = get_segment_view(file_name, cases_dir)
+    layout = read_layout(view[:SEGMENT_V2_HEADER_SIZE])
+    if not layout.zone_map:
+        return None
+    
+    raw = view[SEGMENT_V2_ZONE_MAP_POS:SEGMENT_V2_ZONE_MAP_POS + 2 * layout.cords * layout.cord_size]
+    if layout.cord_size in _INT_CODES:
+        values = struct.unpack(f'>{2 * layout.cords}{_INT_CODES[layout.cord_size]}', raw)
+    else:
+        values = [int.from_bytes(raw[offset:offset + layout.cord_size], 'big', signed=True)
+                  for offset in range(0, len(raw), layout.cord_size)]
+    return list(values[:layout.cords]), list(values[layout.cords:])
+
+def segment_overlaps(file_name, lower_cords, upper_cords, cases_dir=CASES_DIR):
+    """Проверяет по границам координат, могут ли в файле быть записи между lower_cords и upper_cords (None - без границы)"""
+    bounds = get_segment_bounds(file_name, cases_dir)
+    if bounds is None:
+        return True
+    
+    return all((low is None or low <= high_bound) and (high is None or high >= low_bound)
+               for low, high, low_bound, high_bound in zip(lower_cords, upper_cords, *bounds))
+
+def _widen_bounds(f, file_name, layout, cords_list, cases_dir=CASES_DIR):
+    """Расширяет границы координат в заголовке открытого файла до новых записей"""
+    if not layout.zone_map:
+        return
+    
+    bounds = get_segment_bounds(file_name, cases_dir)
+    new_bounds = _extend_bounds(*bounds, cords_list)
+    if list(new_bounds) != list(bounds):
+        packed = _pack_bounds(*new_bounds, layout.cord_size)
+        f.seek(SEGMENT_V2_ZONE_MAP_POS)
+        f.write(packed)
+        f.flush()
+        BUFFER_POOL.invalidate(os.path.join(cases_dir, file_name), SEGMENT_V2_ZONE_MAP_POS, len(packed))
+
+def _read_case_count(view, layout):
+    """Читает счетчик записей из заголовка"""
+    return int.from_bytes(view[layout.counter_pos:layout.counter_pos + MAX_CASES_IN_TABLE_B], 'big')
+
+def get_table_id(file_name, cases_dir=CASES_DIR):
+    """Возвращает ID таблицы из файла"""
+    return get_segment_layout(file_name, cases_dir).table_id
 
 def get_table_info(file_name, cases_dir=CASES_DIR):
     """Возвращает информацию о таблице"""
-    file_path = os.path.join(cases_dir, file_name)
-    with open(file_path, "rb") as f:
-        f.seek(MAX_TABLES_IN_BD_B)
-        cords = int.from_bytes(f.read(MAX_TABLES_IN_BD_B), 'big')
-        max_cases = int.from_bytes(f.read(MAX_CASES_IN_TABLE_B), 'big')
-        case_count = int.from_bytes(f.read(MAX_CASES_IN_TABLE_B), 'big')
-        return cords, max_cases, case_count, max_cases - case_count
+    view = get_segment_view(file_name, cases_dir)
+    layout = read_layout(view[:SEGMENT_V2_HEADER_SIZE])
+    case_count = _read_case_count(view, layout)
+    return layout.cords, layout.max_cases, case_count, layout.max_cases - case_count
 
-def get_cases_info(file_name, cases_dir=CASES_DIR):
-    """Возвращает информацию о записях в файле"""
-    cords, max_cases, case_count, free_slots = get_table_info(file_name, cases_dir)
+def is_file_full(file_name, cases_dir=CASES_DIR):
+    """Проверяет, заняты ли все слоты метаданных в файле (слоты удаленных записей свободны)"""
+    return get_table_info(file_name, cases_dir)[3] <= 0 and not get_free_slots(file_name, cases_dir)
+
+def _decode_slots_struct(metadata, layout, case_count):
+    """Декодирует блок метаданных через struct.iter_unpack"""
+    if not case_count:
+        return SlotArrays([], [], [])
     
-    file_path = os.path.join(cases_dir, file_name)
-    with open(file_path, "rb") as f:
-        # Пропускаем заголовок
-        f.seek(MAX_TABLES_IN_BD_B * 2 + MAX_CASES_IN_TABLE_B * 2)
-        
-        cases = []
-        for _ in range(case_count):
-            cord_data = f.read(cords * STANDART_CORD_SIZE)
-            position = int.from_bytes(f.read(BYTES_PLASE_IN_FILE), 'big')
-            data_len = int.from_bytes(f.read(STANDART_LEN_SIZE + 1), 'big')
-            
-            # Извлекаем координаты
-            case_cords = []
-            for i in range(cords):
-                start = i * STANDART_CORD_SIZE
-                end = start + STANDART_CORD_SIZE
-                cord_val = int.from_bytes(cord_data[start:end], 'big', signed=True)
-                case_cords.append(cord_val)
-            
-            cases.append({
-                'cords': case_cords,
-                'position': position,
-                'length': data_len,
-                'current_pos': f.tell() - (BYTES_PLASE_IN_FILE + STANDART_LEN_SIZE + 1)
-            })
-        
-        return cases, cords
+    cord_code = _INT_CODES.get(layout.cord_size, f'{layout.cord_size}s')
+    slot_format = f">{cord_code * layout.cords}{BYTES_PLASE_IN_FILE}s{layout.len_size + 1}s"
+    
+    # Столбцы слотов: координаты по измерениям, затем позиции и длины
+    columns = list(zip(*struct.iter_unpack(slot_format, metadata[:case_count * layout.slot_size])))
+    cord_columns = columns[:layout.cords]
+    if len(cord_code) > 1:
+        # Ширина координаты без собственного кода struct
+        cord_columns = [[int.from_bytes(value, 'big', signed=True) for value in column] for column in cord_columns]
+    
+    return SlotArrays(list(zip(*cord_columns)),
+                      [int.from_bytes(value, 'big') for value in columns[layout.cords]],
+                      [int.from_bytes(value, 'big') for value in columns[layout.cords + 1]])
+
+def _bytes_to_int(matrix):
+    """Собирает беззнаковые big-endian целые из последней оси матрицы байт NumPy"""
+    weights = 256 ** np.arange(matrix.shape[-1] - 1, -1, -1, dtype=np.int64)
+    return matrix.astype(np.int64) @ weights
+
+def _decode_slots_numpy(metadata, layout, case_count):
+    """Декодирует блок метаданных структурированным массивом NumPy"""
+    if layout.cord_size in _INT_CODES:
+        cord_field = ('cords', f'>{_INT_CODES[layout.cord_size]}', (layout.cords,))
+    else:
+        cord_field = ('cords', 'u1', (layout.cords, layout.cord_size))
+    dtype = np.dtype([cord_field,
+                      ('position', 'u1', (BYTES_PLASE_IN_FILE,)),
+                      ('length', 'u1', (layout.len_size + 1,))])
+    slots = np.frombuffer(metadata, dtype=dtype, count=case_count)
+    
+    if layout.cord_size in _INT_CODES:
+        cords = slots['cords'].astype(np.int64)
+    else:
+        # Беззнаковое значение переводится в число со знаком по старшему биту
+        cords = _bytes_to_int(slots['cords'])
+        cords = np.where(cords >= 1 << (layout.cord_size * 8 - 1), cords - (1 << (layout.cord_size * 8)), cords)
+    return SlotArrays(cords.reshape(case_count, layout.cords),
+                      _bytes_to_int(slots['position']), _bytes_to_int(slots['length']))
+
+def decode_slots(metadata, layout, case_count, use_numpy=None):
+    """Декодирует блок метаданных в SlotArrays; use_numpy=None - NumPy, если он установлен"""
+    if use_numpy is None:
+        use_numpy = np is not None
+    if use_numpy:
+        if np is None:
+            raise ImportError("Для декодирования метаданных в массивы NumPy нужен пакет numpy")
+        return _decode_slots_numpy(metadata, layout, case_count)
+    return _decode_slots_struct(metadata, layout, case_count)
+
+def read_slot_arrays(file_name, cases_dir=CASES_DIR, use_numpy=None):
+    """Читает блок метаданных файла одним чтением и декодирует его в параллельные массивы"""
+    view = get_segment_view(file_name, cases_dir)
+    layout = read_layout(view[:SEGMENT_V2_HEADER_SIZE])
+    case_count = _read_case_count(view, layout)
+    metadata = BUFFER_POOL.read(os.path.join(cases_dir, file_name), view, layout.header_size,
+                                case_count * layout.slot_size)
+    return decode_slots(bytes(metadata), layout, case_count, use_numpy)
+
+def match_slots(file_name, conditions, cases_dir=CASES_DIR, use_numpy=None):
+    """Возвращает слоты записей, у которых измерения {номер: значение} равны значениям"""
+    slots = read_slot_arrays(file_name, cases_dir, use_numpy)
+    if isinstance(slots.cords, list):
+        return [slot for slot, (cords, length) in enumerate(zip(slots.cords, slots.lengths))
+                if length and all(cords[dim] == value for dim, value in conditions.items())]
+    
+    # Сравнение идет сразу по столбцам матрицы координат; слоты удаленных записей имеют нулевую длину
+    mask = slots.lengths != 0
+    for dim, value in conditions.items():
+        mask &= slots.cords[:, dim] == value
+    return np.flatnonzero(mask).tolist()
+
+def get_cases_info(file_name, cases_dir=CASES_DIR, with_deleted=False):
+    """Возвращает информацию о записях в файле; with_deleted - вместе со слотами удаленных записей"""
+    layout = get_segment_layout(file_name, cases_dir)
+    slots = read_slot_arrays(file_name, cases_dir)
+    if np is not None:
+        slots = SlotArrays(slots.cords.tolist(), slots.positions.tolist(), slots.lengths.tolist())
+    
+    # Позиция слота указывает на поле позиции данных, сразу после координат
+    first_pos = layout.header_size + layout.cords * layout.cord_size
+    cases = [{
+        'cords': list(cords),
+        'slot': slot,
+        'position': position,
+        'length': length,
+        'current_pos': first_pos + slot * layout.slot_size
+    } for slot, (cords, position, length) in enumerate(zip(slots.cords, slots.positions, slots.lengths))
+        if length or with_deleted]
+    
+    return cases, layout.cords
+
+def get_case_index(file_name, cases_dir=CASES_DIR):
+    """Возвращает хеш-индекс файла {упакованные координаты: (слот, позиция, длина)}"""
+    view = get_segment_view(file_name, cases_dir)
+    layout = read_layout(view[:SEGMENT_V2_HEADER_SIZE])
+    case_count = _read_case_count(view, layout)
+    case_index = index.load_index(file_name, layout.cords, case_count, cases_dir, layout.cord_size, layout.len_size)
+    
+    if case_index is None:
+        # Индекс отсутствует или не совпадает с файлом - строим по метаданным
+        cases_info, _ = get_cases_info(file_name, cases_dir, with_deleted=True)
+        case_index = index.rebuild_index(file_name, cases_info, cases_dir, layout.cord_size, layout.len_size)
+    
+    return case_index
+
+def get_free_slots(file_name, cases_dir=CASES_DIR):
+    """Возвращает множество слотов удаленных записей, которые займут следующие вставки"""
+    get_case_index(file_name, cases_dir)
+    return index.get_free_slots(file_name, cases_dir)
+
+def get_live_count(file_name, cases_dir=CASES_DIR):
+    """Возвращает количество записей файла без удаленных"""
+    return len(get_case_index(file_name, cases_dir))
+
+def pack_case_key(file_name, cords, cases_dir=CASES_DIR):
+    """Упаковывает координаты в ключ хеш-индекса файла с учетом ширины его координат"""
+    return index.pack_cords(cords, get_segment_layout(file_name, cases_dir).cord_size)
+
+def get_bloom_filter(file_name, cases_dir=CASES_DIR):
+    """Возвращает фильтр Блума ключей файла, строя его по хеш-индексу при необходимости"""
+    bloom = bloom_filter.load_bloom(file_name, cases_dir)
+    if bloom is None:
+        # Фильтр строится под блокировкой файла, чтобы в него не опоздала параллельная вставка
+        with segment_lock(file_name, cases_dir):
+            bloom = bloom_filter.load_bloom(file_name, cases_dir)
+            if bloom is None:
+                bloom = bloom_filter.rebuild_bloom(file_name, get_case_index(file_name, cases_dir),
+                                                   get_segment_layout(file_name, cases_dir).max_cases, cases_dir)
+    return bloom
+
+def might_contain(file_name, key, cases_dir=CASES_DIR):
+    """Проверяет по фильтру Блума, может ли в файле быть запись с упакованным ключом"""
+    return key in get_bloom_filter(file_name, cases_dir)
+
+def _allocate_position(f, file_name, size, cases_dir=CASES_DIR):
+    """Возвращает позицию для данных: свободный участок файла или его конец"""
+    position = free_space.allocate_space(file_name, size, cases_dir)
+    if position is None:
+        # Если свободного места нет, записываем в конец файла
+        position = f.seek(0, 2)
+    return position
 
 def write_case_to_file(file_name, cords, data, cases_dir=CASES_DIR):
     """Записывает запись в файл"""
-    cases_info, cords_count = get_cases_info(file_name, cases_dir)
-    file_path = os.path.join(cases_dir, file_name)
-    
-    # Проверяем, существует ли уже запись с такими координатами
-    existing_case = None
-    for case in cases_info:
-        if case['cords'] == cords:
-            existing_case = case
-            break
-    
-    # Сериализуем данные
-    serialized_data = create_case(cords, data, STANDART_CORD_SIZE, BASED_RESERV_SIZE)
-    
-    with open(file_path, "rb+") as f:
-        if existing_case:
-            # Если запись существует, проверяем, достаточно ли места
-            if existing_case['length'] >= len(serialized_data):
-                # Перезаписываем существующую запись
-                f.seek(existing_case['position'])
+    with segment_lock(file_name, cases_dir):
+        cords_count, max_cases, case_count, free_slots = get_table_info(file_name, cases_dir)
+        layout = get_segment_layout(file_name, cases_dir)
+        file_path = os.path.join(cases_dir, file_name)
+        
+        # Проверяем, существует ли уже запись с такими координатами
+        key = index.pack_cords(cords, layout.cord_size)
+        existing_case = get_case_index(file_name, cases_dir).get(key)
+        deleted_slots = index.get_free_slots(file_name, cases_dir)
+        
+        # Новую запись некуда записать, если все слоты метаданных заняты
+        if existing_case is None and free_slots <= 0 and not deleted_slots:
+            return False
+        
+        # Сериализуем данные
+        serialized_data = create_case(cords, data, layout.cord_size, BASED_RESERV_SIZE, layout.len_size,
+                                          layout.compression, layout.compress_threshold)
+        
+        with open(file_path, "rb+") as f:
+            if existing_case:
+                slot, position, length = existing_case
+                # Если запись существует, проверяем, достаточно ли места
+                _mark_dirty(file_path, [slot])
+                if length >= len(serialized_data):
+                    # Перезаписываем существующую запись
+                    f.seek(position)
+                    f.write(serialized_data)
+                    f.flush()
+                    BUFFER_POOL.invalidate(file_path, position, len(serialized_data))
+                    return True
+                
+                # Переносим запись на новое место и обновляем ее слот метаданных
+                new_position = _allocate_position(f, file_name, len(serialized_data), cases_dir)
+                f.seek(new_position)
                 f.write(serialized_data)
-                return True
+                
+                slot_pos = layout.header_size + slot * layout.slot_size + cords_count * layout.cord_size
+                f.seek(slot_pos)
+                f.write(new_position.to_bytes(BYTES_PLASE_IN_FILE, 'big'))
+                f.write(len(serialized_data).to_bytes(layout.len_size + 1, 'big'))
+                f.flush()
+                BUFFER_POOL.invalidate(file_path, new_position, len(serialized_data))
+                BUFFER_POOL.invalidate(file_path, slot_pos, BYTES_PLASE_IN_FILE + layout.len_size + 1)
+                
+                index.update_index(file_name, cords, slot, new_position, len(serialized_data),
+                                   case_count, cases_dir, layout.cord_size, layout.len_size)
             else:
-                # Помечаем старое место как свободное
-                if existing_case['length'] not in FREE_SPACE:
-                    FREE_SPACE[existing_case['length']] = []
-                FREE_SPACE[existing_case['length']].append(existing_case['position'])
-        else:
-            # Ищем свободное место
-            free_position = None
-            for size in sorted(FREE_SPACE.keys()):
-                if size >= len(serialized_data) and FREE_SPACE[size]:
-                    free_position = FREE_SPACE[size].pop(0)
-                    if not FREE_SPACE[size]:
-                        del FREE_SPACE[size]
-                    break
-            
-            if free_position is None:
-                # Если свободного места нет, записываем в конец файла
-                f.seek(0, 2)
-                free_position = f.tell()
+                # Ключ попадает в фильтр Блума раньше записи: после сбоя в фильтре может оказаться
+                # лишний ключ, но не может не хватить существующего
+                bloom_filter.add_bloom_keys(file_name, [key], cases_dir)
+                # Границы координат тоже расширяются до записи
+                _widen_bounds(f, file_name, layout, [cords], cases_dir)
+                
+                # Ищем свободное место
+                free_position = _allocate_position(f, file_name, len(serialized_data), cases_dir)
+                
+                # Записываем данные
+                f.seek(free_position)
+                f.write(serialized_data)
+                
+                # Слот удаленной записи занимается раньше нового, счетчик записей при этом не меняется
+                if deleted_slots:
+                    slot = min(deleted_slots)
+                    new_count = case_count
+                else:
+                    slot = case_count
+                    new_count = case_count + 1
+                _mark_dirty(file_path, [slot])
+                
+                # Записываем метаданные записи
+                metadata_pos = layout.header_size + slot * layout.slot_size
+                f.seek(metadata_pos)
+                f.write(create_cord_block(cords, layout.cord_size))
+                f.write(free_position.to_bytes(BYTES_PLASE_IN_FILE, 'big'))
+                f.write(len(serialized_data).to_bytes(layout.len_size + 1, 'big'))
+                
+                # Счетчик записей пишется последним: до него запись не видна при чтении
+                if new_count != case_count:
+                    f.seek(layout.counter_pos)
+                    f.write(new_count.to_bytes(MAX_CASES_IN_TABLE_B, 'big'))
+                f.flush()
+                
+                # Страницы пула с данными, слотом и счетчиком больше не актуальны
+                BUFFER_POOL.invalidate(file_path, free_position, len(serialized_data))
+                BUFFER_POOL.invalidate(file_path, metadata_pos, layout.slot_size)
+                BUFFER_POOL.invalidate(file_path, 0, layout.header_size)
+                
+                index.update_index(file_name, cords, slot, free_position, len(serialized_data),
+                                   new_count, cases_dir, layout.cord_size, layout.len_size)
+                return True
+        
+        # Старое место записи возвращается в карту свободного пространства файла
+        free_space.release_space(file_name, position, length, cases_dir)
+        return True
+
+def write_cases_to_file(file_name, cases, cases_dir=CASES_DIR):
+    """Дописывает пачку новых записей [(координаты, данные)] в файл; возвращает количество записанных"""
+    with segment_lock(file_name, cases_dir):
+        cords_count, max_cases, case_count, free_slots = get_table_info(file_name, cases_dir)
+        # Индекс должен соответствовать файлу до дописывания новых записей
+        get_case_index(file_name, cases_dir)
+        
+        # Сначала занимаются слоты удаленных записей, затем новые слоты после счетчика
+        reused_slots = sorted(index.get_free_slots(file_name, cases_dir))
+        cases = cases[:len(reused_slots) + free_slots]
+        if not cases:
+            return 0
+        reused_slots = reused_slots[:len(cases)]
+        new_count = case_count + len(cases) - len(reused_slots)
+        
+        layout = get_segment_layout(file_name, cases_dir)
+        file_path = os.path.join(cases_dir, file_name)
+        slot_size = layout.slot_size
+        cords_size = cords_count * layout.cord_size
+        
+        _mark_dirty(file_path, reused_slots + list(range(case_count, new_count)))
+        with open(file_path, "rb+") as f:
+            # Данные всех записей пишутся в конец файла одним блоком
+            data_start = f.seek(0, 2)
+            payloads = []
+            metadata = []
+            entries = []
+            position = data_start
+            for slot, (cords, data) in zip(reused_slots + list(range(case_count, new_count)), cases):
+                serialized_data = create_case(cords, data, layout.cord_size, BASED_RESERV_SIZE, layout.len_size,
+                                              layout.compression, layout.compress_threshold)
+                payloads.append(serialized_data)
+                # Блок координат записи уже собран сразу после флага
+                metadata.append(serialized_data[1:1 + cords_size] +
+                                position.to_bytes(BYTES_PLASE_IN_FILE, 'big') +
+                                len(serialized_data).to_bytes(layout.len_size + 1, 'big'))
+                entries.append((cords, slot, position, len(serialized_data)))
+                position += len(serialized_data)
             
-            # Записываем данные
-            f.seek(free_position)
-            f.write(serialized_data)
+            # Ключи попадают в фильтр Блума, а координаты - в границы файла раньше записей
+            bloom_filter.add_bloom_keys(file_name, [payload[1:1 + cords_size] for payload in payloads], cases_dir)
+            _widen_bounds(f, file_name, layout, [cords for cords, _ in cases], cases_dir)
+            f.seek(data_start)
+            f.write(b''.join(payloads))
             
-            # Обновляем информацию о записи
-            f.seek(MAX_TABLES_IN_BD_B * 2 + MAX_CASES_IN_TABLE_B)
-            case_count = int.from_bytes(f.read(MAX_CASES_IN_TABLE_B), 'big')
-            f.seek(MAX_TABLES_IN_BD_B * 2 + MAX_CASES_IN_TABLE_B)
-            f.write((case_count + 1).to_bytes(MAX_CASES_IN_TABLE_B, 'big'))
+            # Слоты удаленных записей переписываются по одному
+            for slot, slot_data in zip(reused_slots, metadata):
+                f.seek(layout.header_size + slot * slot_size)
+                f.write(slot_data)
             
-            # Записываем метаданные записи
-            metadata_pos = MAX_TABLES_IN_BD_B * 2 + MAX_CASES_IN_TABLE_B * 2 + case_count * (cords_count * STANDART_CORD_SIZE + BYTES_PLASE_IN_FILE + STANDART_LEN_SIZE + 1)
-            f.seek(metadata_pos)
-            f.write(create_cord_block(cords, STANDART_CORD_SIZE))
-            f.write(free_position.to_bytes(BYTES_PLASE_IN_FILE, 'big'))
-            f.write(len(serialized_data).to_bytes(STANDART_LEN_SIZE + 1, 'big'))
+            # Новые слоты метаданных идут подряд, начиная с первого свободного
+            f.seek(layout.header_size + case_count * slot_size)
+            f.write(b''.join(metadata[len(reused_slots):]))
             
-            return True
+            # Счетчик записей обновляется один раз, после данных и метаданных
+            f.seek(layout.counter_pos)
+            f.write(new_count.to_bytes(MAX_CASES_IN_TABLE_B, 'big'))
+        
+        BUFFER_POOL.invalidate(file_path, data_start, position - data_start)
+        for slot in reused_slots:
+            BUFFER_POOL.invalidate(file_path, layout.header_size + slot * slot_size, slot_size)
+        BUFFER_POOL.invalidate(file_path, layout.header_size + case_count * slot_size,
+                               (new_count - case_count) * slot_size)
+        BUFFER_POOL.invalidate(file_path, 0, layout.header_size)
+        index.update_index_many(file_name, entries, new_count, cases_dir, layout.cord_size, layout.len_size)
+        return len(cases)
+
+def delete_case_from_file(file_name, cords, cases_dir=CASES_DIR):
+    """Удаляет запись: слот метаданных помечается нулевой длиной, место данных освобождается"""
+    with segment_lock(file_name, cases_dir):
+        layout = get_segment_layout(file_name, cases_dir)
+        case = get_case_index(file_name, cases_dir).get(index.pack_cords(cords, layout.cord_size))
+        if case is None:
+            return False
+        
+        slot, position, length = case
+        case_count = get_table_info(file_name, cases_dir)[2]
+        file_path = os.path.join(cases_dir, file_name)
+        
+        _mark_dirty(file_path, [slot])
+        # Координаты остаются в слоте, обнуляются позиция и длина данных
+        slot_pos = layout.header_size + slot * layout.slot_size + layout.cords * layout.cord_size
+        with open(file_path, "rb+") as f:
+            f.seek(slot_pos)
+            f.write(b'\x00' * (BYTES_PLASE_IN_FILE + layout.len_size + 1))
+        BUFFER_POOL.invalidate(file_path, slot_pos, BYTES_PLASE_IN_FILE + layout.len_size + 1)
+        
+        index.update_index(file_name, cords, slot, 0, 0, case_count, cases_dir, layout.cord_size, layout.len_size)
+        
+        # Место данных возвращается в карту свободного пространства файла
+        free_space.release_space(file_name, position, length, cases_dir)
+        return True
+
+def find_case_info(file_name, cords, cases_dir=CASES_DIR):
+    """Возвращает метаданные записи по координатам или None"""
+    layout = get_segment_layout(file_name, cases_dir)
+    case = get_case_index(file_name, cases_dir).get(index.pack_cords(cords, layout.cord_size))
+    if case is None:
+        return None
     
-    return False
+    slot, position, length = case
+    return {
+        'cords': list(cords),
+        'slot': slot,
+        'position': position,
+        'length': length,
+        'current_pos': layout.header_size + slot * layout.slot_size + len(cords) * layout.cord_size
+    }
 
 def find_case_in_file(file_name, cords, cases_dir=CASES_DIR):
     """Ищет запись по координатам"""
-    cases_info, _ = get_cases_info(file_name, cases_dir)
+    with segment_lock(file_name, cases_dir):
+        layout = get_segment_layout(file_name, cases_dir)
+        case = get_case_index(file_name, cases_dir).get(index.pack_cords(cords, layout.cord_size))
+        view = get_segment_view(file_name, cases_dir)
     
-    for case in cases_info:
-        if case['cords'] == cords:
-            file_path = os.path.join(cases_dir, file_name)
-            with open(file_path, "rb") as f:
-                f.seek(case['position'])
-                case_data = f.read(case['length'])
-                return unpack_case(case_data, STANDART_CORD_SIZE, len(cords))
+    if case:
+        _, position, length = case
+        payload = BUFFER_POOL.read(os.path.join(cases_dir, file_name), view, position, length)
+        return unpack_case(payload, layout.cord_size, len(cords), layout.len_size)
     
     return None
 
+def find_cases_in_file(file_name, cords_list, cases_dir=CASES_DIR):
+    """Ищет несколько записей по координатам за одно обращение к индексу; для отсутствующих - None"""
+    with segment_lock(file_name, cases_dir):
+        layout = get_segment_layout(file_name, cases_dir)
+        case_index = get_case_index(file_name, cases_dir)
+        view = get_segment_view(file_name, cases_dir)
+    
+    file_path = os.path.join(cases_dir, file_name)
+    results = []
+    for cords in cords_list:
+        case = case_index.get(index.pack_cords(cords, layout.cord_size))
+        if case is None:
+            results.append(None)
+            continue
+        _, position, length = case
+        payload = BUFFER_POOL.read(file_path, view, position, length)
+        results.append(unpack_case(payload, layout.cord_size, len(cords), layout.len_size))
+    return results
+
+def read_cases_by_slots(file_name, slots, cases_dir=CASES_DIR):
+    """Читает записи из указанных слотов метаданных; несуществующие слоты пропускаются"""
+    with segment_lock(file_name, cases_dir):
+        cords_count, _, case_count, _ = get_table_info(file_name, cases_dir)
+        layout = get_segment_layout(file_name, cases_dir)
+        view = get_segment_view(file_name, cases_dir)
+    
+    file_path = os.path.join(cases_dir, file_name)
+    slot_size = layout.slot_size
+    position_offset = cords_count * layout.cord_size
+    results = []
+    for slot in slots:
+        if slot >= case_count:
+            continue
+        offset = layout.header_size + slot * slot_size + position_offset
+        slot_data = BUFFER_POOL.read(file_path, view, offset, BYTES_PLASE_IN_FILE + layout.len_size + 1)
+        position = int.from_bytes(slot_data[:BYTES_PLASE_IN_FILE], 'big')
+        length = int.from_bytes(slot_data[BYTES_PLASE_IN_FILE:], 'big')
+        if not length:
+            # Запись удалена
+            continue
+        payload = BUFFER_POOL.read(file_path, view, position, length)
+        # Данные десериализуются, только если вызывающий к ним обратится
+        results.append(unpack_case_lazy(payload, layout.cord_size, cords_count, layout.len_size))
+    return results
+
+def iter_cases(file_name, cases_dir=CASES_DIR, start=0, with_slots=False):
+    """Лениво читает записи LazyCase из файла, начиная со слота start; with_slots - пары (слот, запись)"""
+    # Метаданные и отображение берутся согласованно; дальше чтение идет без блокировки
+    with segment_lock(file_name, cases_dir):
+        layout = get_segment_layout(file_name, cases_dir)
+        slots = read_slot_arrays(file_name, cases_dir)
+        view = get_segment_view(file_name, cases_dir)
+    if np is not None:
+        slots = SlotArrays(None, slots.positions.tolist(), slots.lengths.tolist())
+    
+    file_path = os.path.join(cases_dir, file_name)
+    for slot, position, length in zip(range(start, len(slots.positions)), slots.positions[start:],
+                                      slots.lengths[start:]):
+        if not length:
+            # Слоты удаленных записей пропускаются
+            continue
+        payload = BUFFER_POOL.read(file_path, view, position, length)
+        # Координаты, тип и длина доступны сразу, данные десериализуются при первом обращении
+        record = unpack_case_lazy(payload, layout.cord_size, layout.cords, layout.len_size)
+        yield (slot, record) if with_slots else record
+
 def read_all_cases(file_name, cases_dir=CASES_DIR):
     """Читает все записи из файла"""
-    cases_info, cords_count = get_cases_info(file_name, cases_dir)
-    file_path = os.path.join(cases_dir, file_name)
+    return list(iter_cases(file_name, cases_dir))
+
+def get_fragmentation(file_name, cases_dir=CASES_DIR):
+    """Возвращает живые и мертвые байты области данных файла и их отношение"""
+    layout = get_segment_layout(file_name, cases_dir)
+    data_start = layout.header_size + layout.max_cases * layout.slot_size
+    data_size = os.path.getsize(os.path.join(cases_dir, file_name)) - data_start
     
-    cases = []
-    with open(file_path, "rb") as f:
+    live_bytes = sum(length for _, _, length in get_case_index(file_name, cases_dir).values())
+    dead_bytes = max(data_size - live_bytes, 0)
+    return {
+        'file': file_name,
+        'live_bytes': live_bytes,
+        'dead_bytes': dead_bytes,
+        'ratio': dead_bytes / live_bytes if live_bytes else float(dead_bytes > 0)
+    }
+
+class SegmentCompaction:
+    """Пошаговая дефрагментация файла записей: живые записи копируются во временный файл порциями,
+    блокировка файла держится только на время одной порции. Записи, измененные между порциями,
+    отмечаются писателями и копируются заново на последнем шаге вместе с метаданными; прежние места
+    таких записей во временном файле остаются мертвыми байтами до следующего сжатия"""
+    
+    def __init__(self, file_name, cases_dir=CASES_DIR):
+        self.file_name = file_name
+        self.cases_dir = cases_dir
+        self.file_path = os.path.join(cases_dir, file_name)
+        self.temp_file = f"temp_{file_name}"
+        self.temp_path = os.path.join(cases_dir, self.temp_file)
+        self.dirty = set()    # Слоты, измененные писателями после начала сжатия
+        self.copied = {}      # {слот: (позиция во временном файле, длина)}
+        self.done = False
+        self.steps = 0
+        self.elapsed = 0.0
+        
+        with segment_lock(file_name, cases_dir):
+            start_time = time.perf_counter()
+            self.layout = get_segment_layout(file_name, cases_dir)
+            self.inode = os.stat(self.file_path).st_ino
+            # Записи копируются в порядке слотов, данные идут подряд после блока метаданных
+            cases_info, _ = get_cases_info(file_name, cases_dir)
+            self.pending = [(case['slot'], case['position'], case['length']) for case in cases_info]
+            self.cursor = 0
+            self.data_end = self.layout.header_size + self.layout.max_cases * self.layout.slot_size
+            
+            # Прерванное сжатие того же файла уступает новому
+            previous = COMPACTIONS.get(self.file_path)
+            if previous is not None:
+                previous.abort()
+            self._file = open(self.temp_path, "wb")
+            self._file.seek(self.data_end)
+            COMPACTIONS[self.file_path] = self
+            self.elapsed += time.perf_counter() - start_time
+    
+    def step(self, max_bytes=None):
+        """Копирует порцию записей не больше max_bytes (None - все); возвращает статистику, когда файл сжат"""
+        with segment_lock(self.file_name, self.cases_dir):
+            if self.done:
+                return None
+            if COMPACTIONS.get(self.file_path) is not self or os.stat(self.file_path).st_ino != self.inode:
+                # Файл заменен (перевод в формат 2) или его сжимает другой проход
+                self.abort()
+                return None
+            
+            start_time = time.perf_counter()
+            self.steps += 1
+            view = get_segment_view(self.file_name, self.cases_dir)
+            copied_bytes = 0
+            while self.cursor < len(self.pending) and (max_bytes is None or copied_bytes < max_bytes):
+                slot, position, length = self.pending[self.cursor]
+                self.cursor += 1
+                # Измененная запись копируется на последнем шаге по текущим метаданным
+                if slot in self.dirty:
+                    continue
+                self._file.write(view[position:position + length])
+                self.copied[slot] = (self.data_end, length)
+                self.data_end += length
+                copied_bytes += length
+            view.release()
+            
+            result = self._finish() if self.cursor >= len(self.pending) else None
+            self.elapsed += time.perf_counter() - start_time
+            if result:
+                result['elapsed'] = self.elapsed
+            return result
+    
+    def _finish(self):
+        """Докопирует измененные записи, пишет метаданные и заменяет файл; вызывается под блокировкой"""
+        layout = self.layout
+        cords_count, max_cases = layout.cords, layout.max_cases
+        cords_size = cords_count * layout.cord_size
+        old_size = os.path.getsize(self.file_path)
+        cases_info, _ = get_cases_info(self.file_name, self.cases_dir, with_deleted=True)
+        view = get_segment_view(self.file_name, self.cases_dir)
+        
+        # Удаленные записи в конце блока метаданных отбрасываются вместе со своими слотами
+        while cases_info and not cases_info[-1]['length']:
+            cases_info.pop()
+        
+        # Слоты удаленных записей сохраняют свои номера, на них ссылаются инвертированные индексы
+        metadata = bytearray()
+        new_cases_info = []
         for case in cases_info:
-            f.seek(case['position'])
-            case_data = f.read(case['length'])
-            unpacked = unpack_case(case_data, STANDART_CORD_SIZE, cords_count)
-            cases.append(unpacked)
+            slot, length = case['slot'], case['length']
+            copied = self.copied.get(slot)
+            if not length:
+                position = 0
+            elif copied and slot not in self.dirty:
+                position = copied[0]
+            else:
+                # Запись еще не скопирована или изменена после копирования: старое место
+                # во временном файле используется, если новые данные в него помещаются
+                if copied and copied[1] >= length:
+                    position = copied[0]
+                else:
+                    position = self.data_end
+                    self.data_end += length
+                self._file.seek(position)
+                self._file.write(view[case['position']:case['position'] + length])
+            
+            metadata += view[case['current_pos'] - cords_size:case['current_pos']]
+            metadata += position.to_bytes(BYTES_PLASE_IN_FILE, 'big')
+            metadata += length.to_bytes(layout.len_size + 1, 'big')
+            new_cases_info.append({'cords': case['cords'], 'slot': slot, 'position': position, 'length': length})
+        new_size = self.data_end
+        live_count = sum(1 for case in cases_info if case['length'])
+        
+        # Заголовок копируется из старого файла, счетчик - число оставшихся слотов,
+        # границы координат сужаются до живых записей
+        header = bytearray(view[:layout.header_size])
+        header[layout.counter_pos:layout.counter_pos + MAX_CASES_IN_TABLE_B] = \
+            len(cases_info).to_bytes(MAX_CASES_IN_TABLE_B, 'big')
+        if layout.zone_map:
+            bounds = _extend_bounds(*_empty_bounds(cords_count, layout.cord_size),
+                                    [case['cords'] for case in cases_info if case['length']])
+            packed = _pack_bounds(*bounds, layout.cord_size)
+            header[SEGMENT_V2_ZONE_MAP_POS:SEGMENT_V2_ZONE_MAP_POS + len(packed)] = packed
+        view.release()
+        
+        f = self._file
+        f.seek(0)
+        f.write(header)
+        f.write(metadata)
+        f.truncate(new_size)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        
+        live_keys = index.rebuild_index(self.temp_file, new_cases_info, self.cases_dir,
+                                        layout.cord_size, layout.len_size)
+        # Фильтр Блума строится заново: ключи удаленных записей из него уходят
+        bloom_filter.rebuild_bloom(self.temp_file, live_keys, max_cases, self.cases_dir)
+        
+        close_segment_map(self.file_name, self.cases_dir)
+        os.replace(self.temp_path, self.file_path)
+        # Индекс и фильтр временного файла соответствуют новому содержимому файла
+        index.replace_index(self.temp_file, self.file_name, self.cases_dir)
+        bloom_filter.replace_bloom(self.temp_file, self.file_name, self.cases_dir)
+        # В сжатом файле свободных участков нет
+        free_space.clear_free_space(self.file_name, self.cases_dir)
+        
+        del COMPACTIONS[self.file_path]
+        self.done = True
+        return {
+            'file': self.file_name,
+            'cases': live_count,
+            'old_size': old_size,
+            'new_size': new_size,
+            'bytes_reclaimed': old_size - new_size,
+            'steps': self.steps
+        }
     
-    return cases
+    def abort(self):
+        """Прекращает сжатие; временный файл удаляется, если его не занял следующий проход"""
+        with segment_lock(self.file_name, self.cases_dir):
+            owner = COMPACTIONS.get(self.file_path) is self
+            if owner:
+                del COMPACTIONS[self.file_path]
+            if not self._file.closed:
+                self._file.close()
+            if owner and not self.done and os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+            self.done = True
+
+def _mark_dirty(file_path, slots):
+    """Отмечает слоты, измененные во время пошагового сжатия файла"""
+    compaction = COMPACTIONS.get(file_path)
+    if compaction is not None:
+        compaction.dirty.update(slots)
 
 def defragment_file(file_name, cases_dir=CASES_DIR):
-    """Дефрагментирует файл, удаляя пустые пространства"""
-    temp_file = f"temp_{file_name}"
-    create_cases_file(temp_file, get_table_id(file_name), get_table_info(file_name)[0])
-    
-    cases = read_all_cases(file_name, cases_dir)
-    for cords, _, _, data, _ in cases:
-        write_case_to_file(temp_file, cords, data)
-    
-    os.replace(os.path.join(cases_dir, temp_file), os.path.join(cases_dir, file_name))
-    FREE_SPACE.clear()
\ No newline at end of file
+    """Дефрагментирует файл за один последовательный проход; возвращает статистику"""
+    with segment_lock(file_name, cases_dir):
+        return SegmentCompaction(file_name, cases_dir).step()
+
+def convert_segment(file_name, cases_dir=CASES_DIR, chunk_size=CONVERT_CHUNK_SIZE):
+    """Переводит файл записей версии 1 в версию 2 потоковым копированием; возвращает статистику или None"""
+    with segment_lock(file_name, cases_dir):
+        layout = get_segment_layout(file_name, cases_dir)
+        if layout.version != 1:
+            return None
+        
+        # Начатая пошаговая дефрагментация использует то же имя временного файла
+        compaction = COMPACTIONS.get(os.path.join(cases_dir, file_name))
+        if compaction is not None:
+            compaction.abort()
+        
+        start_time = time.perf_counter()
+        file_path = os.path.join(cases_dir, file_name)
+        temp_file = f"temp_{file_name}"
+        temp_path = os.path.join(cases_dir, temp_file)
+        old_size = os.path.getsize(file_path)
+        view = get_segment_view(file_name, cases_dir)
+        case_count = _read_case_count(view, layout)
+        
+        # Заголовок становится длиннее, поэтому все позиции данных сдвигаются на одну величину
+        header_size = get_v2_header_size(layout.cords, layout.cord_size)
+        delta = header_size - layout.header_size
+        data_start = layout.header_size + layout.max_cases * layout.slot_size
+        cases_info, _ = get_cases_info(file_name, cases_dir, with_deleted=True)
+        
+        create_cases_file(temp_file, layout.table_id, layout.cords, cases_dir, layout.max_cases,
+                          layout.cord_size, layout.len_size)
+        with open(temp_path, "rb+") as f:
+            f.seek(SEGMENT_V2_COUNTER_POS)
+            f.write(case_count.to_bytes(MAX_CASES_IN_TABLE_B, 'big'))
+            # Границы координат считаются по живым записям
+            f.seek(SEGMENT_V2_ZONE_MAP_POS)
+            f.write(_pack_bounds(*_extend_bounds(*_empty_bounds(layout.cords, layout.cord_size),
+                                                 [case['cords'] for case in cases_info if case['length']]),
+                                 layout.cord_size))
+            
+            # Слоты метаданных переписываются со сдвинутыми позициями
+            metadata = bytearray()
+            cords_size = layout.cords * layout.cord_size
+            for case in cases_info:
+                slot_start = case['current_pos'] - cords_size
+                metadata += view[slot_start:case['current_pos']]
+                # Позиция удаленной записи не сдвигается: слот остается пустым
+                metadata += (case['position'] + delta if case['length'] else 0).to_bytes(BYTES_PLASE_IN_FILE, 'big')
+                metadata += case['length'].to_bytes(layout.len_size + 1, 'big')
+            f.seek(header_size)
+            f.write(metadata)
+            
+            # Область данных копируется кусками вместе с мертвыми участками
+            f.seek(data_start + delta)
+            for offset in range(data_start, old_size, chunk_size):
+                f.write(view[offset:min(offset + chunk_size, old_size)])
+            
+            f.flush()
+            os.fsync(f.fileno())
+        
+        view.release()
+        live_keys = index.rebuild_index(temp_file, [dict(case, position=case['position'] + delta if case['length'] else 0)
+                                                    for case in cases_info],
+                                        cases_dir, layout.cord_size, layout.len_size)
+        bloom_filter.rebuild_bloom(temp_file, live_keys, layout.max_cases, cases_dir)
+        
+        close_segment_map(file_name, cases_dir)
+        os.replace(temp_path, file_path)
+        index.replace_index(temp_file, file_name, cases_dir)
+        bloom_filter.replace_bloom(temp_file, file_name, cases_dir)
+        free_space.shift_free_space(file_name, delta, cases_dir)
+        
+        return {
+            'file': file_name,
+            'cases': case_count,
+            'old_size': old_size,
+            'new_size': os.path.getsize(file_path),
+            'elapsed': time.perf_counter() - start_time
+        }
@@ -0,0 +1,164 @@
+import os
+import bisect
+from .config import *
+
+# Расширение файла со списком свободных участков сегмента
+FREE_SPACE_EXT = ".marf"
+# Размер поля количества участков в файле свободного пространства
+FREE_SPACE_COUNT_SIZE = 4
+
+# Кэш загруженных карт: {путь к .marf: (отметка файла, FreeSpaceMap)}
+FREE_SPACE_CACHE = {}
+
+class FreeSpaceMap:
+    """Карта свободных участков одного файла записей"""
+
+    def __init__(self, extents=()):
+        self.positions = []      # Отсортированные позиции свободных участков
+        self.extents = {}        # {позиция: длина}
+        self.size_classes = {}   # {класс размера: множество позиций}
+        for position, length in extents:
+            self._add(position, length)
+
+    @staticmethod
+    def size_class(length):
+        """Возвращает класс размера участка (степень двойки)"""
+        return length.bit_length()
+
+    def _add(self, position, length):
+        bisect.insort(self.positions, position)
+        self.extents[position] = length
+        self.size_classes.setdefault(self.size_class(length), set()).add(position)
+
+    def _remove(self, position):
+        length = self.extents.pop(position)
+        del self.positions[bisect.bisect_left(self.positions, position)]
+        size_class = self.size_class(length)
+        self.size_classes[size_class].discard(position)
+        if not self.size_classes[size_class]:
+            del self.size_classes[size_class]
+        return length
+
+    def allocate(self, size):
+        """Выделяет наименьший подходящий участок (best-fit) и возвращает его позицию или None"""
+        first_class = self.size_class(size)
+        for size_class in sorted(c for c in self.size_classes if c >= first_class):
+            candidates = [p for p in self.size_classes[size_class] if self.extents[p] >= size]
+            if not candidates:
+                continue
+
+            position = min(candidates, key=lambda p: (self.extents[p], p))
+            length = self._remove(position)
+            # Остаток участка остается свободным
+            if length > size:
+                self._add(position + size, length - size)
+            return position
+
+        return None
+
+    def release(self, position, length):
+        """Освобождает участок, объединяя его с соседними свободными участками"""
+        i = bisect.bisect_left(self.positions, position)
+        if i > 0:
+            prev_position = self.positions[i - 1]
+            if prev_position + self.extents[prev_position] == position:
+                length += self._remove(prev_position)
+                position = prev_position
+
+        next_position = position + length
+        if next_position in self.extents:
+            length += self._remove(next_position)
+
+        self._add(position, length)
+        return position, length
+
+    def free_bytes(self):
+        """Возвращает суммарный размер свободных участков"""
+        return sum(self.extents.values())
+
+    def to_bytes(self):
+        """Упаковывает карту для сохранения на диск"""
+        return len(self.positions).to_bytes(FREE_SPACE_COUNT_SIZE, 'big') + b''.join(
+            position.to_bytes(BYTES_PLASE_IN_FILE, 'big') +
+            self.extents[position].to_bytes(BYTES_PLASE_IN_FILE, 'big')
+            for position in self.positions)
+
+    @classmethod
+    def from_bytes(cls, raw):
+        """Распаковывает карту, сохраненную методом to_bytes"""
+        count = int.from_bytes(raw[:FREE_SPACE_COUNT_SIZE], 'big')
+        extents = []
+        offset = FREE_SPACE_COUNT_SIZE
+        for _ in range(count):
+            position = int.from_bytes(raw[offset:offset + BYTES_PLASE_IN_FILE], 'big')
+            offset += BYTES_PLASE_IN_FILE
+            length = int.from_bytes(raw[offset:offset + BYTES_PLASE_IN_FILE], 'big')
+            offset += BYTES_PLASE_IN_FILE
+            extents.append((position, length))
+        return cls(extents)
+
+def get_free_space_path(file_name, cases_dir=CASES_DIR):
+    """Возвращает путь к файлу свободного пространства для файла записей"""
+    return os.path.join(cases_dir, os.path.splitext(file_name)[0] + FREE_SPACE_EXT)
+
+def _file_stamp(path):
+    """Возвращает отметку состояния файла для проверки актуальности кэша"""
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def load_free_space(file_name, cases_dir=CASES_DIR):
+    """Возвращает карту свободных участков файла записей"""
+    path = get_free_space_path(file_name, cases_dir)
+    if not os.path.exists(path):
+        return FreeSpaceMap()
+
+    stamp = _file_stamp(path)
+    cached = FREE_SPACE_CACHE.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    with open(path, "rb") as f:
+        free_map = FreeSpaceMap.from_bytes(f.read())
+
+    FREE_SPACE_CACHE[path] = (stamp, free_map)
+    return free_map
+
+def save_free_space(file_name, free_map, cases_dir=CASES_DIR):
+    """Сохраняет карту свободных участков файла записей"""
+    path = get_free_space_path(file_name, cases_dir)
+    with open(path, "wb") as f:
+        f.write(free_map.to_bytes())
+    FREE_SPACE_CACHE[path] = (_file_stamp(path), free_map)
+
+def allocate_space(file_name, size, cases_dir=CASES_DIR):
+    """Выделяет свободный участок в файле записей; возвращает позицию или None"""
+    free_map = load_free_space(file_name, cases_dir)
+    position = free_map.allocate(size)
+    if position is not None:
+        # Карта сохраняется до записи данных, чтобы участок не выдали повторно
+        save_free_space(file_name, free_map, cases_dir)
+    return position
+
+def release_space(file_name, position, length, cases_dir=CASES_DIR):
+    """Освобождает участок файла записей"""
+    free_map = load_free_space(file_name, cases_dir)
+    free_map.release(position, length)
+    # Файл не усекается даже при освобождении участка в конце: он может быть отображен
+    # в память читателями, и обращение к отрезанной странице завершает процесс (SIGBUS).
+    # Хвост остается в карте и возвращается дефрагментацией
+    save_free_space(file_name, free_map, cases_dir)
+
+def shift_free_space(file_name, delta, cases_dir=CASES_DIR):
+    """Сдвигает все свободные участки файла записей на delta байт"""
+    free_map = load_free_space(file_name, cases_dir)
+    if not free_map.positions:
+        return
+    shifted = FreeSpaceMap((position + delta, free_map.extents[position]) for position in free_map.positions)
+    save_free_space(file_name, shifted, cases_dir)
+
+def clear_free_space(file_name, cases_dir=CASES_DIR):
+    """Удаляет карту свободных участков файла записей"""
+    path = get_free_space_path(file_name, cases_dir)
+    FREE_SPACE_CACHE.pop(path, None)
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,168 @@
+import os
+import threading
+from .config import *
+from .serialization import create_cord_block
+
+# Расширение файла хеш-индекса сегмента
+INDEX_EXT = ".marh"
+# Размер поля количества записей в заголовке индекса
+INDEX_COUNT_SIZE = 4
+
+# Кэш загруженных индексов: {путь к индексу: (отметка файла, количество записей, {ключ: (слот, позиция, длина)},
+#                                              множество слотов удаленных записей)}
+INDEX_CACHE = {}
+# Поколение индексов: растет при каждом изменении или чтении индекса с диска в этом процессе;
+# пока оно не изменилось, количество живых записей в файлах тоже прежнее
+INDEX_GENERATION = 0
+_GENERATION_LOCK = threading.Lock()
+
+def get_index_path(file_name, cases_dir=CASES_DIR):
+    """Возвращает путь к файлу индекса для файла записей"""
+    return os.path.join(cases_dir, os.path.splitext(file_name)[0] + INDEX_EXT)
+
+def _advance_generation():
+    """Отмечает изменение индексов"""
+    global INDEX_GENERATION
+    with _GENERATION_LOCK:
+        INDEX_GENERATION += 1
+
+def get_index_generation():
+    """Возвращает поколение индексов"""
+    return INDEX_GENERATION
+
+def pack_cords(cords, cord_size=STANDART_CORD_SIZE):
+    """Упаковывает координаты в ключ индекса"""
+    return create_cord_block(cords, cord_size)
+
+def get_entry_size(cords_count, cord_size=STANDART_CORD_SIZE, len_size=STANDART_LEN_SIZE):
+    """Возвращает размер одной записи индекса"""
+    return cords_count * cord_size + MAX_CASES_IN_TABLE_B + BYTES_PLASE_IN_FILE + len_size + 1
+
+def _file_stamp(index_path):
+    """Возвращает отметку состояния файла для проверки актуальности кэша"""
+    stat = os.stat(index_path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def _pack_entry(key, slot, position, length, len_size=STANDART_LEN_SIZE):
+    """Упаковывает одну запись индекса"""
+    return (key +
+            slot.to_bytes(MAX_CASES_IN_TABLE_B, 'big') +
+            position.to_bytes(BYTES_PLASE_IN_FILE, 'big') +
+            length.to_bytes(len_size + 1, 'big'))
+
+def _apply_entry(entries, free_slots, key, slot, position, length):
+    """Применяет запись индекса; нулевая длина означает удаление записи из слота"""
+    if length:
+        entries[key] = (slot, position, length)
+        free_slots.discard(slot)
+    else:
+        # Ключ мог быть уже заново вставлен в другой слот
+        if entries.get(key, (None,))[0] == slot:
+            del entries[key]
+        free_slots.add(slot)
+
+def load_index(file_name, cords_count, case_count, cases_dir=CASES_DIR,
+               cord_size=STANDART_CORD_SIZE, len_size=STANDART_LEN_SIZE):
+    """Загружает индекс файла записей; возвращает None, если индекс отсутствует или устарел"""
+    index_path = get_index_path(file_name, cases_dir)
+    if not os.path.exists(index_path):
+        return None
+
+    stamp = _file_stamp(index_path)
+    cached = INDEX_CACHE.get(index_path)
+    if cached and cached[0] == stamp:
+        return cached[2] if cached[1] == case_count and len(cached[2]) + len(cached[3]) == case_count else None
+
+    with open(index_path, "rb") as f:
+        raw = f.read()
+
+    indexed_count = int.from_bytes(raw[:INDEX_COUNT_SIZE], 'big')
+    key_size = cords_count * cord_size
+    entry_size = get_entry_size(cords_count, cord_size, len_size)
+
+    # Записи добавляются в конец файла, более поздняя запись заменяет раннюю
+    entries = {}
+    free_slots = set()
+    for offset in range(INDEX_COUNT_SIZE, len(raw) - entry_size + 1, entry_size):
+        key = raw[offset:offset + key_size]
+        offset += key_size
+        slot = int.from_bytes(raw[offset:offset + MAX_CASES_IN_TABLE_B], 'big')
+        offset += MAX_CASES_IN_TABLE_B
+        position = int.from_bytes(raw[offset:offset + BYTES_PLASE_IN_FILE], 'big')
+        offset += BYTES_PLASE_IN_FILE
+        length = int.from_bytes(raw[offset:offset + len_size + 1], 'big')
+        _apply_entry(entries, free_slots, key, slot, position, length)
+
+    INDEX_CACHE[index_path] = (stamp, indexed_count, entries, free_slots)
+    _advance_generation()
+    if indexed_count != case_count or len(entries) + len(free_slots) != case_count:
+        return None
+    return entries
+
+def get_free_slots(file_name, cases_dir=CASES_DIR):
+    """Возвращает множество слотов удаленных записей из загруженного индекса файла"""
+    cached = INDEX_CACHE.get(get_index_path(file_name, cases_dir))
+    return cached[3] if cached else set()
+
+def rebuild_index(file_name, cases_info, cases_dir=CASES_DIR, cord_size=STANDART_CORD_SIZE,
+                  len_size=STANDART_LEN_SIZE):
+    """Перестраивает индекс по метаданным всех слотов файла, включая слоты удаленных записей"""
+    index_path = get_index_path(file_name, cases_dir)
+    entries = {}
+    free_slots = set()
+    deleted = []
+    for case in cases_info:
+        key = pack_cords(case['cords'], cord_size)
+        if case['length']:
+            entries[key] = (case['slot'], case['position'], case['length'])
+        else:
+            free_slots.add(case['slot'])
+            deleted.append(_pack_entry(key, case['slot'], 0, 0, len_size))
+
+    with open(index_path, "wb") as f:
+        f.write(len(cases_info).to_bytes(INDEX_COUNT_SIZE, 'big'))
+        # Удаления пишутся первыми, чтобы не снять живой ключ с теми же координатами
+        f.write(b''.join(deleted))
+        f.write(b''.join(_pack_entry(key, *value, len_size) for key, value in entries.items()))
+
+    INDEX_CACHE[index_path] = (_file_stamp(index_path), len(cases_info), entries, free_slots)
+    _advance_generation()
+    return entries
+
+def update_index(file_name, cords, slot, position, length, case_count, cases_dir=CASES_DIR,
+                 cord_size=STANDART_CORD_SIZE, len_size=STANDART_LEN_SIZE):
+    """Добавляет или обновляет запись индекса"""
+    update_index_many(file_name, [(cords, slot, position, length)], case_count, cases_dir, cord_size, len_size)
+
+def update_index_many(file_name, entries, case_count, cases_dir=CASES_DIR,
+                      cord_size=STANDART_CORD_SIZE, len_size=STANDART_LEN_SIZE):
+    """Добавляет, обновляет или удаляет (нулевая длина) пачку записей индекса [(координаты, слот, позиция, длина)]"""
+    index_path = get_index_path(file_name, cases_dir)
+
+    cached = INDEX_CACHE.get(index_path)
+    index_entries = cached[2] if cached else {}
+    free_slots = cached[3] if cached else set()
+
+    packed = []
+    for cords, slot, position, length in entries:
+        key = pack_cords(cords, cord_size)
+        _apply_entry(index_entries, free_slots, key, slot, position, length)
+        packed.append(_pack_entry(key, slot, position, length, len_size))
+
+    with open(index_path, "rb+") as f:
+        f.write(case_count.to_bytes(INDEX_COUNT_SIZE, 'big'))
+        f.seek(0, 2)
+        f.write(b''.join(packed))
+
+    INDEX_CACHE[index_path] = (_file_stamp(index_path), case_count, index_entries, free_slots)
+    _advance_generation()
+
+def replace_index(src_file_name, dst_file_name, cases_dir=CASES_DIR):
+    """Переносит индекс файла записей вместе с самим файлом"""
+    src_path = get_index_path(src_file_name, cases_dir)
+    dst_path = get_index_path(dst_file_name, cases_dir)
+    INDEX_CACHE.pop(src_path, None)
+    INDEX_CACHE.pop(dst_path, None)
+    if os.path.exists(src_path):
+        os.replace(src_path, dst_path)
+    _advance_generation()
@@ -0,0 +1,184 @@
+import os
+import threading
+from .config import *
+
+# Расширение файла инвертированного индекса одного измерения таблицы
+INVERTED_EXT = ".marv"
+# Размер поля количества записей в заголовке индекса
+INVERTED_COUNT_SIZE = 4
+def get_entry_size(cord_size=STANDART_CORD_SIZE):
+    """Возвращает размер записи индекса (значение координаты, номер файла записей таблицы, номер слота)
+    для координат заданной ширины"""
+    return cord_size + MAX_TABLES_IN_BD_B + MAX_CASES_IN_TABLE_B
+
+# Старший бит номера файла помечает запись об удалении (файл, слот) из индекса
+DELETED_FLAG = 1 << (MAX_TABLES_IN_BD_B * 8 - 1)
+# Индекс переписывается без удаленных записей, когда их больше четверти живых или этого минимума
+INVERTED_COMPACT_MIN = 1024
+
+# Кэш загруженных индексов: {путь к .marv: (отметка файла, количество записей в файле, {значение: [(файл, слот)]},
+# количество живых записей)}
+INVERTED_INDEX_CACHE = {}
+# Блокировки инвертированных индексов таблиц
+INVERTED_LOCKS = {}
+_INVERTED_LOCKS_GUARD = threading.Lock()
+
+def get_inverted_index_path(table_name, dim):
+    """Возвращает путь к инвертированному индексу измерения таблицы"""
+    return os.path.join("config", f"{table_name}_{dim}{INVERTED_EXT}")
+
+def has_inverted_index(table_name, dim):
+    """Проверяет, включен ли инвертированный индекс измерения"""
+    return os.path.exists(get_inverted_index_path(table_name, dim))
+
+def get_indexed_dims(table_name, cords_count):
+    """Возвращает измерения таблицы, для которых включены инвертированные индексы"""
+    return [dim for dim in range(cords_count) if has_inverted_index(table_name, dim)]
+
+def inverted_index_lock(table_name):
+    """Возвращает блокировку инвертированных индексов таблицы"""
+    with _INVERTED_LOCKS_GUARD:
+        return INVERTED_LOCKS.setdefault(table_name, threading.Lock())
+
+def _file_stamp(path):
+    """Возвращает отметку состояния файла для проверки актуальности кэша"""
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def _pack_entry(value, segment, slot, cord_size=STANDART_CORD_SIZE):
+    """Упаковывает одну запись индекса"""
+    return (value.to_bytes(cord_size, 'big', signed=True) +
+            segment.to_bytes(MAX_TABLES_IN_BD_B, 'big') +
+            slot.to_bytes(MAX_CASES_IN_TABLE_B, 'big'))
+
+def load_inverted_index(table_name, dim, case_count, cord_size=STANDART_CORD_SIZE):
+    """Загружает индекс {значение: [(файл, слот)]}; возвращает None, если он отсутствует или устарел"""
+    path = get_inverted_index_path(table_name, dim)
+    if not os.path.exists(path):
+        return None
+
+    stamp = _file_stamp(path)
+    cached = INVERTED_INDEX_CACHE.get(path)
+    if not (cached and cached[0] == stamp):
+        with open(path, "rb") as f:
+            raw = f.read()
+
+        count = int.from_bytes(raw[:INVERTED_COUNT_SIZE], 'big')
+        entry_size = get_entry_size(cord_size)
+        postings = {}
+        for offset in range(INVERTED_COUNT_SIZE, INVERTED_COUNT_SIZE + count * entry_size, entry_size):
+            value = int.from_bytes(raw[offset:offset + cord_size], 'big', signed=True)
+            offset += cord_size
+            segment = int.from_bytes(raw[offset:offset + MAX_TABLES_IN_BD_B], 'big')
+            offset += MAX_TABLES_IN_BD_B
+            slot = int.from_bytes(raw[offset:offset + MAX_CASES_IN_TABLE_B], 'big')
+            # Записи применяются по порядку: удаление убирает запись, добавленную раньше
+            if segment & DELETED_FLAG:
+                _remove_posting(postings, value, segment ^ DELETED_FLAG, slot)
+            else:
+                postings.setdefault(value, []).append((segment, slot))
+
+        # Оборванный хвост файла означает, что индекс отстал от файлов записей
+        if len(raw) < INVERTED_COUNT_SIZE + count * entry_size:
+            return None
+        cached = (stamp, count, postings, sum(len(posting) for posting in postings.values()))
+        INVERTED_INDEX_CACHE[path] = cached
+
+    if cached[3] != case_count:
+        return None
+    return cached[2]
+
+def _remove_posting(postings, value, segment, slot):
+    """Убирает (файл, слот) из списка значения; возвращает True, если запись была в индексе"""
+    posting = postings.get(value)
+    if not posting or (segment, slot) not in posting:
+        return False
+    posting.remove((segment, slot))
+    if not posting:
+        del postings[value]
+    return True
+
+def _write_postings(path, postings, cord_size=STANDART_CORD_SIZE):
+    """Записывает индекс целиком по словарю {значение: [(файл, слот)]}"""
+    packed = [_pack_entry(value, segment, slot, cord_size)
+              for value, posting in postings.items() for segment, slot in posting]
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(len(packed).to_bytes(INVERTED_COUNT_SIZE, 'big'))
+        f.write(b''.join(packed))
+    os.replace(temp_path, path)
+    INVERTED_INDEX_CACHE[path] = (_file_stamp(path), len(packed), postings, len(packed))
+
+def rebuild_inverted_index(table_name, dim, segments_info, cord_size=STANDART_CORD_SIZE):
+    """Строит индекс измерения по метаданным файлов таблицы [[{'cords', 'slot'}, ...], ...]"""
+    postings = {}
+    for segment, cases_info in enumerate(segments_info):
+        for case in cases_info:
+            postings.setdefault(case['cords'][dim], []).append((segment, case['slot']))
+
+    _write_postings(get_inverted_index_path(table_name, dim), postings, cord_size)
+    return postings
+
+def drop_inverted_index(table_name, dim):
+    """Выключает инвертированный индекс измерения"""
+    path = get_inverted_index_path(table_name, dim)
+    INVERTED_INDEX_CACHE.pop(path, None)
+    if os.path.exists(path):
+        os.remove(path)
+
+def _append_entries(path, dim, entries, flag, cord_size=STANDART_CORD_SIZE):
+    """Дописывает записи [(координаты, файл, слот)] с флагом в номере файла; возвращает загруженный
+    индекс, если он соответствовал файлу, и количество записей в файле до дописывания"""
+    stamp = _file_stamp(path)
+    with open(path, "rb+") as f:
+        count = int.from_bytes(f.read(INVERTED_COUNT_SIZE), 'big')
+        f.seek(0)
+        f.write((count + len(entries)).to_bytes(INVERTED_COUNT_SIZE, 'big'))
+        f.seek(INVERTED_COUNT_SIZE + count * get_entry_size(cord_size))
+        f.write(b''.join(_pack_entry(cords[dim], segment | flag, slot, cord_size)
+                         for cords, segment, slot in entries))
+        f.truncate()
+
+    cached = INVERTED_INDEX_CACHE.pop(path, None)
+    if cached is None or cached[0] != stamp:
+        cached = None
+    return cached, count
+
+def add_postings(table_name, dim, entries, cord_size=STANDART_CORD_SIZE):
+    """Дописывает в индекс измерения новые записи [(координаты, файл, слот)]"""
+    path = get_inverted_index_path(table_name, dim)
+    if not entries or not os.path.exists(path):
+        return
+
+    cached, count = _append_entries(path, dim, entries, 0, cord_size)
+    if cached is None:
+        return
+
+    # Загруженный индекс дополняется на месте
+    postings = cached[2]
+    for cords, segment, slot in entries:
+        postings.setdefault(cords[dim], []).append((segment, slot))
+    INVERTED_INDEX_CACHE[path] = (_file_stamp(path), count + len(entries), postings, cached[3] + len(entries))
+
+def remove_postings(table_name, dim, entries, cord_size=STANDART_CORD_SIZE):
+    """Дописывает в индекс измерения удаление записей [(координаты, файл, слот)]"""
+    path = get_inverted_index_path(table_name, dim)
+    if not entries or not os.path.exists(path):
+        return
+
+    cached, count = _append_entries(path, dim, entries, DELETED_FLAG, cord_size)
+    if cached is None:
+        return
+
+    postings = cached[2]
+    live_count = cached[3]
+    for cords, segment, slot in entries:
+        if _remove_posting(postings, cords[dim], segment, slot):
+            live_count -= 1
+
+    count += len(entries)
+    if count - live_count > max(live_count // 4, INVERTED_COMPACT_MIN):
+        # Удаленные записи и отметки об удалении отбрасываются
+        _write_postings(path, postings, cord_size)
+    else:
+        INVERTED_INDEX_CACHE[path] = (_file_stamp(path), count, postings, live_count)
@@ -1,10 +1,24 @@
 import socket
 import json
+import itertools
 import os
 from .config import *
 from . import database
 from . import file_operations
 from . import serialization
+from .compaction import BackgroundCompactor
+
+def _record_to_dict(record):
+    """Преобразует запись из кортежа в словарь, как в серверном режиме"""
+    cords, data_type, data_len, data, reversed_size = record
+    return {
+        'cords': cords,
+        'data_type': data_type.__name__,
+        'data_len': data_len,
+        'data': data,
+        'reversed_size': reversed_size
+    }
+
 
 class MARDB:
     def __init__(self, mode='local', host='localhost', port=9999):
@@ -19,6 +33,7 @@ class MARDB:
         self.host = host
         self.port = port
         self.socket = None
+        self.compactors = {}  # Фоновые дефрагментаторы локального режима: {db_name: BackgroundCompactor}
         
         if mode == 'server':
             self._connect_to_server()
@@ -85,24 +100,58 @@ class MARDB:
             else:
                 raise e
                 
-    def create_database(self, db_name):
-        """Создает новую базу данных"""
+    def create_database(self, db_name, version=DB_VERSION):
+        """Создает новую базу данных (version=1 - старый формат с разделителями)"""
         if self.mode == 'local':
-            return database.create_database(db_name)
+            return database.create_database(db_name, version)
         else:
-            return self._send_request('create_database', {'db_name': db_name})
+            return self._send_request('create_database', {'db_name': db_name, 'version': version})
             
-    def create_table(self, db_name, table_name, columns):
-        """Создает новую таблицу в базе данных"""
+    def create_table(self, db_name, table_name, columns, cases_in_file=CASES_IN_FILE,
+                     cord_size=STANDART_CORD_SIZE, len_size=STANDART_LEN_SIZE,
+                     compression=None, compress_threshold=COMPRESSION_THRESHOLD):
+        """
+        Создает новую таблицу в базе данных
+        
+        :param cord_size: Ширина одной координаты в байтах (только формат 2)
+        :param len_size: Ширина поля длины данных в байтах (только формат 2)
+        :param compression: Сжатие данных записей: 'zlib', 'lzma' или None (только формат 2)
+        :param compress_threshold: Данные короче этого размера не сжимаются
+        """
         if self.mode == 'local':
-            return database.create_table(db_name, table_name, columns)
+            return database.create_table(db_name, table_name, columns, cases_in_file, cord_size, len_size,
+                                         compression, compress_threshold)
         else:
             return self._send_request('create_table', {
                 'db_name': db_name,
                 'table_name': table_name,
-                'columns': columns
+                'columns': columns,
+                'cases_in_file': cases_in_file,
+                'cord_size': cord_size,
+                'len_size': len_size,
+                'compression': compression,
+                'compress_threshold': compress_threshold
+            })
+            
+    def set_table_compression(self, db_name, table_name, compression, compress_threshold=COMPRESSION_THRESHOLD):
+        """Меняет сжатие таблицы для новых и перезаписываемых записей"""
+        if self.mode == 'local':
+            return database.set_table_compression(db_name, table_name, compression, compress_threshold)
+        else:
+            return self._send_request('set_table_compression', {
+                'db_name': db_name,
+                'table_name': table_name,
+                'compression': compression,
+                'compress_threshold': compress_threshold
             })
             
+    def convert_database(self, db_name):
+        """Переводит базу данных формата 1 в формат 2; возвращает статистику перевода"""
+        if self.mode == 'local':
+            return database.convert_database(db_name)
+        else:
+            return self._send_request('convert_database', {'db_name': db_name})
+            
     def get_tables(self, db_name):
         """Возвращает информацию о всех таблицах в базе данных"""
         if self.mode == 'local':
@@ -125,14 +174,7 @@ class MARDB:
         if self.mode == 'local':
             result = database.find_in_table(db_name, table_name, cords)
             if result:
-                cords, data_type, data_len, data, reversed_size = result
-                return {
-                    'cords': cords,
-                    'data_type': data_type.__name__,
-                    'data_len': data_len,
-                    'data': data,
-                    'reversed_size': reversed_size
-                }
+                return _record_to_dict(result)
             else:
                 return None
         else:
@@ -154,39 +196,268 @@ class MARDB:
                 'data': data
             })
             
-    def select_from_table(self, db_name, table_name):
-        """Возвращает все записи из таблицы"""
+    def delete_from_table(self, db_name, table_name, cords):
+        """Удаляет запись из таблицы"""
         if self.mode == 'local':
-            results = database.select_from_table(db_name, table_name)
-            # Сериализуем результаты для единообразия с серверным режимом
-            serialized_results = []
-            for result in results:
-                cords, data_type, data_len, data, reversed_size = result
-                serialized_results.append({
-                    'cords': cords,
-                    'data_type': data_type.__name__,
-                    'data_len': data_len,
-                    'data': data,
-                    'reversed_size': reversed_size
+            return database.delete_from_table(db_name, table_name, cords)
+        else:
+            return self._send_request('delete_from_table', {
+                'db_name': db_name,
+                'table_name': table_name,
+                'cords': cords
+            })
+            
+    def insert_many(self, db_name, table_name, records, batch_size=1000):
+        """Вставляет в таблицу записи из итерируемого объекта пар (координаты, данные)"""
+        if self.mode == 'local':
+            return database.insert_many(db_name, table_name, records, batch_size=batch_size)
+        else:
+            # Записи отправляются на сервер пачками
+            inserted = 0
+            records = iter(records)
+            while True:
+                batch = [[list(cords), data] for cords, data in itertools.islice(records, batch_size)]
+                if not batch:
+                    return inserted
+                inserted += self._send_request('insert_many', {
+                    'db_name': db_name,
+                    'table_name': table_name,
+                    'records': batch
                 })
-            return serialized_results
+            
+    def select_from_table(self, db_name, table_name, workers=SCAN_WORKERS):
+        """Возвращает все записи из таблицы; workers > 1 - параллельное чтение файлов (локальный режим)"""
+        if self.mode == 'local':
+            # Сериализуем результаты для единообразия с серверным режимом
+            return [_record_to_dict(result) for result in database.iter_table(db_name, table_name, workers=workers)]
         else:
             return self._send_request('select_from_table', {
                 'db_name': db_name,
                 'table_name': table_name
             })
             
-    def defragment_database(self, db_name):
-        """Дефрагментирует базу данных"""
+    def select_to_numpy(self, db_name, table_name, with_values=True):
+        """
+        Возвращает координаты таблицы матрицей NumPy int64 (записи × измерения) и значения записей
+        
+        :param with_values: Читать значения; False - только координаты из метаданных, без распаковки данных
+        :return: (координаты, значения): числовой массив для однородных чисел, иначе массив объектов; без значений - None
+        """
+        if self.mode == 'local':
+            return database.select_to_numpy(db_name, table_name, with_values)
+        else:
+            response = self._send_request('select_to_numpy', {
+                'db_name': db_name,
+                'table_name': table_name,
+                'with_values': with_values
+            })
+            if database.np is None:
+                raise ImportError("Для select_to_numpy нужен пакет numpy (pip install marlib[numpy])")
+            cords = database.np.array(response['cords'], dtype=database.np.int64).reshape(-1, response['dims'])
+            values = database.values_to_array(response['values']) if with_values else None
+            return cords, values
+            
+    def select_range(self, db_name, table_name, lower_cords, upper_cords):
+        """
+        Возвращает записи, координаты которых лежат в диапазоне, в порядке координат
+        
+        :param lower_cords: Нижние границы координат (None или более короткий список - без границы)
+        :param upper_cords: Верхние границы координат включительно
+        """
+        if self.mode == 'local':
+            return [_record_to_dict(result)
+                    for result in database.select_range(db_name, table_name, lower_cords, upper_cords)]
+        else:
+            return self._send_request('select_range', {
+                'db_name': db_name,
+                'table_name': table_name,
+                'lower_cords': lower_cords,
+                'upper_cords': upper_cords
+            })
+            
+    def find_where(self, db_name, table_name, conditions):
+        """
+        Возвращает записи с заданными значениями части координат
+        
+        :param conditions: {номер измерения или имя колонки: значение}; остальные координаты любые
+        """
+        if self.mode == 'local':
+            return [_record_to_dict(result) for result in database.find_where(db_name, table_name, conditions)]
+        else:
+            return self._send_request('find_where', {
+                'db_name': db_name,
+                'table_name': table_name,
+                'conditions': conditions
+            })
+            
+    def create_inverted_index(self, db_name, table_name, dim):
+        """Включает инвертированный индекс измерения (номер или имя колонки) для find_where"""
+        if self.mode == 'local':
+            return database.create_inverted_index(db_name, table_name, dim)
+        else:
+            return self._send_request('create_inverted_index', {
+                'db_name': db_name,
+                'table_name': table_name,
+                'dim': dim
+            })
+            
+    def drop_inverted_index(self, db_name, table_name, dim):
+        """Выключает инвертированный индекс измерения"""
+        if self.mode == 'local':
+            return database.drop_inverted_index(db_name, table_name, dim)
+        else:
+            return self._send_request('drop_inverted_index', {
+                'db_name': db_name,
+                'table_name': table_name,
+                'dim': dim
+            })
+            
+    def create_spatial_index(self, db_name, table_name):
+        """Включает для таблицы пространственный индекс для select_box и find_nearest"""
+        if self.mode == 'local':
+            return database.create_spatial_index(db_name, table_name)
+        else:
+            return self._send_request('create_spatial_index', {
+                'db_name': db_name,
+                'table_name': table_name
+            })
+            
+    def drop_spatial_index(self, db_name, table_name):
+        """Выключает пространственный индекс таблицы"""
+        if self.mode == 'local':
+            return database.drop_spatial_index(db_name, table_name)
+        else:
+            return self._send_request('drop_spatial_index', {
+                'db_name': db_name,
+                'table_name': table_name
+            })
+            
+    def select_box(self, db_name, table_name, lower_cords, upper_cords):
+        """Возвращает записи внутри прямоугольника, используя пространственный индекс таблицы"""
+        if self.mode == 'local':
+            return [_record_to_dict(result)
+                    for result in database.select_box(db_name, table_name, lower_cords, upper_cords)]
+        else:
+            return self._send_request('select_box', {
+                'db_name': db_name,
+                'table_name': table_name,
+                'lower_cords': lower_cords,
+                'upper_cords': upper_cords
+            })
+            
+    def find_nearest(self, db_name, table_name, cords, count=1):
+        """Возвращает до count записей, ближайших к координатам, от ближней к дальней"""
+        if self.mode == 'local':
+            return [_record_to_dict(result)
+                    for result in database.find_nearest(db_name, table_name, cords, count)]
+        else:
+            return self._send_request('find_nearest', {
+                'db_name': db_name,
+                'table_name': table_name,
+                'cords': cords,
+                'count': count
+            })
+            
+    def iter_table(self, db_name, table_name, batch_size=None, workers=SCAN_WORKERS):
+        """Лениво возвращает записи таблицы; с batch_size - списками такого размера"""
+        if self.mode == 'local':
+            if batch_size is None:
+                for record in database.iter_table(db_name, table_name, workers=workers):
+                    yield _record_to_dict(record)
+            else:
+                for batch in database.iter_table(db_name, table_name, batch_size, workers):
+                    yield [_record_to_dict(record) for record in batch]
+        else:
+            # Сервер отдает таблицу пачками по курсору
+            cursor = None
+            while True:
+                response = self._send_request('iter_table', {
+                    'db_name': db_name,
+                    'table_name': table_name,
+                    'cursor': cursor,
+                    'batch_size': batch_size or 1000
+                })
+                records = response['records']
+                if batch_size is None:
+                    yield from records
+                elif records:
+                    yield records
+                
+                cursor = response['cursor']
+                if cursor is None:
+                    return
+            
+    def defragment_database(self, db_name, background=False, threshold=None):
+        """
+        Дефрагментирует базу данных
+        
+        :param background: Сжимать файлы в фоне короткими шагами, не блокируя вызывающего
+        :param threshold: Сжимать только файлы с отношением мертвых байт к живым выше порога
+        :return: Статистика дефрагментации; в фоновом локальном режиме - объект BackgroundCompactor
+        """
+        if self.mode == 'local':
+            if background:
+                compactor = self.compactors.get(db_name)
+                if compactor is None or not compactor.is_alive():
+                    compactor = BackgroundCompactor(db_name, threshold if threshold is not None else 0,
+                                                    run_once=True).start()
+                    self.compactors[db_name] = compactor
+                return compactor
+            # Возвращается статистика: освобожденные байты и затраченное время
+            return database.defragment_database(db_name, threshold)
+        else:
+            return self._send_request('defragment_database', {
+                'db_name': db_name,
+                'background': background,
+                'threshold': threshold
+            })
+            
+    def get_compaction_status(self, db_name):
+        """Возвращает {'running': фоновое сжатие еще идет, 'stats': его статистика или None}"""
+        if self.mode == 'local':
+            compactor = self.compactors.get(db_name)
+            return compactor.get_status() if compactor else {'running': False, 'stats': None}
+        else:
+            return self._send_request('get_compaction_status', {'db_name': db_name})
+            
+    def get_fragmentation(self, db_name):
+        """Возвращает показатели фрагментации файлов записей базы данных"""
+        if self.mode == 'local':
+            return database.get_database_fragmentation(db_name)
+        else:
+            return self._send_request('get_fragmentation', {'db_name': db_name})
+            
+    def get_buffer_pool_stats(self):
+        """Возвращает счетчики пула страниц файлов записей (попадания, промахи, вытеснения)"""
+        if self.mode == 'local':
+            return file_operations.get_buffer_pool_stats()
+        else:
+            return self._send_request('get_buffer_pool_stats', {})
+            
+    def get_compression_stats(self):
+        """Возвращает счетчики сжатия записей: байты до и после сжатия, степень сжатия, время сжатия и распаковки"""
+        if self.mode == 'local':
+            return serialization.get_compression_stats()
+        else:
+            return self._send_request('get_compression_stats', {})
+            
+    def open_database(self, db_name, durability=WAL_DURABILITY):
+        """
+        Открывает журнал упреждающей записи базы данных
+        
+        :param durability: 'none' - без fsync, 'batch' - групповой fsync, 'op' - fsync на каждую операцию
+        """
+        if self.mode == 'local':
+            return database.open_database(db_name, durability)
+        else:
+            raise Exception("Write-ahead log is configured by the server (--durability)")
+            
+    def close_database(self, db_name):
+        """Сбрасывает изменения на диск и закрывает журнал базы данных"""
         if self.mode == 'local':
-            # Получаем все файлы таблиц и дефрагментируем их
-            table_files = database.get_table_files(db_name)
-            for files in table_files.values():
-                for file_name in files:
-                    file_operations.defragment_file(file_name)
-            return True
+            database.close_database(db_name)
         else:
-            return self._send_request('defragment_database', {'db_name': db_name})
+            raise Exception("Write-ahead log is configured by the server (--durability)")
             
     def load_database(self, db_name, mode='fast'):
         """Загружает базу данных на сервере"""
@@ -14,11 +14,14 @@ from .config import *
 from . import database
 from . import file_operations
 from . import serialization
+from .compaction import BackgroundCompactor
+from .wal import OP_INSERT
 
 class MARDatabaseServer:
     def __init__(self, host='localhost', port=9999, log_level='INFO', 
                  console_log=True, file_log=False, log_file='mardb_server.log',
-                 sync_interval=30, load_mode='fast'):
+                 sync_interval=30, load_mode='fast', compact_threshold=None,
+                 compact_interval=COMPACTION_INTERVAL, durability=None, scan_workers=SCAN_WORKERS):
         self.host = host
         self.port = port
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -26,6 +29,11 @@ class MARDatabaseServer:
         self.running = False
         self.sync_interval = sync_interval  # Интервал синхронизации в секундах
         self.load_mode = load_mode  # Режим загрузки: full, part, fast
+        self.compact_threshold = compact_threshold  # Порог фрагментации для автоматического сжатия (None - выключено)
+        self.compact_interval = compact_interval
+        self.scan_workers = scan_workers  # Процессы параллельного чтения таблиц при полной загрузке
+        self.compactors = {}        # Фоновые дефрагментаторы: {db_name: BackgroundCompactor}
+        self.durability = durability  # Режим журнала упреждающей записи (None - журнал выключен)
         
         # Структуры для хранения данных в памяти
         self.active_databases = {}  # Активные базы данных
@@ -85,6 +93,10 @@ class MARDatabaseServer:
                 'load_mode': mode
             }
             
+        # Журнал открывается до загрузки данных: операции, оставшиеся после сбоя, применяются к файлам
+        if self.durability is not None:
+            database.open_database(db_name, self.durability)
+            
         # Получаем информацию о таблицах
         tables = database.get_tables(db_name)
         self.active_databases[db_name]['tables'] = tables
@@ -118,6 +130,10 @@ class MARDatabaseServer:
             # В этом режиме данные загружаются по мере обращения
             pass
             
+        # Постоянное фоновое сжатие фрагментированных файлов
+        if self.compact_threshold is not None:
+            self.start_compactor(db_name, self.compact_threshold)
+            
         self.logger.info(f"Database loaded: {db_name} in {mode} mode")
         
     def load_marl_file(self, db_name, marl_file):
@@ -160,14 +176,16 @@ class MARDatabaseServer:
         if full:
             # Загружаем все данные таблицы
             try:
-                records = database.select_from_table(db_name, table_name)
-                for record in records:
+                # Записи читаются потоком, без промежуточного списка всей таблицы
+                records_count = 0
+                for record in database.iter_table(db_name, table_name, workers=self.scan_workers):
                     cords, data_type, data_len, data, reversed_size = record
                     cord_key = tuple(cords)
                     self.cached_data[db_name][table_name][cord_key] = data
                     self.accessed_cells[db_name][table_name].add(cord_key)
+                    records_count += 1
                     
-                self.logger.info(f"Loaded table {table_name} from {db_name}, records: {len(records)}")
+                self.logger.info(f"Loaded table {table_name} from {db_name}, records: {records_count}")
             except Exception as e:
                 self.logger.error(f"Error loading table {table_name} from {db_name}: {e}")
                 
@@ -202,6 +220,93 @@ class MARDatabaseServer:
         except Exception as e:
             self.logger.error(f"Error loading case {cords} from {table_name} in {db_name}: {e}")
             
+    def cache_insert(self, db_name, table_name, cords, data, log=True):
+        """Сохраняет запись в кэше и помечает ее для синхронизации с базой"""
+        cord_key = tuple(cords)
+        
+        # Сохраняем в кэш
+        if db_name not in self.cached_data:
+            self.cached_data[db_name] = {}
+        if table_name not in self.cached_data[db_name]:
+            self.cached_data[db_name][table_name] = {}
+        
+        self.cached_data[db_name][table_name][cord_key] = data
+        
+        # Помечаем как измененную ячейку
+        if db_name not in self.modified_cells:
+            self.modified_cells[db_name] = {}
+        if table_name not in self.modified_cells[db_name]:
+            self.modified_cells[db_name][table_name] = set()
+        
+        self.modified_cells[db_name][table_name].add(cord_key)
+        
+        # Помечаем как доступную ячейку
+        if db_name not in self.accessed_cells:
+            self.accessed_cells[db_name] = {}
+        if table_name not in self.accessed_cells[db_name]:
+            self.accessed_cells[db_name][table_name] = set()
+        
+        self.accessed_cells[db_name][table_name].add(cord_key)
+        
+        # Добавляем операцию в очередь для синхронизации
+        self.operation_queue.append({
+            'type': 'insert',
+            'db_name': db_name,
+            'table_name': table_name,
+            'cords': cords,
+            'data': data
+        })
+        
+        # Операция становится надежной до ответа клиенту; в файлы ее запишет синхронизация
+        if log:
+            database.log_operations(db_name, [(OP_INSERT, table_name, cords, data)], pending=False)
+        
+    @staticmethod
+    def record_to_dict(record):
+        """Преобразует запись из кортежа в словарь для передачи клиенту"""
+        cords, data_type, data_len, data, reversed_size = record
+        return {
+            'cords': cords,
+            'data_type': data_type.__name__,
+            'data_len': data_len,
+            'data': data,
+            'reversed_size': reversed_size
+        }
+        
+    def modified_records(self, db_name, table_name):
+        """Возвращает еще не синхронизированные записи таблицы из кэша {координаты: запись}"""
+        table_cache = self.cached_data.get(db_name, {}).get(table_name, {})
+        records = {}
+        for cord_key in list(self.modified_cells.get(db_name, {}).get(table_name, ())):
+            if cord_key in table_cache:
+                data = table_cache[cord_key]
+                records[cord_key] = {
+                    'cords': list(cord_key),
+                    'data_type': type(data).__name__,
+                    'data_len': len(str(data)),
+                    'data': data,
+                    'reversed_size': 0
+                }
+        return records
+        
+    def start_compactor(self, db_name, threshold, run_once=False):
+        """Запускает фоновую дефрагментацию базы данных, если она еще не идет"""
+        compactor = self.compactors.get(db_name)
+        if compactor and compactor.is_alive():
+            return compactor
+        
+        compactor = BackgroundCompactor(db_name, threshold, interval=self.compact_interval,
+                                        run_once=run_once, logger=self.logger)
+        self.compactors[db_name] = compactor.start()
+        self.logger.info(f"Background compaction started for {db_name} (threshold: {threshold})")
+        return compactor
+        
+    def stop_compactor(self, db_name):
+        """Останавливает фоновую дефрагментацию базы данных"""
+        compactor = self.compactors.pop(db_name, None)
+        if compactor:
+            compactor.stop()
+            
     def sync_worker(self):
         """Фоновая задача для синхронизации данных с базой"""
         while self.running:
@@ -216,33 +321,43 @@ class MARDatabaseServer:
         self.logger.info("Starting database synchronization")
         
         for db_name, tables in self.modified_cells.items():
-            for table_name, cells in tables.items():
-                if not cells:
-                    continue
-                    
-                for cord_key in cells:
-                    if (db_name in self.cached_data and 
-                        table_name in self.cached_data[db_name] and 
-                        cord_key in self.cached_data[db_name][table_name]):
-                        
-                        data = self.cached_data[db_name][table_name][cord_key]
-                        cords = list(cord_key)
-                        
-                        try:
-                            # Обновляем данные в базе
-                            success = database.insert_into_table(db_name, table_name, cords, data)
-                            if success:
-                                self.logger.debug(f"Synced case {cords} to {table_name} in {db_name}")
-                            else:
-                                self.logger.error(f"Failed to sync case {cords} to {table_name} in {db_name}")
-                        except Exception as e:
-                            self.logger.error(f"Error syncing case {cords} to {table_name} in {db_name}: {e}")
-                
-                # Очищаем множество измененных ячеек после синхронизации
-                cells.clear()
+            # Все операции журнала до этого смещения попадут в файлы этой синхронизацией
+            wal = database.get_wal(db_name)
+            checkpoint_upto = wal.tell() if wal else None
+            
+            for table_name in list(tables):
+                self.sync_table(db_name, table_name)
+                
+            if checkpoint_upto is not None:
+                database.checkpoint_database(db_name, checkpoint_upto)
                 
         self.logger.info("Database synchronization completed")
         
+    def sync_table(self, db_name, table_name):
+        """Записывает в файлы измененные ячейки одной таблицы из кэша"""
+        cells = self.modified_cells.get(db_name, {}).get(table_name)
+        if not cells:
+            return
+            
+        # Ячейки забираются до записи: измененные во время синхронизации останутся на следующую
+        synced_cells = set(cells)
+        cells.difference_update(synced_cells)
+        
+        # Измененные ячейки таблицы записываются одной пачкой
+        table_cache = self.cached_data.get(db_name, {}).get(table_name, {})
+        records = [(list(cord_key), table_cache[cord_key])
+                   for cord_key in synced_cells if cord_key in table_cache]
+        
+        try:
+            # Операции уже записаны в журнал в cache_insert
+            synced = database.insert_many(db_name, table_name, records, log=False)
+            if synced == len(records):
+                self.logger.debug(f"Synced {synced} cases to {table_name} in {db_name}")
+            else:
+                self.logger.error(f"Failed to sync cases to {table_name} in {db_name}")
+        except Exception as e:
+            self.logger.error(f"Error syncing cases to {table_name} in {db_name}: {e}")
+        
     def start(self):
         """Запускает сервер базы данных"""
         try:
@@ -276,9 +391,16 @@ class MARDatabaseServer:
         """Останавливает сервер"""
         self.running = False
         
+        for db_name in list(self.compactors):
+            self.stop_compactor(db_name)
+        
         # Синхронизируем все данные перед остановкой
         self.sync_to_database()
         
+        for db_name in list(self.active_databases):
+            database.close_database(db_name)
+        database.shutdown_scan_pools()
+        
         self.socket.close()
         self.logger.info("MAR Database Server stopped")
         
@@ -338,17 +460,23 @@ class MARDatabaseServer:
                 self.load_database(db_name)
             
             if command == 'create_database':
-                database.create_database(args['db_name'])
+                database.create_database(args['db_name'], args.get('version', DB_VERSION))
                 self.load_database(args['db_name'])
                 self.logger.info(f"Database created: {args['db_name']}")
                 return {'status': 'success', 'data': None}
                 
             elif command == 'create_table':
-                database.create_table(args['db_name'], args['table_name'], args['columns'])
+                database.create_table(args['db_name'], args['table_name'], args['columns'],
+                                      args.get('cases_in_file', CASES_IN_FILE),
+                                      args.get('cord_size', STANDART_CORD_SIZE),
+                                      args.get('len_size', STANDART_LEN_SIZE),
+                                      args.get('compression'),
+                                      args.get('compress_threshold', COMPRESSION_THRESHOLD))
                 # Обновляем информацию о базе данных
                 if args['db_name'] in self.active_databases:
                     tables = database.get_tables(args['db_name'])
                     self.active_databases[args['db_name']]['tables'] = tables
+                    self.active_databases[args['db_name']]['files'] = database.get_table_files(args['db_name'])
                 self.logger.info(f"Table created: {args['table_name']} in {args['db_name']}")
                 return {'status': 'success', 'data': None}
                 
@@ -426,45 +554,39 @@ class MARDatabaseServer:
             elif command == 'insert_into_table':
                 db_name = args['db_name']
                 table_name = args['table_name']
-                cords = args['cords']
-                data = args['data']
-                cord_key = tuple(cords)
+                self.cache_insert(db_name, table_name, args['cords'], args['data'])
                 
-                # Сохраняем в кэш
-                if db_name not in self.cached_data:
-                    self.cached_data[db_name] = {}
-                if table_name not in self.cached_data[db_name]:
-                    self.cached_data[db_name][table_name] = {}
-                    
-                self.cached_data[db_name][table_name][cord_key] = data
+                self.logger.info(f"Record inserted into cache: {table_name} in {db_name}")
+                return {'status': 'success', 'data': True}
                 
-                # Помечаем как измененную ячейку
-                if db_name not in self.modified_cells:
-                    self.modified_cells[db_name] = {}
-                if table_name not in self.modified_cells[db_name]:
-                    self.modified_cells[db_name][table_name] = set()
-                    
-                self.modified_cells[db_name][table_name].add(cord_key)
+            elif command == 'insert_many':
+                db_name = args['db_name']
+                table_name = args['table_name']
+                for cords, data in args['records']:
+                    self.cache_insert(db_name, table_name, cords, data, log=False)
                 
-                # Помечаем как доступную ячейку
-                if db_name not in self.accessed_cells:
-                    self.accessed_cells[db_name] = {}
-                if table_name not in self.accessed_cells[db_name]:
-                    self.accessed_cells[db_name][table_name] = set()
-                    
-                self.accessed_cells[db_name][table_name].add(cord_key)
+                # Вся пачка записывается в журнал одной операцией с одним fsync
+                database.log_operations(db_name, [(OP_INSERT, table_name, cords, data)
+                                                  for cords, data in args['records']], pending=False)
                 
-                # Добавляем операцию в очередь для синхронизации
-                self.operation_queue.append({
-                    'type': 'insert',
-                    'db_name': db_name,
-                    'table_name': table_name,
-                    'cords': cords,
-                    'data': data
-                })
+                self.logger.info(f"{len(args['records'])} records inserted into cache: {table_name} in {db_name}")
+                return {'status': 'success', 'data': len(args['records'])}
                 
-                self.logger.info(f"Record inserted into cache: {table_name} in {db_name}")
-                return {'status': 'success', 'data': True}
+            elif command == 'delete_from_table':
+                db_name = args['db_name']
+                table_name = args['table_name']
+                cord_key = tuple(args['cords'])
+                
+                # Ячейка убирается из кэша, чтобы синхронизация не записала ее обратно
+                self.modified_cells.get(db_name, {}).get(table_name, set()).discard(cord_key)
+                self.accessed_cells.get(db_name, {}).get(table_name, set()).discard(cord_key)
+                cached = self.cached_data.get(db_name, {}).get(table_name, {}).pop(cord_key, None)
+                
+                # Удаление попадает в журнал после вставок этой ячейки, поэтому повтор журнала сохранит порядок
+                deleted = database.delete_from_table(db_name, table_name, list(cord_key))
+                
+                self.logger.info(f"Record deleted: {table_name} in {db_name}")
+                return {'status': 'success', 'data': deleted or cached is not None}
                 
             elif command == 'select_from_table':
                 table_name = args['table_name']
@@ -516,13 +638,153 @@ class MARDatabaseServer:
                 self.logger.debug(f"Selected {len(results)} records from database: {table_name}")
                 return {'status': 'success', 'data': serialized_results}
                 
+            elif command in ('select_range', 'select_box'):
+                table_name = args['table_name']
+                lower_cords = args.get('lower_cords')
+                upper_cords = args.get('upper_cords')
+                select = database.select_range if command == 'select_range' else database.select_box
+                
+                results = {tuple(record[0]): self.record_to_dict(record)
+                           for record in select(db_name, table_name, lower_cords, upper_cords)}
+                
+                # Измененные, но еще не синхронизированные ячейки берутся из кэша
+                for cord_key, record in self.modified_records(db_name, table_name).items():
+                    if database.cords_in_range(cord_key, lower_cords, upper_cords):
+                        results[cord_key] = record
+                
+                self.logger.debug(f"Selected {len(results)} records in range from {table_name}")
+                return {'status': 'success', 'data': [results[key] for key in sorted(results)]}
+                
+            elif command == 'select_to_numpy':
+                table_name = args['table_name']
+                with_values = args.get('with_values', True)
+                cords, values = database.select_columns(db_name, table_name, with_values)
+                
+                # Измененные, но еще не синхронизированные ячейки берутся из кэша
+                modified = self.modified_records(db_name, table_name)
+                if modified:
+                    rows = {cord_key: i for i, cord_key in enumerate(cords)}
+                    for cord_key, record in modified.items():
+                        if cord_key in rows:
+                            if with_values:
+                                values[rows[cord_key]] = record['data']
+                        else:
+                            cords.append(cord_key)
+                            if with_values:
+                                values.append(record['data'])
+                
+                table_files = next(iter(database.get_table_files(db_name, table_name).values()), [])
+                dims = database.get_table_info(table_files[0])[0] if table_files else 0
+                return {'status': 'success', 'data': {'cords': cords, 'values': values, 'dims': dims}}
+                
+            elif command == 'find_nearest':
+                table_name = args['table_name']
+                cords = args['cords']
+                count = args.get('count', 1)
+                
+                results = {tuple(record[0]): self.record_to_dict(record)
+                           for record in database.find_nearest(db_name, table_name, cords, count)}
+                results.update(self.modified_records(db_name, table_name))
+                
+                # Кандидаты из файлов и кэша упорядочиваются по расстоянию заново
+                def distance(cord_key):
+                    return sum((a - b) * (a - b) for a, b in zip(cord_key, cords)), cord_key
+                
+                nearest = sorted(results, key=distance)[:count]
+                return {'status': 'success', 'data': [results[key] for key in nearest]}
+                
+            elif command == 'find_where':
+                table_name = args['table_name']
+                results = {tuple(record[0]): self.record_to_dict(record)
+                           for record in database.find_where(db_name, table_name, args['conditions'])}
+                
+                # Измененные, но еще не синхронизированные ячейки берутся из кэша
+                modified = self.modified_records(db_name, table_name)
+                if modified:
+                    cords_count = len(next(iter(modified)))
+                    conditions = {database.resolve_dim(db_name, table_name, dim, cords_count): value
+                                  for dim, value in args['conditions'].items()}
+                    for cord_key, record in modified.items():
+                        if all(cord_key[dim] == value for dim, value in conditions.items()):
+                            results[cord_key] = record
+                
+                return {'status': 'success', 'data': [results[key] for key in sorted(results)]}
+                
+            elif command == 'create_inverted_index':
+                return {'status': 'success',
+                        'data': database.create_inverted_index(db_name, args['table_name'], args['dim'])}
+                
+            elif command == 'drop_inverted_index':
+                database.drop_inverted_index(db_name, args['table_name'], args['dim'])
+                return {'status': 'success', 'data': None}
+                
+            elif command == 'create_spatial_index':
+                return {'status': 'success', 'data': database.create_spatial_index(db_name, args['table_name'])}
+                
+            elif command == 'drop_spatial_index':
+                database.drop_spatial_index(db_name, args['table_name'])
+                return {'status': 'success', 'data': None}
+                
+            elif command == 'iter_table':
+                # Страницы читаются прямо из файлов, поэтому несинхронизированные ячейки таблицы
+                # записываются в них перед каждой страницей; журнал сохраняет их до общей синхронизации
+                self.sync_table(db_name, args['table_name'])
+                
+                # Постраничная выдача таблицы: курсор указывает на файл и слот следующей записи
+                records, cursor = database.read_table_batch(
+                    db_name, args['table_name'], args.get('cursor'), args.get('batch_size', 1000))
+                
+                serialized_results = []
+                for result in records:
+                    cords, data_type, data_len, data, reversed_size = result
+                    serialized_results.append({
+                        'cords': cords,
+                        'data_type': data_type.__name__,
+                        'data_len': data_len,
+                        'data': data,
+                        'reversed_size': reversed_size
+                    })
+                
+                self.logger.debug(f"Sent {len(records)} records from {args['table_name']}, cursor: {cursor}")
+                return {'status': 'success', 'data': {'records': serialized_results, 'cursor': cursor}}
+                
             elif command == 'defragment_database':
-                # Получаем все файлы таблиц и дефрагментируем их
-                table_files = database.get_table_files(db_name)
-                for files in table_files.values():
-                    for file_name in files:
-                        file_operations.defragment_file(file_name)
-                self.logger.info(f"Database defragmented: {db_name}")
+                threshold = args.get('threshold')
+                if args.get('background'):
+                    # Сжатие идет короткими шагами в отдельном потоке, запросы продолжают обслуживаться
+                    compactor = self.start_compactor(db_name, threshold if threshold is not None else 0,
+                                                     run_once=True)
+                    return {'status': 'success', 'data': compactor.stats}
+                
+                stats = database.defragment_database(db_name, threshold)
+                self.logger.info(f"Database defragmented: {db_name}, "
+                                 f"reclaimed {stats['bytes_reclaimed']} bytes in {stats['elapsed']:.3f} s")
+                return {'status': 'success', 'data': stats}
+                
+            elif command == 'get_compaction_status':
+                compactor = self.compactors.get(db_name)
+                status = compactor.get_status() if compactor else {'running': False, 'stats': None}
+                return {'status': 'success', 'data': status}
+                
+            elif command == 'get_fragmentation':
+                return {'status': 'success', 'data': database.get_database_fragmentation(db_name)}
+                
+            elif command == 'convert_database':
+                stats = database.convert_database(db_name)
+                self.active_databases[db_name]['tables'] = database.get_tables(db_name)
+                self.logger.info(f"Database converted to format {database.CATALOG_VERSION}: {db_name}, "
+                                 f"{len(stats['files'])} files in {stats['elapsed']:.3f} s")
+                return {'status': 'success', 'data': stats}
+                
+            elif command == 'get_buffer_pool_stats':
+                return {'status': 'success', 'data': file_operations.get_buffer_pool_stats()}
+                
+            elif command == 'get_compression_stats':
+                return {'status': 'success', 'data': serialization.get_compression_stats()}
+                
+            elif command == 'set_table_compression':
+                database.set_table_compression(db_name, args['table_name'], args['compression'],
+                                               args.get('compress_threshold', COMPRESSION_THRESHOLD))
                 return {'status': 'success', 'data': None}
                 
             elif command == 'load_database':
@@ -541,6 +803,9 @@ class MARDatabaseServer:
                                 self.sync_to_database()
                                 break
                     
+                    self.stop_compactor(db_name)
+                    database.close_database(db_name)
+                    
                     # Удаляем из памяти
                     if db_name in self.cached_data:
                         del self.cached_data[db_name]
@@ -585,6 +850,15 @@ def main():
     parser.add_argument('--load-mode', default='fast',
                        choices=['full', 'part', 'fast'],
                        help='Data loading mode: full, part, fast')
+    parser.add_argument('--compact-threshold', type=float, default=None,
+                       help='Compact segments in background when dead/live bytes ratio exceeds this value')
+    parser.add_argument('--compact-interval', type=float, default=COMPACTION_INTERVAL,
+                       help='Pause between background compaction steps in seconds')
+    parser.add_argument('--durability', default=None,
+                       choices=['none', 'batch', 'op'],
+                       help='Enable the write-ahead log: none (no fsync), batch (group commit), op (fsync per operation)')
+    parser.add_argument('--scan-workers', type=int, default=SCAN_WORKERS,
+                       help='Worker processes for parallel full-table loads (0 or 1 - single process)')
     parser.add_argument('--preload', nargs='+',
                        help='Preload these databases at startup')
     
@@ -598,7 +872,11 @@ def main():
         file_log=args.file_log,
         log_file=args.log_file,
         sync_interval=args.sync_interval,
-        load_mode=args.load_mode
+        load_mode=args.load_mode,
+        compact_threshold=args.compact_threshold,
+        compact_interval=args.compact_interval,
+        durability=args.durability,
+        scan_workers=args.scan_workers
     )
     
     # Предзагрузка баз данных, если указано
@@ -12,7 +12,22 @@ import enum
 import fractions
 import weakref
 import types
-from config import STANDART_LEN_SIZE
+import time
+import zlib
+import lzma
+import operator
+from .config import STANDART_LEN_SIZE, COMPRESSION_THRESHOLD
+
+# Первый байт записи: обычная запись и запись со сжатыми данными
+CASE_FLAG = 0xf8
+COMPRESSED_CASE_FLAG = 0xf9
+# Коды методов сжатия данных записей
+COMPRESSION_METHODS = {'zlib': 1, 'lzma': 2}
+COMPRESSION_NAMES = {code: name for name, code in COMPRESSION_METHODS.items()}
+
+# Счетчики сжатия: записи, байты до и после сжатия, время сжатия и распаковки
+COMPRESSION_STATS = {'compressed': 0, 'skipped': 0, 'raw_bytes': 0, 'stored_bytes': 0,
+                     'compress_time': 0.0, 'decompressed': 0, 'decompress_time': 0.0}
 
 # Словарь соответствия типов Python и их байтовых идентификаторов
 PYTHON_TYPE_TO_BYTE = {
@@ -61,101 +76,193 @@ PYTHON_TYPE_TO_BYTE = {
 # Обратный словарь для десериализации
 BYTE_TO_PYTHON_TYPE = {v: k for k, v in PYTHON_TYPE_TO_BYTE.items()}
 
+# Форматы struct для координат стандартной ширины
+_CORD_FORMATS = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+# Кэш упаковщиков блоков координат: {(количество координат, ширина): struct.Struct}
+_CORD_STRUCTS = {}
+
 def create_cord_block(cords, cord_size):
     """Создает блок координат из списка значений"""
-    return b''.join(i.to_bytes(cord_size, byteorder='big', signed=True) for i in cords)
+    packer = _CORD_STRUCTS.get((len(cords), cord_size))
+    if packer is None:
+        code = _CORD_FORMATS.get(cord_size)
+        if code is None:
+            return b''.join(i.to_bytes(cord_size, byteorder='big', signed=True) for i in cords)
+        packer = _CORD_STRUCTS[(len(cords), cord_size)] = struct.Struct(f'>{len(cords)}{code}')
+    try:
+        # Все координаты упаковываются одним вызовом struct
+        return packer.pack(*cords)
+    except struct.error as e:
+        raise OverflowError(f"Координаты {list(cords)} не помещаются в {cord_size} байт: {e}")
+
+# Кодировщики типов пишут длину и данные в общий буфер; байт типа пишет _encode_into.
+# Длина коллекции неизвестна до записи элементов, поэтому под нее резервируется место,
+# которое заполняется после них
+
+_pack_double = struct.Struct('!d').pack
+_DOUBLE_SIZE = 8
+
+def _reserve_length(buf, len_size):
+    """Резервирует место под длину и возвращает позицию начала данных"""
+    buf += bytes(len_size)
+    return len(buf)
+
+def _patch_length(buf, start, len_size):
+    """Записывает длину данных, начинающихся с позиции start, в зарезервированное перед ними место"""
+    buf[start - len_size:start] = (len(buf) - start).to_bytes(len_size, 'big')
+
+def _encode_sized(buf, encoded, len_size):
+    buf += len(encoded).to_bytes(len_size, 'big')
+    buf += encoded
+
+def _encode_str(buf, data, len_size):
+    encoded = data.encode('utf-8')
+    buf += len(encoded).to_bytes(len_size, 'big')
+    buf += encoded
+
+def _encode_int(buf, data, len_size):
+    # Для нуля используем 1 байт
+    if data == 0:
+        _encode_sized(buf, b'\x00', len_size)
+    else:
+        _encode_sized(buf, data.to_bytes((data.bit_length() + 7) // 8, 'big', signed=True), len_size)
+
+def _encode_float(buf, data, len_size):
+    buf += _DOUBLE_SIZE.to_bytes(len_size, 'big')
+    buf += _pack_double(data)
+
+def _encode_bool(buf, data, len_size):
+    _encode_sized(buf, b'\x01' if data else b'\x00', len_size)
+
+def _encode_bytes(buf, data, len_size):
+    buf += len(data).to_bytes(len_size, 'big')
+    buf += data
+
+def _encode_complex(buf, data, len_size):
+    _encode_sized(buf, struct.pack('!dd', data.real, data.imag), len_size)
+
+def _encode_none(buf, data, len_size):
+    buf += bytes(len_size)
+
+def _encode_items(buf, data, len_size):
+    buf += bytes(len_size)
+    start = len(buf)
+    # Диспетчеризация встроена в цикл: элементов много, а вызов _encode_into на каждый дорог
+    encoders = _ENCODERS
+    for item in data:
+        try:
+            type_byte, encode = encoders[type(item)]
+        except KeyError:
+            raise TypeError(f"Неподдерживаемый тип: {type(item)}") from None
+        buf.append(type_byte)
+        encode(buf, item, len_size)
+    buf[start - len_size:start] = (len(buf) - start).to_bytes(len_size, 'big')
+
+def _encode_mapping(buf, data, len_size):
+    buf += bytes(len_size)
+    start = len(buf)
+    encoders = _ENCODERS
+    for key, value in data.items():
+        try:
+            key_byte, encode_key = encoders[type(key)]
+            value_byte, encode_value = encoders[type(value)]
+        except KeyError as e:
+            raise TypeError(f"Неподдерживаемый тип: {e.args[0]}") from None
+        buf.append(key_byte)
+        encode_key(buf, key, len_size)
+        buf.append(value_byte)
+        encode_value(buf, value, len_size)
+    buf[start - len_size:start] = (len(buf) - start).to_bytes(len_size, 'big')
+
+def _encode_nested(values):
+    """Возвращает кодировщик типа, данные которого - вложенные сериализованные значения values(data)"""
+    def encode(buf, data, len_size):
+        start = _reserve_length(buf, len_size)
+        for value in values(data):
+            _encode_into(buf, value, len_size)
+        _patch_length(buf, start, len_size)
+    return encode
+
+def _encode_with(convert):
+    """Возвращает кодировщик типа, данные которого - байты convert(data)"""
+    def encode(buf, data, len_size):
+        _encode_sized(buf, convert(data), len_size)
+    return encode
+
+def _encode_with_count(buf, data, len_size):
+    # array и memoryview: в поле длины пишется количество элементов, как в прежнем формате
+    buf += len(data).to_bytes(len_size, 'big')
+    buf += data.tobytes()
+
+_ENCODER_FUNCTIONS = {
+    str: _encode_str,
+    int: _encode_int,
+    float: _encode_float,
+    bool: _encode_bool,
+    bytes: _encode_bytes,
+    bytearray: _encode_bytes,
+    complex: _encode_complex,
+    type(None): _encode_none,
+    list: _encode_items,
+    tuple: _encode_items,
+    set: _encode_items,
+    frozenset: _encode_items,
+    collections.deque: _encode_items,
+    dict: _encode_mapping,
+    collections.defaultdict: _encode_mapping,
+    collections.OrderedDict: _encode_mapping,
+    collections.Counter: _encode_mapping,
+    collections.ChainMap: _encode_nested(lambda data: (list(data.maps),)),
+    array.array: _encode_with_count,
+    datetime.date: _encode_with(lambda data: data.isoformat().encode('utf-8')),
+    datetime.datetime: _encode_with(lambda data: data.isoformat().encode('utf-8')),
+    datetime.time: _encode_with(lambda data: data.isoformat().encode('utf-8')),
+    datetime.timedelta: _encode_with(lambda data: struct.pack('!d', data.total_seconds())),
+    decimal.Decimal: _encode_with(lambda data: str(data).encode('utf-8')),
+    uuid.UUID: _encode_with(lambda data: data.bytes),
+    re.Pattern: _encode_with(pickle.dumps),
+    re.Match: _encode_with(pickle.dumps),
+    io.StringIO: _encode_nested(lambda data: (data.getvalue(),)),
+    io.BytesIO: _encode_nested(lambda data: (data.getvalue(),)),
+    pathlib.Path: _encode_with(lambda data: str(data).encode('utf-8')),
+    enum.Enum: _encode_nested(lambda data: (data.value,)),
+    enum.Flag: _encode_nested(lambda data: (data.value,)),
+    fractions.Fraction: _encode_nested(lambda data: (data.numerator, data.denominator)),
+    memoryview: _encode_with_count,
+    weakref.ref: _encode_nested(lambda data: (data(),)),
+    weakref.ProxyType: _encode_nested(lambda data: (data,)),
+    types.FunctionType: _encode_with(pickle.dumps),
+    types.GeneratorType: _encode_with(pickle.dumps),
+    types.CoroutineType: _encode_with(pickle.dumps),
+    types.ModuleType: _encode_with(lambda data: data.__name__.encode('utf-8'))
+}
 
-def serialize_data(data):
+# Таблица сериализации: {тип: (байт типа, кодировщик)}
+_ENCODERS = {data_type: (PYTHON_TYPE_TO_BYTE[data_type][0], encode)
+             for data_type, encode in _ENCODER_FUNCTIONS.items()}
+
+def _encode_into(buf, data, len_size):
+    """Дописывает сериализованное значение в буфер"""
+    try:
+        type_byte, encode = _ENCODERS[type(data)]
+    except KeyError:
+        raise TypeError(f"Неподдерживаемый тип: {type(data)}") from None
+    buf.append(type_byte)
+    encode(buf, data, len_size)
+
+def serialize_into(buf, data, len_size=STANDART_LEN_SIZE):
+    """Дописывает данные любого поддерживаемого типа в bytearray"""
+    _encode_into(buf, data, len_size)
+    return buf
+
+def serialize_data(data, len_size=STANDART_LEN_SIZE):
     """Сериализует данные любого поддерживаемого типа"""
-    data_type = type(data)
-    
-    if data_type not in PYTHON_TYPE_TO_BYTE:
-        raise TypeError(f"Неподдерживаемый тип: {data_type}")
-    
-    type_byte = PYTHON_TYPE_TO_BYTE[data_type]
-    
-    # Простые типы данных
-    if data_type is str:
-        encoded = data.encode('utf-8')
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif data_type is int:
-        # Для нуля используем 1 байт
-        if data == 0:
-            byte_repr = b'\x00'
-        else:
-            byte_repr = data.to_bytes((data.bit_length() + 7) // 8, 'big', signed=True)
-        return type_byte + len(byte_repr).to_bytes(STANDART_LEN_SIZE, 'big') + byte_repr
-    elif data_type is float:
-        encoded = struct.pack('!d', data)
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif data_type is bool:
-        encoded = b'\x01' if data else b'\x00'
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif data_type is bytes:
-        return type_byte + len(data).to_bytes(STANDART_LEN_SIZE, 'big') + data
-    elif data_type is bytearray:
-        return type_byte + len(data).to_bytes(STANDART_LEN_SIZE, 'big') + bytes(data)
-    elif data_type is complex:
-        encoded = struct.pack('!dd', data.real, data.imag)
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif data is None:
-        return type_byte + b'\x00' * STANDART_LEN_SIZE
-    
-    # Коллекции
-    elif data_type in (list, tuple, set, frozenset, collections.deque):
-        items = b''.join(serialize_data(item) for item in data)
-        return type_byte + len(items).to_bytes(STANDART_LEN_SIZE, 'big') + items
-    elif data_type in (dict, collections.defaultdict, collections.OrderedDict, collections.Counter):
-        items = b''.join(serialize_data(k) + serialize_data(v) for k, v in data.items())
-        return type_byte + len(items).to_bytes(STANDART_LEN_SIZE, 'big') + items
-    elif data_type is collections.ChainMap:
-        items = serialize_data(list(data.maps))
-        return type_byte + len(items).to_bytes(STANDART_LEN_SIZE, 'big') + items
-    
-    # Специальные типы
-    elif data_type is array.array:
-        return type_byte + len(data).to_bytes(STANDART_LEN_SIZE, 'big') + data.tobytes()
-    elif data_type in (datetime.date, datetime.datetime, datetime.time):
-        encoded = data.isoformat().encode('utf-8')
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif data_type is datetime.timedelta:
-        encoded = struct.pack('!d', data.total_seconds())
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif data_type is decimal.Decimal:
-        encoded = str(data).encode('utf-8')
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif data_type is uuid.UUID:
-        return type_byte + len(data.bytes).to_bytes(STANDART_LEN_SIZE, 'big') + data.bytes
-    elif data_type in (re.Pattern, re.Match, types.FunctionType, types.GeneratorType, types.CoroutineType):
-        encoded = pickle.dumps(data)
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif data_type in (io.StringIO, io.BytesIO):
-        encoded = serialize_data(data.getvalue())
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif data_type is pathlib.Path:
-        encoded = str(data).encode('utf-8')
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif isinstance(data, (enum.Enum, enum.Flag)):
-        encoded = serialize_data(data.value)
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif data_type is fractions.Fraction:
-        encoded = serialize_data(data.numerator) + serialize_data(data.denominator)
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif data_type is memoryview:
-        return type_byte + len(data).to_bytes(STANDART_LEN_SIZE, 'big') + data.tobytes()
-    elif data_type is weakref.ref:
-        encoded = serialize_data(data())
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif data_type is weakref.ProxyType:
-        encoded = serialize_data(data)
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    elif data_type is types.ModuleType:
-        encoded = data.__name__.encode('utf-8')
-        return type_byte + len(encoded).to_bytes(STANDART_LEN_SIZE, 'big') + encoded
-    
-    raise TypeError(f"Сериализация не реализована для типа: {data_type}")
+    # Вложенные коллекции пишутся в один буфер без копирования сериализованных элементов на каждом уровне
+    buf = bytearray()
+    _encode_into(buf, data, len_size)
+    return bytes(buf)
 
-def deserialize_data(data, data_type):
+def deserialize_data(data, data_type, len_size=STANDART_LEN_SIZE):
     """Десериализует данные из байтового представления"""
     # Простые типы данных
     if data_type is str:
@@ -183,10 +290,10 @@ def deserialize_data(data, data_type):
         while offset < len(data):
             item_type_byte = data[offset:offset+1]
             item_type = BYTE_TO_PYTHON_TYPE[item_type_byte]
-            item_len = int.from_bytes(data[offset+1:offset+1+STANDART_LEN_SIZE], 'big')
-            item_data = data[offset+1+STANDART_LEN_SIZE:offset+1+STANDART_LEN_SIZE+item_len]
-            items.append(deserialize_data(item_data, item_type))
-            offset += 1 + STANDART_LEN_SIZE + item_len
+            item_len = int.from_bytes(data[offset+1:offset+1+len_size], 'big')
+            item_data = data[offset+1+len_size:offset+1+len_size+item_len]
+            items.append(deserialize_data(item_data, item_type, len_size))
+            offset += 1 + len_size + item_len
         
         if data_type is list:
             return items
@@ -206,18 +313,18 @@ def deserialize_data(data, data_type):
             # Ключ
             key_type_byte = data[offset:offset+1]
             key_type = BYTE_TO_PYTHON_TYPE[key_type_byte]
-            key_len = int.from_bytes(data[offset+1:offset+1+STANDART_LEN_SIZE], 'big')
-            key_data = data[offset+1+STANDART_LEN_SIZE:offset+1+STANDART_LEN_SIZE+key_len]
-            key = deserialize_data(key_data, key_type)
-            offset += 1 + STANDART_LEN_SIZE + key_len
+            key_len = int.from_bytes(data[offset+1:offset+1+len_size], 'big')
+            key_data = data[offset+1+len_size:offset+1+len_size+key_len]
+            key = deserialize_data(key_data, key_type, len_size)
+            offset += 1 + len_size + key_len
             
             # Значение
             val_type_byte = data[offset:offset+1]
             val_type = BYTE_TO_PYTHON_TYPE[val_type_byte]
-            val_len = int.from_bytes(data[offset+1:offset+1+STANDART_LEN_SIZE], 'big')
-            val_data = data[offset+1+STANDART_LEN_SIZE:offset+1+STANDART_LEN_SIZE+val_len]
-            value = deserialize_data(val_data, val_type)
-            offset += 1 + STANDART_LEN_SIZE + val_len
+            val_len = int.from_bytes(data[offset+1:offset+1+len_size], 'big')
+            val_data = data[offset+1+len_size:offset+1+len_size+val_len]
+            value = deserialize_data(val_data, val_type, len_size)
+            offset += 1 + len_size + val_len
             
             result[key] = value
         
@@ -231,7 +338,7 @@ def deserialize_data(data, data_type):
             return collections.Counter(result)
     
     elif data_type is collections.ChainMap:
-        maps_data = deserialize_data(data, list)
+        maps_data = deserialize_data(data, list, len_size)
         return collections.ChainMap(*maps_data)
     
     # Специальные типы
@@ -253,27 +360,27 @@ def deserialize_data(data, data_type):
     elif data_type in (re.Pattern, re.Match, types.FunctionType, types.GeneratorType, types.CoroutineType):
         return pickle.loads(data)
     elif data_type is io.StringIO:
-        return io.StringIO(deserialize_data(data, str))
+        return io.StringIO(deserialize_data(data, str, len_size))
     elif data_type is io.BytesIO:
-        return io.BytesIO(deserialize_data(data, bytes))
+        return io.BytesIO(deserialize_data(data, bytes, len_size))
     elif data_type is pathlib.Path:
         return pathlib.Path(data.decode('utf-8'))
     elif data_type in (enum.Enum, enum.Flag):
         # Для enum требуется дополнительная информация о классе
-        return deserialize_data(data, int)  # Упрощенная версия
+        return deserialize_data(data, int, len_size)  # Упрощенная версия
     elif data_type is fractions.Fraction:
         # Данные должны быть разделены на числитель и знаменатель
         half_len = len(data) // 2
-        numerator = deserialize_data(data[:half_len], int)
-        denominator = deserialize_data(data[half_len:], int)
+        numerator = deserialize_data(data[:half_len], int, len_size)
+        denominator = deserialize_data(data[half_len:], int, len_size)
         return fractions.Fraction(numerator, denominator)
     elif data_type is memoryview:
         return memoryview(data)
     elif data_type is weakref.ref:
-        obj = deserialize_data(data, object)
+        obj = deserialize_data(data, object, len_size)
         return weakref.ref(obj)
     elif data_type is weakref.ProxyType:
-        obj = deserialize_data(data, object)
+        obj = deserialize_data(data, object, len_size)
         return weakref.proxy(obj)
     elif data_type is types.ModuleType:
         module_name = data.decode('utf-8')
@@ -281,13 +388,62 @@ def deserialize_data(data, data_type):
     
     raise TypeError(f"Десериализация не реализована для типа: {data_type}")
 
-def create_case(cords, data, cord_size, reserved_size):
-    """Создает запись с координатами и данными"""
-    return b'\xf8' + create_cord_block(cords, cord_size) + serialize_data(data) + b'\x00' * reserved_size
+def get_compression_stats():
+    """Возвращает счетчики сжатия данных записей и степень сжатия"""
+    stats = dict(COMPRESSION_STATS)
+    stats['ratio'] = stats['raw_bytes'] / stats['stored_bytes'] if stats['stored_bytes'] else 1.0
+    return stats
+
+def reset_compression_stats():
+    """Обнуляет счетчики сжатия"""
+    for key in COMPRESSION_STATS:
+        COMPRESSION_STATS[key] = type(COMPRESSION_STATS[key])()
+
+def compress_payload(payload, method):
+    """Сжимает сериализованные данные методом с кодом method"""
+    if method == COMPRESSION_METHODS['zlib']:
+        return zlib.compress(payload)
+    if method == COMPRESSION_METHODS['lzma']:
+        return lzma.compress(payload)
+    raise ValueError(f"Неизвестный метод сжатия: {method}")
 
-def unpack_case(case_data, cord_size, cord_vals):
-    """Распаковывает запись на составляющие"""
-    if case_data[0] == 0xf8:
+def decompress_payload(packed, method):
+    """Распаковывает данные, сжатые методом с кодом method"""
+    start_time = time.perf_counter()
+    if method == COMPRESSION_METHODS['zlib']:
+        payload = zlib.decompress(packed)
+    elif method == COMPRESSION_METHODS['lzma']:
+        payload = lzma.decompress(packed)
+    else:
+        raise ValueError(f"Неизвестный метод сжатия: {method}")
+    COMPRESSION_STATS['decompressed'] += 1
+    COMPRESSION_STATS['decompress_time'] += time.perf_counter() - start_time
+    return payload
+
+def create_case(cords, data, cord_size, reserved_size, len_size=STANDART_LEN_SIZE,
+                compression=0, threshold=COMPRESSION_THRESHOLD):
+    """Создает запись с координатами и данными; данные не короче threshold сжимаются методом compression"""
+    payload = serialize_data(data, len_size)
+    if compression and len(payload) >= threshold:
+        start_time = time.perf_counter()
+        packed = compress_payload(payload, compression)
+        COMPRESSION_STATS['compress_time'] += time.perf_counter() - start_time
+        
+        # Сжатая запись хранится, только если она короче обычной; резерв ей не нужен
+        if len(packed) + 1 < len(payload) + reserved_size:
+            COMPRESSION_STATS['compressed'] += 1
+            COMPRESSION_STATS['raw_bytes'] += len(payload)
+            COMPRESSION_STATS['stored_bytes'] += len(packed) + 1
+            return (bytes((COMPRESSED_CASE_FLAG,)) + create_cord_block(cords, cord_size) +
+                    compression.to_bytes(1, 'big') + packed)
+        COMPRESSION_STATS['skipped'] += 1
+    
+    return bytes((CASE_FLAG,)) + create_cord_block(cords, cord_size) + payload + b'\x00' * reserved_size
+
+def unpack_case(case_data, cord_size, cord_vals, len_size=STANDART_LEN_SIZE):
+    """Распаковывает запись на составляющие (bytes или memoryview)"""
+    flag = case_data[0]
+    if flag in (CASE_FLAG, COMPRESSED_CASE_FLAG):
         case_data = case_data[1:]
     
     # Извлекаем координаты
@@ -297,17 +453,21 @@ def unpack_case(case_data, cord_size, cord_vals):
         cords.append(cord)
         case_data = case_data[cord_size:]
     
+    # Сжатые данные распаковываются целиком, дальше разбор одинаковый
+    if flag == COMPRESSED_CASE_FLAG:
+        case_data = decompress_payload(bytes(case_data[1:]), case_data[0])
+    
     # Извлекаем тип данных
-    type_byte = case_data[:1]
+    type_byte = bytes(case_data[:1])
     data_type = BYTE_TO_PYTHON_TYPE[type_byte]
     case_data = case_data[1:]
     
     # Извлекаем длину данных
-    data_len = int.from_bytes(case_data[:STANDART_LEN_SIZE], 'big')
-    case_data = case_data[STANDART_LEN_SIZE:]
+    data_len = int.from_bytes(case_data[:len_size], 'big')
+    case_data = case_data[len_size:]
     
-    # Извлекаем и десериализуем данные
-    data = deserialize_data(case_data[:data_len], data_type)
+    # Извлекаем и десериализуем данные (копируется только полезная нагрузка)
+    data = deserialize_data(bytes(case_data[:data_len]), data_type, len_size)
     case_data = case_data[data_len:]
     
     # Вычисляем размер резервного пространства
@@ -318,4 +478,141 @@ def unpack_case(case_data, cord_size, cord_vals):
         else:
             break
     
-    return cords, data_type, data_len, data, reserved_size
\ No newline at end of file
+    return cords, data_type, data_len, data, reserved_size
+
+
+# Поля записи в порядке кортежа, который возвращает unpack_case
+CASE_FIELDS = ('cords', 'data_type', 'data_len', 'data', 'reserved')
+_UNSET = object()
+
+class LazyCase:
+    """Запись, данные которой десериализуются при первом обращении; распаковывается как кортеж unpack_case"""
+    __slots__ = ('cords', '_raw', '_compressed', '_len_size', '_data_type', '_data_len', '_data')
+    
+    def __init__(self, cords, raw, len_size=STANDART_LEN_SIZE, compressed=False):
+        """
+        :param cords: Координаты записи
+        :param raw: Запись после координат: тип, длина, данные и резерв (или код метода и сжатые данные)
+        :param len_size: Ширина поля длины данных
+        :param compressed: Данные записи сжаты
+        """
+        self.cords = cords
+        self._raw = raw
+        self._compressed = compressed
+        self._len_size = len_size
+        self._data_type = None
+        self._data_len = None
+        self._data = _UNSET
+        if not compressed:
+            self._read_header()
+    
+    def _read_header(self):
+        """Читает тип и длину данных; сжатая запись для этого распаковывается один раз"""
+        if self._compressed:
+            self._raw = memoryview(decompress_payload(bytes(self._raw[1:]), self._raw[0]))
+            self._compressed = False
+        self._data_type = BYTE_TO_PYTHON_TYPE[bytes(self._raw[:1])]
+        self._data_len = int.from_bytes(self._raw[1:1 + self._len_size], 'big')
+    
+    @property
+    def data_type(self):
+        """Тип данных записи"""
+        if self._data_type is None:
+            self._read_header()
+        return self._data_type
+    
+    @property
+    def data_len(self):
+        """Длина сериализованных данных"""
+        if self._data_len is None:
+            self._read_header()
+        return self._data_len
+    
+    @property
+    def data(self):
+        """Данные записи, десериализуются при первом обращении"""
+        if self._data is _UNSET:
+            # Заголовок читается первым: для сжатой записи он заменяет буфер распакованным
+            data_len = self.data_len
+            start = 1 + self._len_size
+            self._data = deserialize_data(bytes(self._raw[start:start + data_len]), self._data_type, self._len_size)
+        return self._data
+    
+    @property
+    def reserved(self):
+        """Размер резерва после данных"""
+        # Резерв - нулевые байты сразу после данных
+        tail = bytes(self._raw[1 + self._len_size + self.data_len:])
+        return len(tail) - len(tail.lstrip(b'\x00'))
+    
+    def __len__(self):
+        return len(CASE_FIELDS)
+    
+    def __iter__(self):
+        return (getattr(self, field) for field in CASE_FIELDS)
+    
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return tuple(self)[item]
+        return getattr(self, CASE_FIELDS[item])
+    
+    def _compare(self, other, compare):
+        # Записи сравниваются как кортежи, в том числе с обычными кортежами
+        if isinstance(other, (tuple, LazyCase)):
+            return compare(tuple(self), tuple(other))
+        return NotImplemented
+    
+    def __eq__(self, other):
+        return self._compare(other, operator.eq)
+    
+    def __lt__(self, other):
+        return self._compare(other, operator.lt)
+    
+    def __le__(self, other):
+        return self._compare(other, operator.le)
+    
+    def __gt__(self, other):
+        return self._compare(other, operator.gt)
+    
+    def __ge__(self, other):
+        return self._compare(other, operator.ge)
+    
+    def __hash__(self):
+        # Хеш строится по тем же полям, что сравнивает __eq__; координаты - список, поэтому берется их кортеж.
+        # Как и у кортежа, хеш записи с изменяемыми данными (списком, словарем) не определен
+        cords, *rest = self
+        return hash((tuple(cords), *rest))
+    
+    def __repr__(self):
+        return f"LazyCase{tuple(self)!r}"
+    
+    def __reduce__(self):
+        # В другой процесс запись передается своими байтами, уже десериализованные данные - вместе с ними
+        loaded = self._data is not _UNSET
+        return _restore_lazy_case, (self.cords, bytes(self._raw), self._len_size, self._compressed,
+                                    self._data if loaded else None, loaded)
+
+def _restore_lazy_case(cords, raw, len_size, compressed, data, loaded):
+    """Восстанавливает LazyCase, переданный из другого процесса"""
+    case = LazyCase(cords, memoryview(raw), len_size, compressed)
+    if loaded:
+        case._data = data
+    return case
+
+def unpack_case_lazy(case_data, cord_size, cord_vals, len_size=STANDART_LEN_SIZE):
+    """Распаковывает координаты записи, оставляя десериализацию данных до первого обращения к ним"""
+    # Запись хранит свою копию байт: отображение файла может быть закрыто
+    case_data = memoryview(bytes(case_data))
+    flag = case_data[0]
+    offset = 1 if flag in (CASE_FLAG, COMPRESSED_CASE_FLAG) else 0
+    
+    unpacker = _CORD_STRUCTS.get((cord_vals, cord_size))
+    if unpacker is None and cord_size in _CORD_FORMATS:
+        unpacker = _CORD_STRUCTS[(cord_vals, cord_size)] = struct.Struct(f'>{cord_vals}{_CORD_FORMATS[cord_size]}')
+    if unpacker is not None:
+        cords = list(unpacker.unpack_from(case_data, offset))
+    else:
+        cords = [int.from_bytes(case_data[offset + i * cord_size:offset + (i + 1) * cord_size], 'big', signed=True)
+                 for i in range(cord_vals)]
+    
+    return LazyCase(cords, case_data[offset + cord_vals * cord_size:], len_size, flag == COMPRESSED_CASE_FLAG)
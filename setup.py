@@ -5,6 +5,9 @@ setup(
     version="1.0.0",
     packages=find_packages(),
     install_requires=[],
+    extras_require={
+        "numpy": ["numpy"],
+    },
     description="MAR Database Library",
     keywords="database mar",
 )
\ No newline at end of file
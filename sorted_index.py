@@ -0,0 +1,235 @@
+import os
+import bisect
+import threading
+from .config import *
+
+# Расширение файла упорядоченного индекса таблицы
+SORTED_EXT = ".mars"
+# Заголовок: общее количество ключей (4 байта) и количество ключей в упорядоченной части (4 байта)
+SORTED_COUNT_SIZE = 4
+SORTED_HEADER_SIZE = SORTED_COUNT_SIZE * 2
+# Размер поля номера файла записей таблицы
+SEGMENT_NO_SIZE = MAX_TABLES_IN_BD_B
+# Старший бит номера файла помечает запись об удалении ключа в хвосте индекса
+DELETED_FLAG = 1 << (SEGMENT_NO_SIZE * 8 - 1)
+# Неупорядоченный хвост сливается с упорядоченной частью, когда превышает ее долю или этот минимум
+SORTED_MERGE_MIN = 1024
+
+# Кэш загруженных индексов: {путь к .mars: (отметка файла, ключи по возрастанию, номера файлов)}
+SORTED_INDEX_CACHE = {}
+# Блокировки упорядоченных индексов таблиц
+SORTED_LOCKS = {}
+_SORTED_LOCKS_GUARD = threading.Lock()
+
+def cord_bias(cord_size=STANDART_CORD_SIZE):
+    """Возвращает смещение, переводящее координату со знаком в беззнаковое число того же порядка"""
+    return 1 << (cord_size * 8 - 1)
+
+def get_sorted_index_path(table_name):
+    """Возвращает путь к упорядоченному индексу таблицы"""
+    return os.path.join("config", table_name + SORTED_EXT)
+
+def sorted_index_lock(table_name):
+    """Возвращает блокировку упорядоченного индекса таблицы"""
+    path = get_sorted_index_path(table_name)
+    with _SORTED_LOCKS_GUARD:
+        return SORTED_LOCKS.setdefault(path, threading.Lock())
+
+def encode_key(cords, cord_size=STANDART_CORD_SIZE):
+    """Упаковывает координаты в ключ, побайтовый порядок которого совпадает с порядком координат"""
+    bias = cord_bias(cord_size)
+    return b''.join((cord + bias).to_bytes(cord_size, 'big') for cord in cords)
+
+def decode_key(key, cord_size=STANDART_CORD_SIZE):
+    """Распаковывает ключ в список координат"""
+    bias = cord_bias(cord_size)
+    return [int.from_bytes(key[i:i + cord_size], 'big') - bias
+            for i in range(0, len(key), cord_size)]
+
+def packed_to_key(packed, cord_size=STANDART_CORD_SIZE):
+    """Переводит ключ хеш-индекса (координаты со знаком) в ключ упорядоченного индекса"""
+    key = bytearray(packed)
+    for i in range(0, len(key), cord_size):
+        key[i] ^= 0x80
+    return bytes(key)
+
+def _file_stamp(path):
+    """Возвращает отметку состояния файла для проверки актуальности кэша"""
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def _pack_entries(keys, segments):
+    """Упаковывает пары (ключ, номер файла)"""
+    return b''.join(key + segment.to_bytes(SEGMENT_NO_SIZE, 'big') for key, segment in zip(keys, segments))
+
+def _write_sorted(path, keys, segments):
+    """Записывает индекс целиком как упорядоченную часть"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(len(keys).to_bytes(SORTED_COUNT_SIZE, 'big') * 2)
+        f.write(_pack_entries(keys, segments))
+    os.replace(temp_path, path)
+    SORTED_INDEX_CACHE[path] = (_file_stamp(path), keys, segments)
+
+def load_sorted_index(table_name, cords_count, case_count, cord_size=STANDART_CORD_SIZE):
+    """Загружает индекс таблицы (ключи, номера файлов); возвращает None, если он отсутствует или устарел"""
+    path = get_sorted_index_path(table_name)
+    if not os.path.exists(path):
+        return None
+
+    stamp = _file_stamp(path)
+    cached = SORTED_INDEX_CACHE.get(path)
+    if not (cached and cached[0] == stamp):
+        with open(path, "rb") as f:
+            raw = f.read()
+
+        total = int.from_bytes(raw[:SORTED_COUNT_SIZE], 'big')
+        sorted_count = int.from_bytes(raw[SORTED_COUNT_SIZE:SORTED_HEADER_SIZE], 'big')
+        key_size = cords_count * cord_size
+        entry_size = key_size + SEGMENT_NO_SIZE
+        if len(raw) < SORTED_HEADER_SIZE + total * entry_size:
+            return None
+
+        entries = [(raw[offset:offset + key_size],
+                    int.from_bytes(raw[offset + key_size:offset + entry_size], 'big'))
+                   for offset in range(SORTED_HEADER_SIZE, SORTED_HEADER_SIZE + total * entry_size, entry_size)]
+        if total > sorted_count:
+            # Хвост применяется в порядке записи: удаление убирает ключ, добавленный раньше,
+            # затем ключи снова упорядочиваются (timsort сливает два отрезка)
+            live = dict(entries[:sorted_count])
+            for key, segment in entries[sorted_count:]:
+                if segment & DELETED_FLAG:
+                    live.pop(key, None)
+                else:
+                    live[key] = segment
+            entries = sorted(live.items())
+
+        keys = [key for key, _ in entries]
+        segments = [segment for _, segment in entries]
+        if total > sorted_count:
+            _write_sorted(path, keys, segments)
+        else:
+            SORTED_INDEX_CACHE[path] = (stamp, keys, segments)
+        cached = SORTED_INDEX_CACHE[path]
+
+    if len(cached[1]) != case_count:
+        return None
+    return cached[1], cached[2]
+
+def rebuild_sorted_index(table_name, case_indexes, cord_size=STANDART_CORD_SIZE):
+    """Перестраивает индекс таблицы по хеш-индексам ее файлов [{упакованные координаты: ...}]"""
+    entries = sorted((packed_to_key(packed, cord_size), segment)
+                     for segment, case_index in enumerate(case_indexes)
+                     for packed in case_index)
+    keys = [key for key, _ in entries]
+    segments = [segment for _, segment in entries]
+    _write_sorted(get_sorted_index_path(table_name), keys, segments)
+    return keys, segments
+
+def create_sorted_index(table_name):
+    """Создает пустой индекс для новой таблицы"""
+    _write_sorted(get_sorted_index_path(table_name), [], [])
+
+def _append_entries(path, new_keys, new_segments):
+    """Дописывает пары (ключ, номер файла) в хвост индекса; возвращает загруженный индекс, если он
+    соответствовал файлу, и количество ключей в файле и в его упорядоченной части до дописывания"""
+    stamp = _file_stamp(path)
+    with open(path, "rb+") as f:
+        total = int.from_bytes(f.read(SORTED_COUNT_SIZE), 'big')
+        sorted_count = int.from_bytes(f.read(SORTED_COUNT_SIZE), 'big')
+        f.seek(0)
+        f.write((total + len(new_keys)).to_bytes(SORTED_COUNT_SIZE, 'big'))
+        f.seek(SORTED_HEADER_SIZE + total * (len(new_keys[0]) + SEGMENT_NO_SIZE))
+        f.write(_pack_entries(new_keys, new_segments))
+        f.truncate()
+
+    cached = SORTED_INDEX_CACHE.pop(path, None)
+    if cached is None or cached[0] != stamp:
+        cached = None
+    return cached, total, sorted_count
+
+def _store_updated(path, keys, segments, tail_count, sorted_count):
+    """Кэширует обновленный индекс; слишком длинный хвост сливается с упорядоченной частью"""
+    if tail_count > max(sorted_count // 4, SORTED_MERGE_MIN):
+        _write_sorted(path, keys, segments)
+    else:
+        SORTED_INDEX_CACHE[path] = (_file_stamp(path), keys, segments)
+
+def add_keys(table_name, entries, cord_size=STANDART_CORD_SIZE):
+    """Дописывает в индекс новые ключи [(координаты, номер файла)]; индекс без файла не ведется"""
+    path = get_sorted_index_path(table_name)
+    if not entries or not os.path.exists(path):
+        return
+
+    new_keys = [encode_key(cords, cord_size) for cords, _ in entries]
+    new_segments = [segment for _, segment in entries]
+    cached, total, sorted_count = _append_entries(path, new_keys, new_segments)
+    if cached is None:
+        return
+
+    # Загруженный индекс обновляется на месте, файл читать заново не нужно
+    keys, segments = cached[1], cached[2]
+    if len(entries) == 1:
+        i = bisect.bisect_left(keys, new_keys[0])
+        keys.insert(i, new_keys[0])
+        segments.insert(i, new_segments[0])
+    else:
+        merged = sorted(zip(keys + new_keys, segments + new_segments))
+        keys[:] = [key for key, _ in merged]
+        segments[:] = [segment for _, segment in merged]
+
+    _store_updated(path, keys, segments, total + len(entries) - sorted_count, sorted_count)
+
+def remove_keys(table_name, cords_list, cord_size=STANDART_CORD_SIZE):
+    """Дописывает в индекс удаление ключей [координаты]; индекс без файла не ведется"""
+    path = get_sorted_index_path(table_name)
+    if not cords_list or not os.path.exists(path):
+        return
+
+    removed = [encode_key(cords, cord_size) for cords in cords_list]
+    cached, total, sorted_count = _append_entries(path, removed, [DELETED_FLAG] * len(removed))
+    if cached is None:
+        return
+
+    keys, segments = cached[1], cached[2]
+    for key in removed:
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
+            del segments[i]
+
+    _store_updated(path, keys, segments, total + len(removed) - sorted_count, sorted_count)
+
+def range_bounds(lower_cords, upper_cords, cords_count, cord_size=STANDART_CORD_SIZE):
+    """Дополняет границы диапазона до полного числа координат; None означает отсутствие границы.
+    Границы прижимаются к диапазону координат заданной ширины, иначе их нельзя упаковать в ключ;
+    нижняя граница выше этого диапазона оставляется как есть - диапазон пуст (is_empty_range)"""
+    bias = cord_bias(cord_size)
+    lower = list(lower_cords or [])[:cords_count]
+    upper = list(upper_cords or [])[:cords_count]
+    lower += [None] * (cords_count - len(lower))
+    upper += [None] * (cords_count - len(upper))
+    lower = [-bias if cord is None else max(cord, -bias) for cord in lower]
+    upper = [bias - 1 if cord is None else min(cord, bias - 1) for cord in upper]
+    return lower, upper
+
+def is_empty_range(lower, upper):
+    """Проверяет, пуст ли диапазон: нижняя граница какой-либо координаты больше верхней"""
+    return any(low > high for low, high in zip(lower, upper))
+
+def find_range(keys, segments, lower, upper, cord_size=STANDART_CORD_SIZE):
+    """Возвращает [(координаты, номер файла)] ключей внутри прямоугольника [lower, upper]"""
+    # Лексикографический отрезок [lower, upper] содержит все подходящие ключи;
+    # ключи внутри него, вышедшие за границы по последующим координатам, отбрасываются
+    if is_empty_range(lower, upper):
+        return []
+    start = bisect.bisect_left(keys, encode_key(lower, cord_size))
+    end = bisect.bisect_right(keys, encode_key(upper, cord_size))
+    bounds = list(zip(lower, upper))
+
+    result = []
+    for i in range(start, end):
+        cords = decode_key(keys[i], cord_size)
+        if all(low <= cord <= high for cord, (low, high) in zip(cords, bounds)):
+            result.append((cords, segments[i]))
+    return result
@@ -0,0 +1,285 @@
+import os
+import heapq
+import threading
+from .config import *
+from .serialization import create_cord_block
+
+# Расширение файла пространственного индекса таблицы
+SPATIAL_EXT = ".marp"
+# Заголовок: общее количество точек (4 байта) и количество точек в дереве (4 байта)
+SPATIAL_COUNT_SIZE = 4
+SPATIAL_HEADER_SIZE = SPATIAL_COUNT_SIZE * 2
+# Размер поля номера файла записей таблицы
+SEGMENT_NO_SIZE = MAX_TABLES_IN_BD_B
+# Старший бит номера файла помечает запись об удалении точки в хвосте индекса
+DELETED_FLAG = 1 << (SEGMENT_NO_SIZE * 8 - 1)
+# Дерево перестраивается, когда хвост новых точек превышает четверть дерева или этот минимум
+SPATIAL_REBUILD_MIN = 1024
+
+# Кэш загруженных индексов: {путь к .marp: (отметка файла, точки, номера файлов, точек в дереве, живых точек)};
+# у удаленных точек номер файла None - они остаются в дереве и хвосте до перестройки дерева
+SPATIAL_INDEX_CACHE = {}
+# Блокировки пространственных индексов таблиц
+SPATIAL_LOCKS = {}
+_SPATIAL_LOCKS_GUARD = threading.Lock()
+
+def get_spatial_index_path(table_name):
+    """Возвращает путь к пространственному индексу таблицы"""
+    return os.path.join("config", table_name + SPATIAL_EXT)
+
+def has_spatial_index(table_name):
+    """Проверяет, включен ли для таблицы пространственный индекс"""
+    return os.path.exists(get_spatial_index_path(table_name))
+
+def spatial_index_lock(table_name):
+    """Возвращает блокировку пространственного индекса таблицы"""
+    path = get_spatial_index_path(table_name)
+    with _SPATIAL_LOCKS_GUARD:
+        return SPATIAL_LOCKS.setdefault(path, threading.Lock())
+
+def _file_stamp(path):
+    """Возвращает отметку состояния файла для проверки актуальности кэша"""
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def _pack_points(points, segments, cord_size=STANDART_CORD_SIZE):
+    """Упаковывает пары (координаты, номер файла)"""
+    return b''.join(create_cord_block(point, cord_size) + segment.to_bytes(SEGMENT_NO_SIZE, 'big')
+                    for point, segment in zip(points, segments))
+
+def build_tree(points, segments):
+    """Раскладывает точки в неявное k-d дерево: корень отрезка [lo, hi) лежит в его середине"""
+    if not points:
+        return [], []
+
+    dims = len(points[0])
+    tree = [None] * len(points)
+    stack = [(0, 0, list(zip(points, segments)))]
+    while stack:
+        lo, depth, items = stack.pop()
+        if not items:
+            continue
+        # Медиана по оси уровня делит точки на левое и правое поддерево
+        axis = depth % dims
+        items.sort(key=lambda item: item[0][axis])
+        mid = len(items) // 2
+        tree[lo + mid] = items[mid]
+        stack.append((lo, depth + 1, items[:mid]))
+        stack.append((lo + mid + 1, depth + 1, items[mid + 1:]))
+
+    return [point for point, _ in tree], [segment for _, segment in tree]
+
+def _write_tree(path, points, segments, cord_size=STANDART_CORD_SIZE):
+    """Строит дерево по всем живым точкам и записывает индекс целиком"""
+    live = [(point, segment) for point, segment in zip(points, segments) if segment is not None]
+    points, segments = build_tree([point for point, _ in live], [segment for _, segment in live])
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(len(points).to_bytes(SPATIAL_COUNT_SIZE, 'big') * 2)
+        f.write(_pack_points(points, segments, cord_size))
+    os.replace(temp_path, path)
+    SPATIAL_INDEX_CACHE[path] = (_file_stamp(path), points, segments, len(points), len(points))
+    return points, segments
+
+def load_spatial_index(table_name, cords_count, case_count, cord_size=STANDART_CORD_SIZE):
+    """Загружает индекс (точки, номера файлов, точек в дереве); None, если его нет или он устарел"""
+    path = get_spatial_index_path(table_name)
+    if not os.path.exists(path):
+        return None
+
+    stamp = _file_stamp(path)
+    cached = SPATIAL_INDEX_CACHE.get(path)
+    if not (cached and cached[0] == stamp):
+        with open(path, "rb") as f:
+            raw = f.read()
+
+        total = int.from_bytes(raw[:SPATIAL_COUNT_SIZE], 'big')
+        tree_count = int.from_bytes(raw[SPATIAL_COUNT_SIZE:SPATIAL_HEADER_SIZE], 'big')
+        point_size = cords_count * cord_size
+        entry_size = point_size + SEGMENT_NO_SIZE
+        if len(raw) < SPATIAL_HEADER_SIZE + total * entry_size:
+            return None
+
+        points = []
+        segments = []
+        for offset in range(SPATIAL_HEADER_SIZE, SPATIAL_HEADER_SIZE + total * entry_size, entry_size):
+            point = tuple(int.from_bytes(raw[i:i + cord_size], 'big', signed=True)
+                          for i in range(offset, offset + point_size, cord_size))
+            segment = int.from_bytes(raw[offset + point_size:offset + entry_size], 'big')
+            # Хвост применяется в порядке записи: удаление убирает точку, добавленную раньше
+            if segment & DELETED_FLAG:
+                _remove_point(points, segments, tree_count, point)
+            else:
+                points.append(point)
+                segments.append(segment)
+
+        cached = (stamp, points, segments, tree_count, len(points) - segments.count(None))
+        SPATIAL_INDEX_CACHE[path] = cached
+
+    if cached[4] != case_count:
+        return None
+    return cached[1], cached[2], cached[3]
+
+def rebuild_spatial_index(table_name, case_indexes, cords_count, cord_size=STANDART_CORD_SIZE):
+    """Строит индекс таблицы по хеш-индексам ее файлов [{упакованные координаты: ...}]"""
+    points = []
+    segments = []
+    for segment, case_index in enumerate(case_indexes):
+        for packed in case_index:
+            points.append(tuple(int.from_bytes(packed[i:i + cord_size], 'big', signed=True)
+                                for i in range(0, cords_count * cord_size, cord_size)))
+            segments.append(segment)
+
+    points, segments = _write_tree(get_spatial_index_path(table_name), points, segments, cord_size)
+    return points, segments, len(points)
+
+def drop_spatial_index(table_name):
+    """Выключает пространственный индекс таблицы"""
+    path = get_spatial_index_path(table_name)
+    SPATIAL_INDEX_CACHE.pop(path, None)
+    if os.path.exists(path):
+        os.remove(path)
+
+def _remove_point(points, segments, tree_count, point):
+    """Помечает точку загруженного индекса удаленной; списки не сдвигаются до перестройки дерева"""
+    for i in query_box(points, tree_count, point, point, segments):
+        segments[i] = None
+        return True
+    return False
+
+def _append_points(path, new_points, new_segments, cord_size=STANDART_CORD_SIZE):
+    """Дописывает пары (точка, номер файла) в хвост индекса; возвращает загруженный индекс, если он
+    соответствовал файлу, и количество точек в файле и в дереве до дописывания"""
+    stamp = _file_stamp(path)
+    with open(path, "rb+") as f:
+        total = int.from_bytes(f.read(SPATIAL_COUNT_SIZE), 'big')
+        tree_count = int.from_bytes(f.read(SPATIAL_COUNT_SIZE), 'big')
+        f.seek(0)
+        f.write((total + len(new_points)).to_bytes(SPATIAL_COUNT_SIZE, 'big'))
+        f.seek(SPATIAL_HEADER_SIZE + total * (len(new_points[0]) * cord_size + SEGMENT_NO_SIZE))
+        f.write(_pack_points(new_points, new_segments, cord_size))
+        f.truncate()
+
+    cached = SPATIAL_INDEX_CACHE.pop(path, None)
+    if cached is None or cached[0] != stamp:
+        cached = None
+    return cached, total, tree_count
+
+def _store_updated(path, points, segments, tree_count, tail_count, live_count, cord_size=STANDART_CORD_SIZE):
+    """Кэширует обновленный индекс; при слишком длинном хвосте файла дерево перестраивается"""
+    if tail_count > max(tree_count // 4, SPATIAL_REBUILD_MIN):
+        _write_tree(path, points, segments, cord_size)
+    else:
+        SPATIAL_INDEX_CACHE[path] = (_file_stamp(path), points, segments, tree_count, live_count)
+
+def add_points(table_name, entries, cord_size=STANDART_CORD_SIZE):
+    """Дописывает в индекс новые точки [(координаты, номер файла)]; выключенный индекс не ведется"""
+    path = get_spatial_index_path(table_name)
+    if not entries or not os.path.exists(path):
+        return
+
+    new_points = [tuple(cords) for cords, _ in entries]
+    new_segments = [segment for _, segment in entries]
+    cached, total, tree_count = _append_points(path, new_points, new_segments, cord_size)
+    if cached is None:
+        return
+
+    # Новые точки дописываются в хвост загруженных списков на месте: номера уже найденных запросами
+    # точек не меняются, а дерево перестраивается, только когда хвост станет слишком длинным
+    points, segments = cached[1], cached[2]
+    points.extend(new_points)
+    segments.extend(new_segments)
+    _store_updated(path, points, segments, tree_count, total + len(entries) - tree_count,
+                   cached[4] + len(entries), cord_size)
+
+def remove_points(table_name, cords_list, cord_size=STANDART_CORD_SIZE):
+    """Дописывает в индекс удаление точек [координаты]; выключенный индекс не ведется"""
+    path = get_spatial_index_path(table_name)
+    if not cords_list or not os.path.exists(path):
+        return
+
+    removed = [tuple(cords) for cords in cords_list]
+    cached, total, tree_count = _append_points(path, removed, [DELETED_FLAG] * len(removed), cord_size)
+    if cached is None:
+        return
+
+    # Удаленные точки помечаются на месте, номера остальных точек не меняются
+    points, segments = cached[1], cached[2]
+    live_count = cached[4]
+    for point in removed:
+        if _remove_point(points, segments, tree_count, point):
+            live_count -= 1
+    _store_updated(path, points, segments, tree_count, total + len(removed) - tree_count, live_count, cord_size)
+
+def query_box(points, tree_count, lower, upper, segments=None):
+    """Возвращает номера точек внутри прямоугольника [lower, upper]; точки с номером файла None пропускаются"""
+    if not points:
+        return []
+
+    dims = len(points[0])
+    bounds = list(zip(lower, upper))
+    result = []
+
+    stack = [(0, tree_count, 0)]
+    while stack:
+        lo, hi, depth = stack.pop()
+        if lo >= hi:
+            continue
+        mid = (lo + hi) // 2
+        point = points[mid]
+        if (all(low <= cord <= high for cord, (low, high) in zip(point, bounds)) and
+                (segments is None or segments[mid] is not None)):
+            result.append(mid)
+
+        # Поддерево обходится, только если прямоугольник заходит на его сторону от медианы
+        axis = depth % dims
+        if lower[axis] <= point[axis]:
+            stack.append((lo, mid, depth + 1))
+        if point[axis] <= upper[axis]:
+            stack.append((mid + 1, hi, depth + 1))
+
+    # Хвост точек, добавленных после построения дерева
+    for i in range(tree_count, len(points)):
+        if (all(low <= cord <= high for cord, (low, high) in zip(points[i], bounds)) and
+                (segments is None or segments[i] is not None)):
+            result.append(i)
+    return result
+
+def query_nearest(points, tree_count, target, count=1, segments=None):
+    """Возвращает [(квадрат расстояния, номер точки)] count ближайших к target точек по возрастанию расстояния;
+    точки с номером файла None пропускаются"""
+    if not points or count <= 0:
+        return []
+
+    dims = len(points[0])
+    target = tuple(target)
+    best = []  # Куча (-квадрат расстояния, -номер точки): на вершине самая дальняя из найденных
+
+    def consider(i):
+        if segments is not None and segments[i] is None:
+            return
+        dist = sum((a - b) * (a - b) for a, b in zip(points[i], target))
+        if len(best) < count:
+            heapq.heappush(best, (-dist, -i))
+        elif (-dist, -i) > best[0]:
+            heapq.heapreplace(best, (-dist, -i))
+
+    def visit(lo, hi, depth):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        consider(mid)
+
+        axis = depth % dims
+        diff = target[axis] - points[mid][axis]
+        near, far = ((lo, mid), (mid + 1, hi)) if diff <= 0 else ((mid + 1, hi), (lo, mid))
+        visit(near[0], near[1], depth + 1)
+        # Дальнее поддерево может содержать точку ближе, только если до плоскости разбиения ближе худшей из найденных
+        if len(best) < count or diff * diff <= -best[0][0]:
+            visit(far[0], far[1], depth + 1)
+
+    visit(0, tree_count, 0)
+    for i in range(tree_count, len(points)):
+        consider(i)
+
+    return sorted((-dist, -i) for dist, i in best)
@@ -0,0 +1,61 @@
+import sys
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_marlib():
+    """Импортирует marlib из установленного пакета или из этого репозитория"""
+    try:
+        import marlib
+        return marlib
+    except ImportError:
+        pass
+
+    spec = importlib.util.spec_from_file_location('marlib', ROOT / '__init__.py',
+                                                  submodule_search_locations=[str(ROOT)])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules['marlib'] = package
+    spec.loader.exec_module(package)
+    return package
+
+
+load_marlib()
+
+from marlib import database, file_operations, index, free_space, bloom_filter  # noqa: E402
+from marlib import sorted_index, spatial_index, inverted_index  # noqa: E402
+
+
+def clear_caches():
+    """Сбрасывает кэши модулей: пути в них относительные и совпадают у разных тестов"""
+    for wal in list(database.WAL_LOGS.values()):
+        wal.close()
+    database.WAL_LOGS.clear()
+    database.CATALOG_CACHE.clear()
+    database.LIVE_COUNT_CACHE.clear()
+    file_operations.reset_process_state()
+    index.INDEX_CACHE.clear()
+    free_space.FREE_SPACE_CACHE.clear()
+    bloom_filter.BLOOM_CACHE.clear()
+    sorted_index.SORTED_INDEX_CACHE.clear()
+    spatial_index.SPATIAL_INDEX_CACHE.clear()
+    inverted_index.INVERTED_INDEX_CACHE.clear()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Рабочий каталог теста: база, cases/ и config/ создаются в нем"""
+    monkeypatch.chdir(tmp_path)
+    clear_caches()
+    yield tmp_path
+    clear_caches()
+
+
+@pytest.fixture
+def db(workdir):
+    """Пустая база данных test.marm"""
+    database.create_database('test.marm')
+    return 'test.marm'
@@ -0,0 +1,52 @@
+import json
+import sys
+
+from marlib import bulk_load, database
+
+
+def write_csv(path, rows):
+    path.write_text('x,y,name,score\n' + ''.join(f'{x},{y},p{x}_{y},{x * 0.5}\n' for x, y in rows))
+    return str(path)
+
+
+def test_estimate_rows(workdir):
+    small = write_csv(workdir / 'small.csv', [(i, -i) for i in range(10)])
+    assert bulk_load.estimate_rows(small) == 10
+    (workdir / 'rows.jsonl').write_text('{"x": 1}\n{"x": 2}')
+    assert bulk_load.estimate_rows(str(workdir / 'rows.jsonl')) == 2
+
+    # Для большого файла количество строк оценивается по началу
+    big = write_csv(workdir / 'big.csv', [(i, i) for i in range(1000, 6000)])
+    assert abs(bulk_load.estimate_rows(big, sample_size=4096) - 5000) < 5000 * 0.05
+    assert bulk_load.presize_segments(5000) == 5500
+    assert bulk_load.presize_segments(1) == bulk_load.CASES_IN_FILE
+
+
+def test_bulk_load_csv_into_a_presized_table(db, workdir):
+    rows = [(x, y) for x in range(30) for y in range(-5, 5)]
+    path = write_csv(workdir / 'points.csv', rows)
+    reports = []
+    stats = bulk_load.bulk_load(db, 'points', path, ['x', 'y'], batch_size=64,
+                                report=reports.append, report_interval=0)
+    assert stats['rows'] == stats['estimated_rows'] == 300
+    assert stats['segments'] == 1 and len(reports) == 5
+
+    records = database.select_from_table(db, 'points')
+    assert [record.cords for record in records] == [list(row) for row in rows]
+    assert records[7].data == {'name': 'p0_2', 'score': '0.0'}
+    # Индексы построены по итогам загрузки
+    assert [record[0] for record in database.select_range(db, 'points', [3, 0], [3, 2])] == \
+        [[3, 0], [3, 1], [3, 2]]
+    assert database.find_in_table(db, 'points', [29, 4])[3]['name'] == 'p29_4'
+
+
+def test_bulk_load_cli(workdir, monkeypatch, capsys):
+    with open(workdir / 'rows.jsonl', 'w') as f:
+        for i in range(12):
+            f.write(json.dumps({'id': i, 'value': i * 1.5, 'skip': 'x'}) + '\n')
+    monkeypatch.setattr(sys, 'argv', ['bulk_load', 'cli.marm', 'rows', 'rows.jsonl',
+                                      '--cords', 'id', '--values', 'value', '--batch-size', '5'])
+    bulk_load.main()
+    assert capsys.readouterr().out.startswith('Loaded 12 rows into 1 segments')
+    assert [(record.cords, record.data) for record in database.select_from_table('cli.marm', 'rows')] == \
+        [([i], i * 1.5) for i in range(12)]
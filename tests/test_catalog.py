@@ -0,0 +1,16 @@
+from marlib import database
+
+
+def test_get_tables_returns_a_copy_of_the_catalog(db):
+    database.create_table(db, 't', ['x', 'y'])
+    tables = database.get_tables(db)
+    table_id, info = next(iter(tables.items()))
+    info['name'] = 'other'
+    info['columns'][0] = 'z'
+    del tables[table_id]
+
+    assert database.get_tables(db)[table_id]['name'] == 't'
+    assert database.get_tables(db)[table_id]['columns'] == {0: 'x', 1: 'y'}
+    assert list(database.get_table_files(db, 't')) == [table_id]
+    database.insert_into_table(db, 't', [1, 2], 'data')
+    assert database.find_in_table(db, 't', [1, 2])[3] == 'data'
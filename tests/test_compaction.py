@@ -0,0 +1,134 @@
+import os
+
+from marlib import database, file_operations, free_space
+from marlib.compaction import BackgroundCompactor
+from conftest import clear_caches
+
+
+def fragmented_table(db, count=60, size=500):
+    database.create_table(db, 'c', ['a', 'b'], cases_in_file=100)
+    live = {}
+    for i in range(count):
+        database.insert_into_table(db, 'c', [i, 0], f'{i:04}' * (size // 4))
+        live[(i, 0)] = f'{i:04}' * (size // 4)
+    for i in range(0, count, 2):
+        database.delete_from_table(db, 'c', [i, 0])
+        del live[(i, 0)]
+    return database.get_table_files(db, 'c')[1][0], live
+
+
+def assert_table(db, live):
+    records = database.select_from_table(db, 'c')
+    assert sorted((tuple(r[0]), r[3]) for r in records) == sorted(live.items())
+    for cords, data in live.items():
+        assert database.find_in_table(db, 'c', list(cords))[3] == data
+
+
+def test_compaction_in_chunks_with_writes_between_chunks(db):
+    segment, live = fragmented_table(db)
+    compaction = file_operations.SegmentCompaction(segment)
+    assert compaction.step(1500) is None
+    assert compaction.step(1500) is None
+
+    # Обновление на месте, перенос выросшей записи, удаление, вставки в старый и новый слоты
+    database.insert_into_table(db, 'c', [1, 0], 'short')
+    database.insert_into_table(db, 'c', [3, 0], 'x' * 2000)
+    database.insert_into_table(db, 'c', [59, 0], 'tail')
+    database.delete_from_table(db, 'c', [5, 0])
+    database.insert_into_table(db, 'c', [100, 0], 'reused slot')
+    live.update({(1, 0): 'short', (3, 0): 'x' * 2000, (59, 0): 'tail', (100, 0): 'reused slot'})
+    del live[(5, 0)]
+    database.insert_many(db, 'c', [([200 + i, 0], f'new {i}') for i in range(40)])
+    live.update({(200 + i, 0): f'new {i}' for i in range(40)})
+
+    stats = None
+    while stats is None:
+        assert not compaction.done
+        stats = compaction.step(1500)
+    assert compaction.done and stats['steps'] > 3
+    assert not os.path.exists(compaction.temp_path)
+    # Мертвыми остаются только прежние места записей, измененных после копирования
+    fragmentation = file_operations.get_fragmentation(segment)
+    assert 0 < fragmentation['dead_bytes'] <= 3 * 500
+    assert_table(db, live)
+
+    clear_caches()
+    assert file_operations.defragment_file(segment)['bytes_reclaimed'] == fragmentation['dead_bytes']
+    assert_table(db, live)
+
+
+def test_compaction_is_aborted_by_a_new_pass(db):
+    segment, live = fragmented_table(db)
+    first = file_operations.SegmentCompaction(segment)
+    first.step(1000)
+    stats = file_operations.defragment_file(segment)
+    assert stats['bytes_reclaimed'] > 0
+    assert first.done and first.step(1000) is None
+    assert_table(db, live)
+
+
+def test_background_compactor_works_in_bounded_chunks(db):
+    _, live = fragmented_table(db)
+    compactor = BackgroundCompactor(db, threshold=0.1, time_slice=0, chunk_size=1000)
+    steps = 0
+    while compactor.step():
+        steps += 1
+        assert steps < 100
+    assert steps > 5
+    assert compactor.stats['files_compacted'] == 1
+    assert compactor.stats['bytes_reclaimed'] > 0
+    assert_table(db, live)
+    assert not compactor.get_candidates()
+
+
+def test_background_defragmentation_reports_completion(db):
+    from marlib.mardb import MARDB
+    from marlib.mardb_server import MARDatabaseServer
+    _, live = fragmented_table(db)
+    client = MARDB()
+    assert client.get_compaction_status(db) == {'running': False, 'stats': None}
+    compactor = client.defragment_database(db, background=True)
+    compactor.thread.join(10)
+    status = client.get_compaction_status(db)
+    assert not status['running'] and status['stats']['bytes_reclaimed'] > 0
+    assert_table(db, live)
+
+    server = MARDatabaseServer(console_log=False, sync_interval=3600)
+    database.delete_from_table(db, 'c', [1, 0])
+    response = server.process_request({'command': 'defragment_database', 'args': {'db_name': db, 'background': True}})
+    assert response['status'] == 'success'
+    server.compactors[db].thread.join(10)
+    status = server.process_request({'command': 'get_compaction_status', 'args': {'db_name': db}})['data']
+    assert not status['running'] and status['stats']['files_compacted'] == 1
+
+
+def test_defragmentation_packs_live_records_in_slot_order(db):
+    segment, live = fragmented_table(db)
+    database.delete_from_table(db, 'c', [59, 0])
+    del live[(59, 0)]
+    # Перенесенная при обновлении запись оставляет дыру в середине области данных
+    database.insert_into_table(db, 'c', [1, 0], 'grown' * 300)
+    live[(1, 0)] = 'grown' * 300
+    path = os.path.join(file_operations.CASES_DIR, segment)
+    old_size = os.path.getsize(path)
+
+    stats = file_operations.defragment_file(segment)
+    assert stats['steps'] == 1 and stats['cases'] == len(live)
+    assert stats['old_size'] == old_size and stats['new_size'] == os.path.getsize(path)
+    assert stats['bytes_reclaimed'] == old_size - stats['new_size'] > 0
+
+    # Данные идут подряд сразу за блоком метаданных в порядке слотов; слоты удаленных записей
+    # в середине сохраняются, а в конце отбрасываются вместе со счетчиком
+    layout = file_operations.get_segment_layout(segment)
+    cases, _ = file_operations.get_cases_info(segment, with_deleted=True)
+    assert len(cases) == 58 and file_operations.get_table_info(segment)[2] == 58
+    position = layout.header_size + layout.max_cases * layout.slot_size
+    for case in cases:
+        assert case['slot'] == case['cords'][0]
+        if case['length']:
+            assert case['position'] == position
+            position += case['length']
+    assert position == stats['new_size']
+    assert file_operations.get_fragmentation(segment)['dead_bytes'] == 0
+    assert free_space.load_free_space(segment).free_bytes() == 0
+    assert_table(db, live)
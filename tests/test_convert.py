@@ -0,0 +1,41 @@
+from marlib import database, file_operations
+from conftest import clear_caches
+
+
+def test_convert_v1_database_to_v2(workdir):
+    db = 'old.marm'
+    database.create_database(db, version=1)
+    database.create_table(db, 'a', ['x', 'y'], cases_in_file=8)
+    database.create_table(db, 'b', ['name'], cases_in_file=100)
+    records = {(i, -i): {'i': i, 'text': 'x' * i} for i in range(30)}
+    database.insert_many(db, 'a', [(list(cords), data) for cords, data in records.items()])
+    database.delete_from_table(db, 'a', [7, -7])
+    del records[(7, -7)]
+    database.insert_into_table(db, 'b', [1], 'single')
+    tables = database.get_tables(db)
+    files = database.get_table_files(db)
+    assert database.parse_database(db)['version'] == 1
+
+    stats = database.convert_database(db)
+    assert stats['converted'] and len(stats['files']) == sum(len(names) for names in files.values())
+    clear_caches()
+
+    assert database.parse_database(db)['version'] == 2
+    assert {table_id: (info['name'], info['columns']) for table_id, info in database.get_tables(db).items()} == \
+        {table_id: (info['name'], info['columns']) for table_id, info in tables.items()}
+    assert database.get_table_files(db) == files
+    for names in files.values():
+        for name in names:
+            assert file_operations.get_segment_layout(name).version == 2
+
+    assert sorted((tuple(record[0]), record[3]['i']) for record in database.select_from_table(db, 'a')) == \
+        sorted((cords, data['i']) for cords, data in records.items())
+    for cords, data in records.items():
+        assert database.find_in_table(db, 'a', list(cords))[3] == data
+    assert database.find_in_table(db, 'a', [7, -7]) is None
+    assert database.find_in_table(db, 'b', [1])[3] == 'single'
+
+    # Сконвертированная база принимает записи и повторный перевод ничего не меняет
+    database.insert_into_table(db, 'a', [100, 100], 'new')
+    assert database.find_in_table(db, 'a', [100, 100])[3] == 'new'
+    assert database.convert_database(db)['files'] == [] and not database.convert_database(db)['converted']
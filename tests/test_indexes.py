@@ -0,0 +1,173 @@
+import random
+
+import pytest
+
+from marlib import database, sorted_index, spatial_index, inverted_index
+from conftest import clear_caches
+
+
+@pytest.fixture
+def table(db):
+    database.create_table(db, 'p', ['x', 'y'], cases_in_file=16)
+    database.insert_many(db, 'p', (([x, y], f'{x},{y}') for x in range(10) for y in range(10)))
+    database.create_spatial_index(db, 'p')
+    database.create_inverted_index(db, 'p', 'x')
+    database.create_inverted_index(db, 'p', 'y')
+    return db, 'p'
+
+
+def no_rebuilds(monkeypatch):
+    """Запрещает полную перестройку индексов: они должны правиться при вставке и удалении"""
+    def fail(*args, **kwargs):
+        raise AssertionError("index was rebuilt")
+    monkeypatch.setattr(sorted_index, 'rebuild_sorted_index', fail)
+    monkeypatch.setattr(spatial_index, 'rebuild_spatial_index', fail)
+    monkeypatch.setattr(inverted_index, 'rebuild_inverted_index', fail)
+
+
+def assert_consistent(db, table, live):
+    """Сравнивает ответы всех индексов с перебором живых записей"""
+    cords = sorted(live)
+    assert sorted(record[0] for record in database.select_from_table(db, table)) == [list(c) for c in cords]
+    assert [record[0] for record in database.select_range(db, table, [2, None], [7, 4])] == \
+        [list(c) for c in cords if 2 <= c[0] <= 7 and c[1] <= 4]
+    assert sorted(record[0] for record in database.select_box(db, table, [3, 3], [6, 8])) == \
+        [list(c) for c in cords if 3 <= c[0] <= 6 and 3 <= c[1] <= 8]
+    for x in (0, 4, 9):
+        assert [record[0] for record in database.find_where(db, table, {'x': x})] == \
+            [list(c) for c in cords if c[0] == x]
+    assert [record[0] for record in database.find_where(db, table, {'x': 5, 'y': 5})] == \
+        ([[5, 5]] if (5, 5) in live else [])
+    nearest = database.find_nearest(db, table, [5, 5], count=3)
+    distances = sorted((c[0] - 5) ** 2 + (c[1] - 5) ** 2 for c in cords)[:3]
+    assert [(r[0][0] - 5) ** 2 + (r[0][1] - 5) ** 2 for r in nearest] == distances
+    for record in database.select_range(db, table, None, None):
+        assert record[3] == live[tuple(record[0])]
+
+
+def test_indexes_follow_deletes_and_updates(table, monkeypatch):
+    db, name = table
+    live = {(x, y): f'{x},{y}' for x in range(10) for y in range(10)}
+    assert_consistent(db, name, live)
+    no_rebuilds(monkeypatch)
+
+    rng = random.Random(7)
+    for cords in rng.sample(sorted(live), 40):
+        assert database.delete_from_table(db, name, list(cords))
+        del live[cords]
+    assert not database.delete_from_table(db, name, [100, 100])
+    assert_consistent(db, name, live)
+
+    # Обновления на месте и вставки в освобожденные слоты
+    for cords in rng.sample(sorted(live), 10):
+        database.insert_into_table(db, name, list(cords), 'updated')
+        live[cords] = 'updated'
+    for cords in [(5, 5), (0, 0), (9, 9), (11, 11)]:
+        database.insert_into_table(db, name, list(cords), 'again')
+        live[cords] = 'again'
+    assert_consistent(db, name, live)
+
+    # Удаление и повторная вставка одних и тех же координат
+    for _ in range(3):
+        assert database.delete_from_table(db, name, [5, 5])
+        del live[(5, 5)]
+        assert_consistent(db, name, live)
+        database.insert_into_table(db, name, [5, 5], 'back')
+        live[(5, 5)] = 'back'
+        assert_consistent(db, name, live)
+
+    # Индексы на диске с отметками удалений читаются без перестройки
+    clear_caches()
+    assert_consistent(db, name, live)
+
+
+def test_index_compaction_after_many_deletes(table, monkeypatch):
+    db, name = table
+    monkeypatch.setattr(sorted_index, 'SORTED_MERGE_MIN', 8)
+    monkeypatch.setattr(spatial_index, 'SPATIAL_REBUILD_MIN', 8)
+    monkeypatch.setattr(inverted_index, 'INVERTED_COMPACT_MIN', 8)
+    live = {(x, y): f'{x},{y}' for x in range(10) for y in range(10)}
+    for x in range(8):
+        for y in range(10):
+            database.delete_from_table(db, name, [x, y])
+            del live[(x, y)]
+    assert_consistent(db, name, live)
+    clear_caches()
+    assert_consistent(db, name, live)
+
+
+def test_unindexed_insert_after_delete_triggers_rebuild(table):
+    db, name = table
+    database.delete_from_table(db, name, [3, 3])
+    # Количество записей совпадает с прежним, но индексы не знают о новой записи
+    database.insert_many(db, name, [([20, 20], 'new')], update_indexes=False)
+    assert [record[0] for record in database.select_range(db, name, [3, 3], [20, 20])
+            if record[0] in ([3, 3], [20, 20])] == [[20, 20]]
+    assert [record[0] for record in database.find_where(db, name, {'x': 20})] == [[20, 20]]
+    assert database.select_box(db, name, [3, 3], [3, 3]) == []
+
+
+def test_spatial_inserts_extend_the_loaded_index_in_place(db, monkeypatch):
+    database.create_table(db, 's', ['x', 'y'], cases_in_file=64)
+    database.create_spatial_index(db, 's')
+    monkeypatch.setattr(spatial_index, 'SPATIAL_REBUILD_MIN', 1000)
+    points, segments, tree_count = database.get_spatial_index(db, 's')
+    for i in range(200):
+        database.insert_into_table(db, 's', [i, -i], f'{i}')
+        # Вставка дописывает точку в те же списки, а не копирует индекс
+        loaded = database.get_spatial_index(db, 's')
+        assert loaded[0] is points and loaded[1] is segments and loaded[2] == tree_count
+    assert len(points) == 200
+    assert sorted(record[0][0] for record in database.select_box(db, 's', [50, -150], [150, -50])) == \
+        list(range(50, 151))
+
+
+def test_spatial_deletes_mark_points_in_place(db, monkeypatch):
+    database.create_table(db, 's', ['x', 'y'], cases_in_file=64)
+    database.insert_many(db, 's', [([i, -i], f'{i}') for i in range(100)])
+    database.create_spatial_index(db, 's')
+    database.insert_many(db, 's', [([i, -i], f'{i}') for i in range(100, 120)])
+    monkeypatch.setattr(spatial_index, 'SPATIAL_REBUILD_MIN', 1000)
+    points, segments, tree_count = database.get_spatial_index(db, 's')
+    assert (tree_count, len(points)) == (100, 120)
+
+    # Удаляются точки и дерева, и хвоста; списки не копируются и не сдвигаются
+    for i in range(0, 120, 3):
+        database.delete_from_table(db, 's', [i, -i])
+        loaded = database.get_spatial_index(db, 's')
+        assert loaded[0] is points and loaded[1] is segments and len(points) == 120
+    assert segments.count(None) == 40
+    expected = [i for i in range(40, 111) if i % 3]
+    assert sorted(record[0][0] for record in database.select_box(db, 's', [40, -110], [110, -40])) == expected
+    assert [record[0][0] for record in database.find_nearest(db, 's', [111, -111], 2)] == [110, 112]
+
+    # Перестройка дерева отбрасывает удаленные точки
+    clear_caches()
+    points, segments, tree_count = database.get_spatial_index(db, 's')
+    assert segments.count(None) == 40
+    spatial_index._write_tree(spatial_index.get_spatial_index_path('s'), points, segments)
+    points, segments, tree_count = database.get_spatial_index(db, 's')
+    assert tree_count == len(points) == 80 and None not in segments
+    assert sorted(record[0][0] for record in database.select_box(db, 's', [40, -110], [110, -40])) == expected
+
+
+def test_queries_without_writes_do_not_recount_segments(table, monkeypatch):
+    db, name = table
+    calls = []
+    get_live_count = database.get_live_count
+    monkeypatch.setattr(database, 'get_live_count', lambda file: calls.append(file) or get_live_count(file))
+
+    database.select_range(db, name, [2, 2], [4, 4])
+    assert len(calls) == len(next(iter(database.get_table_files(db, name).values())))
+    # Пока индексы файлов не менялись, запросы берут количество записей из кэша
+    calls.clear()
+    for _ in range(3):
+        database.select_range(db, name, [2, 2], [4, 4])
+        database.select_box(db, name, [2, 2], [4, 4])
+        database.find_where(db, name, {'x': 2})
+    assert calls == []
+
+    # Вставка меняет поколение индексов, и следующий запрос пересчитывает записи
+    database.insert_into_table(db, name, [20, 20], 'new')
+    assert len(database.find_where(db, name, {'x': 20})) == 1
+    assert calls
@@ -0,0 +1,17 @@
+from marlib import database
+from marlib.mardb import MARDB
+
+
+def test_local_insert_many_uses_batch_size(db, monkeypatch):
+    database.create_table(db, 't', ['x'])
+    batches = []
+    insert_batch = database._insert_batch
+
+    def spy(db_name, table_name, files, batch, *args):
+        batches.append(len(batch))
+        return insert_batch(db_name, table_name, files, batch, *args)
+
+    monkeypatch.setattr(database, '_insert_batch', spy)
+    assert MARDB().insert_many(db, 't', (([i], i) for i in range(25)), batch_size=10) == 25
+    assert batches == [10, 10, 5]
+    assert sorted(record[3] for record in database.select_from_table(db, 't')) == list(range(25))
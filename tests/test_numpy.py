@@ -0,0 +1,66 @@
+import pytest
+
+from marlib import database, file_operations
+
+np = pytest.importorskip('numpy')
+
+
+@pytest.mark.parametrize('cord_size', [1, 2, 3, 8])
+def test_slot_arrays_match_between_numpy_and_struct(db, cord_size):
+    limit = 1 << (cord_size * 8 - 1)
+    values = [-limit, -1, 0, 1, limit - 1]
+    database.create_table(db, 'n', ['a', 'b'], cases_in_file=40, cord_size=cord_size, len_size=2)
+    database.insert_many(db, 'n', [([x, y], f'{x},{y}') for x in values for y in values[:3]])
+    database.delete_from_table(db, 'n', [0, -1])
+    segment = database.get_table_files(db, 'n')[1][0]
+
+    arrays = file_operations.read_slot_arrays(segment, use_numpy=True)
+    plain = file_operations.read_slot_arrays(segment, use_numpy=False)
+    cases, _ = file_operations.get_cases_info(segment, with_deleted=True)
+    assert arrays.cords.dtype == np.int64 and arrays.cords.shape == (15, 2)
+    assert [tuple(row) for row in arrays.cords.tolist()] == plain.cords == [tuple(case['cords']) for case in cases]
+    assert arrays.positions.tolist() == plain.positions == [case['position'] for case in cases]
+    assert arrays.lengths.tolist() == plain.lengths == [case['length'] for case in cases]
+
+    # Отбор по столбцам пропускает удаленную запись
+    for use_numpy in (True, False):
+        assert file_operations.match_slots(segment, {0: 0}, use_numpy=use_numpy) == [6, 8]
+        assert file_operations.match_slots(segment, {0: -limit, 1: limit - 1}, use_numpy=use_numpy) == []
+
+
+def test_slot_arrays_of_an_empty_segment(db):
+    database.create_table(db, 'n', ['a'])
+    segment = database.get_table_files(db, 'n')[1][0]
+    assert file_operations.read_slot_arrays(segment, use_numpy=True).cords.shape == (0, 1)
+    assert file_operations.read_slot_arrays(segment, use_numpy=False) == ([], [], [])
+
+
+def test_select_to_numpy_skips_deleted_records(db):
+    database.create_table(db, 'e', ['x', 'y', 'z'], cases_in_file=8)
+    database.insert_many(db, 'e', [([i, -i, i % 3], i) for i in range(20)])
+    for i in (0, 9, 19):
+        database.delete_from_table(db, 'e', [i, -i, i % 3])
+    live = [i for i in range(20) if i not in (0, 9, 19)]
+
+    cords, values = database.select_to_numpy(db, 'e')
+    assert cords.dtype == np.int64 and cords.shape == (17, 3)
+    assert cords.tolist() == [[i, -i, i % 3] for i in live]
+    assert values.dtype == np.int64 and values.tolist() == live
+    # Без NumPy те же столбцы возвращаются списками
+    assert database.select_columns(db, 'e') == ([(i, -i, i % 3) for i in live], live)
+
+    cords, values = database.select_to_numpy(db, 'e', with_values=False)
+    assert values is None and cords.shape == (17, 3)
+
+
+def test_select_to_numpy_value_types(db):
+    database.create_table(db, 'e', ['x'])
+    assert database.select_to_numpy(db, 'e')[1].shape == (0,)
+    database.insert_many(db, 'e', [([0], 1), ([1], 2.5)])
+    assert database.select_to_numpy(db, 'e')[1].dtype == np.float64
+
+    # Разнородные значения и списки остаются объектами, а не лишними осями массива
+    database.insert_many(db, 'e', [([2], [1, 2]), ([3], 'text')])
+    values = database.select_to_numpy(db, 'e')[1]
+    assert values.dtype == object and values.shape == (4,)
+    assert values.tolist() == [1, 2.5, [1, 2], 'text']
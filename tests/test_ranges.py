@@ -0,0 +1,45 @@
+import pytest
+
+from marlib import database
+
+LIMIT = 1 << 15
+POINTS = [[-LIMIT, -LIMIT], [-5, 3], [0, 0], [5, LIMIT - 1], [LIMIT - 1, 7], [LIMIT - 1, LIMIT - 1]]
+
+
+@pytest.fixture
+def table(db):
+    database.create_table(db, 'p', ['x', 'y'], cases_in_file=4)
+    for point in POINTS:
+        database.insert_into_table(db, 'p', point, f'{point}')
+    return db, 'p'
+
+
+def selected(records):
+    return [record[0] for record in records]
+
+
+@pytest.mark.parametrize('lower, upper, expected', [
+    ([-100000, None], [5, None], [[-LIMIT, -LIMIT], [-5, 3], [0, 0], [5, LIMIT - 1]]),
+    ([0, None], [10 ** 6, None], [[0, 0], [5, LIMIT - 1], [LIMIT - 1, 7], [LIMIT - 1, LIMIT - 1]]),
+    ([None, 10 ** 6], [None, None], []),
+    ([None, None], [-10 ** 6, None], []),
+    ([LIMIT - 1, None], [10 ** 6, 10 ** 6], [[LIMIT - 1, 7], [LIMIT - 1, LIMIT - 1]]),
+    ([-10 ** 9, -10 ** 9], [-LIMIT, -LIMIT], [[-LIMIT, -LIMIT]]),
+    ([5, None], [0, None], []),
+])
+def test_select_range_at_coordinate_limits(table, lower, upper, expected):
+    assert selected(database.select_range(*table, lower, upper)) == expected
+
+
+@pytest.mark.parametrize('spatial', [False, True])
+@pytest.mark.parametrize('lower, upper, expected', [
+    ([0, 0], [10 ** 6, 10 ** 6], [[0, 0], [5, LIMIT - 1], [LIMIT - 1, 7], [LIMIT - 1, LIMIT - 1]]),
+    ([-10 ** 6, -10 ** 6], [0, 10 ** 6], [[-LIMIT, -LIMIT], [-5, 3], [0, 0]]),
+    ([10 ** 6, None], [None, None], []),
+    ([None, None], [None, -10 ** 6], []),
+    ([-10 ** 12, -10 ** 12], [10 ** 12, 10 ** 12], POINTS),
+])
+def test_select_box_at_coordinate_limits(table, spatial, lower, upper, expected):
+    if spatial:
+        database.create_spatial_index(*table)
+    assert sorted(selected(database.select_box(*table, lower, upper))) == sorted(expected)
@@ -0,0 +1,77 @@
+import pickle
+
+import pytest
+
+from marlib import database
+from marlib.serialization import LazyCase
+
+
+def test_parallel_scan_returns_lazy_cases(db):
+    database.create_table(db, 't', ['x'], cases_in_file=8)
+    database.set_table_compression(db, 't', 'zlib', 16)
+    records = [([i], {'value': i, 'text': 'a' * (i * 10)}) for i in range(30)]
+    database.insert_many(db, 't', records)
+    try:
+        serial = database.select_from_table(db, 't', workers=0)
+        parallel = database.select_from_table(db, 't', workers=2)
+        lazy = list(database.iter_table(db, 't', workers=2))
+    finally:
+        database.shutdown_scan_pools()
+
+    assert all(type(record) is LazyCase for record in serial + parallel + lazy)
+    assert parallel == serial == lazy
+    assert [(record.cords, record.data) for record in parallel] == records
+
+
+def test_lazy_case_pickles_as_lazy_case(db):
+    database.create_table(db, 't', ['x'])
+    database.insert_into_table(db, 't', [1], 'data')
+    record = database.select_from_table(db, 't')[0]
+    copy = pickle.loads(pickle.dumps(record))
+    assert type(copy) is LazyCase and copy == record
+    record.data
+    copy = pickle.loads(pickle.dumps(record))
+    assert copy.data == 'data' and copy.reserved == record.reserved
+
+
+def test_lazy_cases_are_hashable(db):
+    database.create_table(db, 't', ['x', 'y'])
+    database.insert_many(db, 't', [([i, -i], f'row {i}') for i in range(5)])
+    database.insert_into_table(db, 't', [9, 9], ['mutable'])
+    *first, mutable = database.select_from_table(db, 't')
+    *second, _ = database.select_from_table(db, 't')
+
+    # Равные записи разных чтений дают один ключ множества и словаря
+    assert len(set(first + second)) == 5
+    names = {record: record.data for record in first}
+    assert [names[record] for record in second] == [f'row {i}' for i in range(5)]
+    assert pickle.loads(pickle.dumps(first[0])) in names
+    # Как и у кортежа, хеш записи со списком в данных не определен
+    with pytest.raises(TypeError):
+        hash(mutable)
+
+
+def test_parallel_scan_keeps_a_bounded_window_of_segments(db, monkeypatch):
+    database.create_table(db, 't', ['x'], cases_in_file=4)
+    database.insert_many(db, 't', [([i], i) for i in range(80)])
+    submitted = []
+    get_scan_pool = database.get_scan_pool
+
+    class CountingPool:
+        def __init__(self, pool):
+            self.pool = pool
+
+        def submit(self, *args):
+            submitted.append(args[1])
+            return self.pool.submit(*args)
+
+    monkeypatch.setattr(database, 'get_scan_pool', lambda workers: CountingPool(get_scan_pool(workers)))
+    try:
+        records = database.iter_table(db, 't', workers=2)
+        assert next(records)[3] == 0
+        # Из 20 файлов в работу отдано не больше окна и одного файла на место прочитанного
+        assert len(submitted) == 2 * database.SCAN_PREFETCH + 1
+        assert [record[3] for record in records] == list(range(1, 80))
+        assert len(submitted) == 20
+    finally:
+        database.shutdown_scan_pools()
@@ -0,0 +1,308 @@
+import os
+
+import pytest
+
+from marlib import database, file_operations, free_space, index, bloom_filter
+from conftest import clear_caches
+
+
+def first_segment(db, table):
+    return database.get_table_files(db, table)[1][0]
+
+
+def record_flag(segment, cords):
+    """Возвращает байт флага записи в файле"""
+    view = file_operations.get_segment_view(segment)
+    try:
+        return view[file_operations.find_case_info(segment, cords)['position']]
+    finally:
+        view.release()
+
+
+def test_iterating_while_deleting_trailing_records(db):
+    file_operations.configure_buffer_pool(0)
+    try:
+        database.create_table(db, 'u', ['a', 'b'], cases_in_file=100)
+        for i in range(50):
+            database.insert_into_table(db, 'u', [i, 0], 'x' * 5000)
+        segment = first_segment(db, 'u')
+        path = os.path.join(file_operations.CASES_DIR, segment)
+        size = os.path.getsize(path)
+
+        cases = file_operations.iter_cases(segment)
+        assert next(cases)[0] == [0, 0]
+        for i in range(49, 10, -1):
+            database.delete_from_table(db, 'u', [i, 0])
+
+        # Прежде удаление хвостовых записей усекало файл, и чтение из отображения падало с SIGBUS
+        assert sum(1 for _ in cases) == 49
+        assert os.path.getsize(path) == size
+        assert [case[0] for case in database.select_from_table(db, 'u')] == [[i, 0] for i in range(11)]
+    finally:
+        file_operations.configure_buffer_pool()
+
+
+def test_freed_tail_is_reused_and_reclaimed(db):
+    database.create_table(db, 'u', ['a', 'b'], cases_in_file=20)
+    for i in range(10):
+        database.insert_into_table(db, 'u', [i, 0], 'y' * 1000)
+    segment = first_segment(db, 'u')
+    database.delete_from_table(db, 'u', [9, 0])
+    assert free_space.load_free_space(segment).free_bytes() >= 1000
+
+    database.insert_into_table(db, 'u', [20, 0], 'z' * 1000)
+    assert database.find_in_table(db, 'u', [20, 0])[3] == 'z' * 1000
+
+    database.delete_from_table(db, 'u', [20, 0])
+    stats = file_operations.defragment_file(segment)
+    assert stats['bytes_reclaimed'] >= 1000
+    assert free_space.load_free_space(segment).free_bytes() == 0
+
+
+def test_hash_index_survives_restart_and_is_rebuilt_when_stale(db, monkeypatch):
+    database.create_table(db, 'h', ['a', 'b'], cases_in_file=50)
+    database.insert_many(db, 'h', (([i, -i], f'v{i}') for i in range(40)))
+    database.delete_from_table(db, 'h', [7, -7])
+    database.insert_into_table(db, 'h', [3, -3], 'updated')
+    segment = first_segment(db, 'h')
+    index_path = index.get_index_path(segment)
+    assert os.path.exists(index_path)
+
+    # После перезапуска индекс читается с диска, метаданные слотов не перебираются
+    clear_caches()
+    get_cases_info = file_operations.get_cases_info
+    monkeypatch.setattr(file_operations, 'get_cases_info', lambda *args, **kwargs: pytest.fail("slots scanned"))
+    assert database.find_in_table(db, 'h', [3, -3])[3] == 'updated'
+    assert database.find_in_table(db, 'h', [7, -7]) is None
+    assert database.find_in_table(db, 'h', [39, -39])[3] == 'v39'
+    assert file_operations.get_free_slots(segment) == {7}
+    monkeypatch.setattr(file_operations, 'get_cases_info', get_cases_info)
+
+    # Отсутствующий или отставший от файла индекс строится заново по метаданным
+    rebuilds = []
+    rebuild_index = index.rebuild_index
+    monkeypatch.setattr(index, 'rebuild_index', lambda *args, **kwargs: rebuilds.append(args[0]) or
+                        rebuild_index(*args, **kwargs))
+    for damage in (os.remove, lambda path: open(path, 'r+b').write((0).to_bytes(index.INDEX_COUNT_SIZE, 'big'))):
+        damage(index_path)
+        clear_caches()
+        assert database.find_in_table(db, 'h', [3, -3])[3] == 'updated'
+        assert database.find_in_table(db, 'h', [7, -7]) is None
+        assert file_operations.get_live_count(segment) == 39
+        assert file_operations.get_free_slots(segment) == {7}
+    assert rebuilds == [segment, segment]
+
+
+def test_free_space_map_best_fit_and_coalescing():
+    free_map = free_space.FreeSpaceMap([(100, 50), (300, 20), (500, 40)])
+    # Выбирается наименьший подходящий участок, остаток остается свободным
+    assert free_map.allocate(30) == 500
+    assert free_map.extents == {100: 50, 300: 20, 530: 10}
+    assert free_map.allocate(60) is None
+
+    # Освобожденный участок сливается с соседями с обеих сторон
+    assert free_map.release(150, 150) == (100, 220)
+    assert free_map.extents == {100: 220, 530: 10}
+    assert free_space.FreeSpaceMap.from_bytes(free_map.to_bytes()).extents == free_map.extents
+
+
+def test_free_space_survives_restart_and_is_reused(db):
+    database.create_table(db, 'f', ['a'], cases_in_file=20)
+    for i in range(6):
+        database.insert_into_table(db, 'f', [i], f'{i}' * 400)
+    segment = first_segment(db, 'f')
+    old = file_operations.find_case_info(segment, [2])
+    database.delete_from_table(db, 'f', [2])
+
+    # Карта хранится в .marf рядом с сегментом и читается после перезапуска
+    clear_caches()
+    assert free_space.load_free_space(segment).extents == {old['position']: old['length']}
+    size = os.path.getsize(os.path.join(file_operations.CASES_DIR, segment))
+
+    database.insert_into_table(db, 'f', [10], 'n' * 300)
+    assert file_operations.find_case_info(segment, [10])['position'] == old['position']
+    assert os.path.getsize(os.path.join(file_operations.CASES_DIR, segment)) == size
+    assert database.find_in_table(db, 'f', [10])[3] == 'n' * 300
+    assert [record[3] for record in database.select_from_table(db, 'f') if record[0] != [10]] == \
+        [f'{i}' * 400 for i in (0, 1, 3, 4, 5)]
+
+
+def test_buffer_pool_evicts_least_recently_used_pages():
+    pool = file_operations.BufferPool(capacity=3 * 16, page_size=16)
+    data = memoryview(bytes(range(256)))
+    assert pool.read('a', data, 0, 16) == data[0:16]
+    pool.read('a', data, 16, 16)
+    pool.read('a', data, 32, 16)
+    # Повторное чтение первой страницы делает ее недавно использованной
+    assert pool.read('a', data, 4, 8) == data[4:12]
+    # Чтение через границу страниц собирается из двух страниц; вытесняется страница 1, а не 0
+    assert pool.read('a', data, 60, 8) == data[60:68]
+    assert list(pool.pages) == [('a', 0), ('a', 3), ('a', 4)]
+    stats = pool.get_stats()
+    assert stats['used_bytes'] <= stats['capacity'] and stats['evictions'] == 2
+    assert (stats['hits'], stats['misses']) == (1, 5)
+
+
+def test_buffer_pool_invalidation_drops_written_pages():
+    pool = file_operations.BufferPool(capacity=1024, page_size=16)
+    data = bytearray(range(128))
+    for offset in range(0, 128, 16):
+        pool.read('a', memoryview(data), offset, 16)
+    pool.read('b', memoryview(data), 0, 16)
+
+    # Запись в участок файла снимает только затронутые страницы этого файла
+    pool.invalidate('a', 20, 20)
+    assert sorted(page_no for path, page_no in pool.pages if path == 'a') == [0, 3, 4, 5, 6, 7]
+    data[20:40] = b'\xff' * 20
+    assert pool.read('a', memoryview(data), 16, 32) == bytes(data[16:48])
+    pool.invalidate('a')
+    assert list(pool.pages) == [('b', 0)] and pool.used == 16
+
+
+def test_reads_through_the_pool_see_writes(db):
+    file_operations.configure_buffer_pool(64 * 1024, 256)
+    try:
+        database.create_table(db, 'p', ['a'], cases_in_file=10)
+        database.insert_many(db, 'p', [([i], f'old {i}') for i in range(5)])
+        assert [database.find_in_table(db, 'p', [i])[3] for i in range(5)] == [f'old {i}' for i in range(5)]
+        assert database.find_in_table(db, 'p', [2])[3] == 'old 2'
+        assert file_operations.get_buffer_pool_stats()['hits'] > 0
+
+        # Перезапись на месте и перенос выросшей записи снимают страницы из пула
+        database.insert_into_table(db, 'p', [2], 'new 2')
+        database.insert_into_table(db, 'p', [3], 'grown' * 100)
+        assert database.find_in_table(db, 'p', [2])[3] == 'new 2'
+        assert database.find_in_table(db, 'p', [3])[3] == 'grown' * 100
+    finally:
+        file_operations.configure_buffer_pool()
+
+
+@pytest.mark.parametrize('method', ['zlib', 'lzma'])
+def test_compression_flag_round_trip(db, method):
+    from marlib.serialization import CASE_FLAG, COMPRESSED_CASE_FLAG
+    database.create_table(db, 'z', ['a'], cases_in_file=10)
+    database.set_table_compression(db, 'z', method, 64)
+    assert database.get_table_compression(db, 'z') == {'compression': method, 'threshold': 64}
+    big = {'text': 'compressible ' * 100, 'values': [0.5] * 50}
+    database.insert_many(db, 'z', [([0], 'short'), ([1], big)])
+    database.insert_into_table(db, 'z', [2], 'x' * 1000)
+
+    # Флаг записи показывает, сжата ли она: записи короче порога хранятся как есть
+    segment = first_segment(db, 'z')
+    assert [record_flag(segment, [i]) for i in range(3)] == [CASE_FLAG, COMPRESSED_CASE_FLAG, COMPRESSED_CASE_FLAG]
+    assert file_operations.find_case_info(segment, [2])['length'] < 1000
+
+    # Старые сжатые записи читаются и после выключения сжатия
+    clear_caches()
+    database.set_table_compression(db, 'z', None)
+    database.insert_into_table(db, 'z', [3], 'y' * 1000)
+    assert record_flag(segment, [3]) == CASE_FLAG
+    records = database.select_from_table(db, 'z')
+    assert [(record.cords, record.data) for record in records] == \
+        [([0], 'short'), ([1], big), ([2], 'x' * 1000), ([3], 'y' * 1000)]
+    assert records[1].data_len > file_operations.find_case_info(segment, [1])['length']
+    assert database.find_in_table(db, 'z', [1])[3] == big
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = bloom_filter.BloomFilter.for_capacity(1000)
+    keys = [index.pack_cords([i, -i]) for i in range(1000)]
+    bloom.update(keys[:500])
+    for key in keys[500:]:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    # При заполненном фильтре ложных срабатываний около 1%
+    false_positives = sum(index.pack_cords([i, i]) in bloom for i in range(1, 5001))
+    assert false_positives < 5000 * 0.03
+    restored = bloom_filter.BloomFilter.from_bytes(bloom.to_bytes())
+    assert restored.key_count == 1000 and all(key in restored for key in keys)
+
+
+def test_absent_lookups_skip_segment_indexes(db, monkeypatch):
+    database.create_table(db, 'b', ['a'], cases_in_file=16)
+    database.insert_many(db, 'b', [([i * 2], f'{i}') for i in range(64)])
+    segments = database.get_table_files(db, 'b')[1]
+    lookups = []
+    find_case_in_file = database.find_case_in_file
+    monkeypatch.setattr(database, 'find_case_in_file', lambda file, cords: lookups.append(file) or
+                        find_case_in_file(file, cords))
+
+    # Нечетные координаты лежат в границах файлов, но фильтр отсекает почти все из них
+    assert all(database.find_in_table(db, 'b', [i * 2 + 1]) is None for i in range(64))
+    assert len(lookups) <= 3
+    lookups.clear()
+    assert database.find_in_table(db, 'b', [100])[3] == '50'
+    assert lookups == [segments[3]]
+
+    # Отсутствующий или оборванный фильтр строится заново по хеш-индексу
+    bloom_path = bloom_filter.get_bloom_path(segments[0])
+    for damage in (os.remove, lambda path: open(path, 'r+b').truncate(4)):
+        damage(bloom_path)
+        clear_caches()
+        assert database.find_in_table(db, 'b', [6])[3] == '3'
+        assert bloom_filter.load_bloom(segments[0]).key_count == 16
+
+    # Удаление не убирает ключ из фильтра, дефрагментация строит фильтр по живым записям
+    database.delete_from_table(db, 'b', [6])
+    assert bloom_filter.load_bloom(segments[0]).key_count == 16
+    file_operations.defragment_file(segments[0])
+    assert bloom_filter.load_bloom(segments[0]).key_count == 15
+    assert database.find_in_table(db, 'b', [6]) is None and database.find_in_table(db, 'b', [8])[3] == '4'
+
+
+def test_zone_maps_track_bounds_and_prune_segments(db, monkeypatch):
+    database.create_table(db, 'zm', ['t', 'v'], cases_in_file=10)
+    segments = database.get_table_files(db, 'zm')[1]
+    # Пустой файл не пересекается ни с одним запросом
+    assert not file_operations.segment_overlaps(segments[0], [0, 0], [0, 0])
+
+    # Каждый файл хранит свой отрезок времени t
+    database.insert_many(db, 'zm', [([t, (t * 7) % 11 - 5], f'{t}') for t in range(30)])
+    database.insert_into_table(db, 'zm', [-3, 40], 'late')
+    segments = database.get_table_files(db, 'zm')[1]
+    assert [file_operations.get_segment_bounds(file) for file in segments] == [
+        ([0, -5], [9, 5]), ([10, -5], [19, 5]), ([20, -5], [29, 5]), ([-3, 40], [-3, 40])]
+
+    scanned = []
+    match_slots = database.match_slots
+    monkeypatch.setattr(database, 'match_slots', lambda file, conditions: scanned.append(file) or
+                        match_slots(file, conditions))
+    assert [record[0] for record in database.find_where(db, 'zm', {'t': 12})] == [[12, 2]]
+    assert scanned == [segments[1]]
+    assert database.find_where(db, 'zm', {'t': 100}) == [] and scanned == [segments[1]]
+    assert [record[0] for record in database.select_range(db, 'zm', [-5, 30], [0, 50])] == [[-3, 40]]
+
+    # Удаление границы не сужает, дефрагментация сужает их до живых записей
+    for t in (0, 1, 9):
+        database.delete_from_table(db, 'zm', [t, (t * 7) % 11 - 5])
+    assert file_operations.get_segment_bounds(segments[0]) == ([0, -5], [9, 5])
+    file_operations.defragment_file(segments[0])
+    assert file_operations.get_segment_bounds(segments[0]) == ([2, -4], [8, 5])
+
+
+def test_segment_views_share_one_map_until_the_file_changes(db):
+    database.create_table(db, 'm', ['a'], cases_in_file=20)
+    database.insert_many(db, 'm', [([i], 'm' * 100) for i in range(10)])
+    segment = first_segment(db, 'm')
+    path = os.path.join(file_operations.CASES_DIR, segment)
+
+    view = file_operations.get_segment_view(segment)
+    assert view.readonly and bytes(view) == open(path, 'rb').read()
+    mapped = file_operations.SEGMENT_MAPS[path][1]
+    assert file_operations.get_segment_view(segment).obj is mapped
+
+    # Файл вырос - следующий читатель получает новое отображение, а начатое чтение продолжается
+    database.insert_into_table(db, 'm', [10], 'n' * 5000)
+    grown = file_operations.get_segment_view(segment)
+    assert grown.obj is not mapped and len(grown) == os.path.getsize(path) > len(view)
+    assert bytes(view[:64]) == bytes(grown[:64])
+
+    # Дефрагментация заменяет файл; старые view остаются читаемыми до освобождения
+    for i in range(5):
+        database.delete_from_table(db, 'm', [i])
+    file_operations.defragment_file(segment)
+    assert path not in file_operations.SEGMENT_MAPS
+    assert len(bytes(grown)) > os.path.getsize(path)
+    view.release()
+    grown.release()
+    assert [record[0] for record in database.select_from_table(db, 'm')] == [[i] for i in range(5, 11)]
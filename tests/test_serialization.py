@@ -0,0 +1,48 @@
+import collections
+import datetime
+import decimal
+import uuid
+
+import pytest
+
+from marlib.serialization import serialize_data, serialize_into, deserialize_data, BYTE_TO_PYTHON_TYPE
+
+# Байты прежнего рекурсивного сериализатора (benchmarks/serialization_bench.py): формат записи не меняется
+GOLDEN = [
+    ({'a': [1, 2.5, None, True], 'b': ('x', b'\x00')}, 2,
+     '05002c010001610600160200010103000840040000000000000d00000400010101000162070008010001780a000100'),
+    ([[], {}, -1], 4, '0600000010060000000005000000000200000001ff'),
+]
+
+
+def roundtrip(value, len_size=2):
+    encoded = serialize_data(value, len_size)
+    data_type = BYTE_TO_PYTHON_TYPE[encoded[:1]]
+    assert int.from_bytes(encoded[1:1 + len_size], 'big') == len(encoded) - 1 - len_size
+    return deserialize_data(encoded[1 + len_size:], data_type, len_size)
+
+
+@pytest.mark.parametrize('value, len_size, expected', GOLDEN)
+def test_serialize_data_matches_the_recursive_format(value, len_size, expected):
+    assert serialize_data(value, len_size).hex() == expected
+
+
+def test_serialize_into_appends_to_the_buffer():
+    buf = bytearray(b'head')
+    assert serialize_into(buf, {'k': [1, 2]}) is buf
+    assert bytes(buf) == b'head' + serialize_data({'k': [1, 2]})
+
+
+@pytest.mark.parametrize('value', [
+    'текст', 0, -1, 127, 2.5, True, None, b'\x00\xff', complex(1, -2),
+    [1, 'a', [2.5, None]], {'a': {'b': [True, False]}, 'c': ()},
+    collections.OrderedDict([('x', 1), ('y', 2)]),
+    datetime.datetime(2024, 5, 1, 12, 30), decimal.Decimal('1.25'), uuid.UUID(int=42),
+])
+def test_roundtrip(value):
+    assert roundtrip(value) == value
+
+
+def test_roundtrip_with_wide_length_field():
+    value = {'text': 'x' * 70000, 'items': [i * 7 for i in range(15)]}
+    assert roundtrip(value, 4) == value
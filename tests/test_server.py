@@ -0,0 +1,31 @@
+from marlib import database
+from marlib.mardb_server import MARDatabaseServer
+
+
+def request(server, command, **args):
+    response = server.process_request({'command': command, 'args': args})
+    assert response['status'] == 'success', response
+    return response['data']
+
+
+def test_iter_table_includes_unsynced_changes(db):
+    database.create_table(db, 't', ['x'], cases_in_file=4)
+    database.insert_many(db, 't', [([i], f'v{i}') for i in range(10)])
+    server = MARDatabaseServer(console_log=False, sync_interval=3600)
+    request(server, 'insert_into_table', db_name=db, table_name='t', cords=[3], data='updated')
+    request(server, 'insert_into_table', db_name=db, table_name='t', cords=[20], data='new')
+    request(server, 'insert_into_table', db_name=db, table_name='t', cords=[21], data='gone')
+    request(server, 'delete_from_table', db_name=db, table_name='t', cords=[21])
+    request(server, 'delete_from_table', db_name=db, table_name='t', cords=[5])
+
+    rows, cursor = {}, None
+    while True:
+        page = request(server, 'iter_table', db_name=db, table_name='t', cursor=cursor, batch_size=3)
+        rows.update((tuple(record['cords']), record['data']) for record in page['records'])
+        cursor = page['cursor']
+        if cursor is None:
+            break
+
+    expected = {(i,): f'v{i}' for i in range(10) if i != 5}
+    expected.update({(3,): 'updated', (20,): 'new'})
+    assert rows == expected
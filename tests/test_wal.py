@@ -0,0 +1,74 @@
+import os
+
+from marlib import database
+from marlib.wal import get_wal_path, OP_INSERT, OP_DELETE
+from conftest import clear_caches
+
+
+def crash():
+    """Имитирует падение процесса: журнал закрывается без контрольной точки, кэши теряются"""
+    clear_caches()
+
+
+def test_wal_replay_after_crash(db):
+    database.create_table(db, 't', ['x', 'y'], cases_in_file=8)
+    wal = database.open_database(db, 'op')
+    database.insert_many(db, 't', [([i, 0], f'v{i}') for i in range(20)])
+
+    # Операции попали в журнал, но не в файлы записей
+    wal.append_many([(OP_INSERT, 't', [100 + i, 1], {'i': i}) for i in range(15)] +
+                    [(OP_INSERT, 't', [3, 0], 'updated'), (OP_DELETE, 't', [5, 0], None)])
+    # Оборванная последняя запись журнала
+    with open(get_wal_path(db), 'ab') as f:
+        f.write(b'\x00\x00\x01\x00torn')
+    crash()
+
+    database.open_database(db)
+    assert os.path.getsize(get_wal_path(db)) == 0
+    expected = {(i, 0): f'v{i}' for i in range(20)}
+    expected.update({(100 + i, 1): {'i': i} for i in range(15)})
+    expected[(3, 0)] = 'updated'
+    del expected[(5, 0)]
+    for cords, data in expected.items():
+        assert database.find_in_table(db, 't', list(cords))[3] == data
+    assert database.find_in_table(db, 't', [5, 0]) is None
+    assert sorted(tuple(record[0]) for record in database.select_range(db, 't', None, None)) == sorted(expected)
+    database.close_database(db)
+
+
+def test_wal_replay_is_idempotent(db):
+    database.create_table(db, 't', ['x'])
+    wal = database.open_database(db, 'op')
+    # Операции применены, но журнал не усечен контрольной точкой до сбоя
+    wal.append_many([(OP_INSERT, 't', [i], i) for i in range(10)] + [(OP_DELETE, 't', [2], None)])
+    database.insert_many(db, 't', [([i], i) for i in range(10)], log=False)
+    database.delete_from_table(db, 't', [2], log=False)
+    crash()
+
+    database.open_database(db)
+    crash()
+    database.open_database(db)
+    assert sorted(record[3] for record in database.select_from_table(db, 't')) == [i for i in range(10) if i != 2]
+    database.close_database(db)
+
+
+def test_replayed_tables_are_synced_before_the_log_is_truncated(db, monkeypatch):
+    database.create_table(db, 't', ['x'])
+    database.create_table(db, 'other', ['x'])
+    wal = database.open_database(db, 'op')
+    wal.append_many([(OP_INSERT, 't', [i], i) for i in range(5)])
+    crash()
+
+    synced = []
+    sync_tables = database._sync_tables
+
+    def spy(db_name, table_names):
+        synced.append((set(table_names), os.path.getsize(get_wal_path(db))))
+        return sync_tables(db_name, table_names)
+
+    monkeypatch.setattr(database, '_sync_tables', spy)
+    database.open_database(db)
+    # Журнал еще не усечен, когда файлы повторенной таблицы сбрасываются на диск
+    assert synced[0][0] == {'t'} and synced[0][1] > 0
+    assert os.path.getsize(get_wal_path(db)) == 0
+    database.close_database(db)
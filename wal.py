@@ -0,0 +1,229 @@
+import os
+import time
+import zlib
+import threading
+from .config import *
+from .serialization import create_cord_block, serialize_data, deserialize_data, BYTE_TO_PYTHON_TYPE
+
+# Расширение файла журнала упреждающей записи
+WAL_EXT = ".marw"
+# Коды операций журнала
+OP_INSERT = 1
+OP_DELETE = 2
+
+# Заголовок записи журнала: длина тела (4 байта) и CRC32 тела (4 байта)
+WAL_HEADER_SIZE = 8
+# Координаты и длина данных пишутся в журнал с наибольшей шириной, допустимой в таблицах
+WAL_CORD_SIZE = 8
+WAL_LEN_SIZE = 4
+# Режимы надежности: none - без fsync, batch - общий fsync для группы операций, op - fsync на каждую операцию
+DURABILITY_MODES = ('none', 'batch', 'op')
+
+def get_wal_path(db_name):
+    """Возвращает путь к журналу базы данных (рядом с файлом .marm)"""
+    return os.path.splitext(db_name)[0] + WAL_EXT
+
+def encode_operation(op, table_name, cords, data=None):
+    """Упаковывает операцию в запись журнала"""
+    table_bytes = table_name.encode('utf-8')
+    body = (op.to_bytes(1, 'big') +
+            len(table_bytes).to_bytes(2, 'big') + table_bytes +
+            len(cords).to_bytes(MAX_TABLES_IN_BD_B, 'big') +
+            create_cord_block(cords, WAL_CORD_SIZE))
+    if op == OP_INSERT:
+        body += serialize_data(data, WAL_LEN_SIZE)
+    return len(body).to_bytes(4, 'big') + zlib.crc32(body).to_bytes(4, 'big') + body
+
+def decode_operation(body):
+    """Распаковывает тело записи журнала в (операция, таблица, координаты, данные); у удаления данных нет"""
+    op = body[0]
+    offset = 1
+    name_len = int.from_bytes(body[offset:offset + 2], 'big')
+    offset += 2
+    table_name = body[offset:offset + name_len].decode('utf-8')
+    offset += name_len
+    cords_count = int.from_bytes(body[offset:offset + MAX_TABLES_IN_BD_B], 'big')
+    offset += MAX_TABLES_IN_BD_B
+
+    cords = []
+    for _ in range(cords_count):
+        cords.append(int.from_bytes(body[offset:offset + WAL_CORD_SIZE], 'big', signed=True))
+        offset += WAL_CORD_SIZE
+
+    data = None
+    if op == OP_INSERT:
+        data_type = BYTE_TO_PYTHON_TYPE[body[offset:offset + 1]]
+        data_len = int.from_bytes(body[offset + 1:offset + 1 + WAL_LEN_SIZE], 'big')
+        offset += 1 + WAL_LEN_SIZE
+        data = deserialize_data(body[offset:offset + data_len], data_type, WAL_LEN_SIZE)
+
+    return op, table_name, cords, data
+
+class WriteAheadLog:
+    """Журнал упреждающей записи базы данных с групповой фиксацией"""
+
+    def __init__(self, path, durability=WAL_DURABILITY, group_commit_delay=WAL_GROUP_COMMIT_DELAY):
+        """
+        :param path: Путь к файлу журнала
+        :param durability: Режим надежности: 'none', 'batch' или 'op'
+        :param group_commit_delay: Сколько лидер группы ждет другие операции перед fsync (режим 'batch')
+        """
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Неизвестный режим надежности: {durability}")
+
+        self.path = path
+        self.durability = durability
+        self.group_commit_delay = group_commit_delay
+        self.tables = set()     # Таблицы, измененные после последней контрольной точки
+        self.pending = 0        # Записанные в журнал, но еще не примененные операции
+
+        self._file = open(path, "ab")
+        self._cond = threading.Condition()
+        # Смещения логические: они не уменьшаются при усечении журнала
+        self._base = 0
+        self._written = self._file.tell()
+        self._synced = self._written
+        self._syncing = False
+
+    def tell(self):
+        """Возвращает логическое смещение конца журнала"""
+        with self._cond:
+            return self._base + self._written
+
+    def size(self):
+        """Возвращает размер файла журнала"""
+        with self._cond:
+            return self._written
+
+    def append(self, op, table_name, cords, data=None, pending=True):
+        """Добавляет операцию в журнал; возвращается, когда она надежна согласно режиму"""
+        return self.append_many([(op, table_name, cords, data)], pending)
+
+    def append_many(self, operations, pending=True):
+        """Добавляет пачку операций [(операция, таблица, координаты, данные)] одной записью в файл"""
+        payload = b''.join(encode_operation(*operation) for operation in operations)
+
+        with self._cond:
+            self._file.write(payload)
+            self._written += len(payload)
+            offset = self._base + self._written
+            self.tables.update(operation[1] for operation in operations)
+            if pending:
+                self.pending += len(operations)
+
+            if self.durability == 'none':
+                self._file.flush()
+                return offset
+            if self.durability == 'op':
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._synced = self._written
+                return offset
+
+        self._wait_durable(offset)
+        return offset
+
+    def _wait_durable(self, offset):
+        """Групповая фиксация: один поток делает fsync за все операции, записанные к этому моменту"""
+        with self._cond:
+            while self._base + self._synced < offset:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+
+                # Этот поток становится лидером группы
+                self._syncing = True
+                try:
+                    if self.group_commit_delay:
+                        # Пока лидер ждет, другие потоки дописывают свои операции в ту же группу
+                        self._cond.wait(self.group_commit_delay)
+                    self._file.flush()
+                    target = self._written
+                    fd = self._file.fileno()
+
+                    self._cond.release()
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        self._cond.acquire()
+                    self._synced = max(self._synced, target)
+                finally:
+                    self._syncing = False
+                    self._cond.notify_all()
+
+    def mark_applied(self, count=1):
+        """Отмечает операции как примененные к файлам записей"""
+        with self._cond:
+            self.pending = max(self.pending - count, 0)
+
+    def replay(self, apply):
+        """Передает apply(операция, таблица, координаты, данные) все целые записи журнала; возвращает их количество"""
+        with self._cond:
+            self._file.flush()
+
+        with open(self.path, "rb") as f:
+            raw = f.read()
+
+        count = 0
+        offset = 0
+        while offset + WAL_HEADER_SIZE <= len(raw):
+            body_len = int.from_bytes(raw[offset:offset + 4], 'big')
+            crc = int.from_bytes(raw[offset + 4:offset + WAL_HEADER_SIZE], 'big')
+            body = raw[offset + WAL_HEADER_SIZE:offset + WAL_HEADER_SIZE + body_len]
+            # Оборванная или поврежденная запись - конец журнала после сбоя
+            if len(body) < body_len or zlib.crc32(body) != crc:
+                break
+            apply(*decode_operation(body))
+            offset += WAL_HEADER_SIZE + body_len
+            count += 1
+
+        if offset < len(raw):
+            with self._cond:
+                self._file.truncate(offset)
+                self._written = self._synced = offset
+
+        return count
+
+    def checkpoint(self, upto=None):
+        """Удаляет из журнала записи до логического смещения upto (все записи, если None)"""
+        with self._cond:
+            if upto is None:
+                if self.pending:
+                    return False
+                upto = self._base + self._written
+
+            self._file.flush()
+            keep_from = min(max(upto - self._base, 0), self._written)
+            if keep_from == 0:
+                return True
+
+            if keep_from == self._written:
+                self._file.truncate(0)
+            else:
+                # Хвост журнала переносится в новый файл
+                with open(self.path, "rb") as f:
+                    f.seek(keep_from)
+                    tail = f.read(self._written - keep_from)
+                temp_path = self.path + ".tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._file.close()
+                os.replace(temp_path, self.path)
+                self._file = open(self.path, "ab")
+
+            self._base += keep_from
+            self._written -= keep_from
+            self._synced = max(self._synced - keep_from, 0)
+            if self._written == 0:
+                self.tables.clear()
+            return True
+
+    def close(self):
+        """Закрывает журнал"""
+        with self._cond:
+            self._file.flush()
+            if self.durability != 'none':
+                os.fsync(self._file.fileno())
+            self._file.close()